@@ -5,6 +5,19 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+Под ASGI AJAX-представления корзины, избранного, подсказок и быстрого
+просмотра подключаются в async-версии (product/async_views.py). Запуск
+нескольких процессов — только с общим кешем (см. CACHES в settings.py):
+
+    SHOP_REDIS_URL=redis://127.0.0.1:6379/1 \
+        uvicorn Shop.asgi:application --workers 4 --loop uvloop --http httptools
+
+Без SHOP_REDIS_URL кеш локален для процесса — запускайте один процесс:
+
+    uvicorn Shop.asgi:application --workers 1 --loop uvloop --http httptools
+
+Сравнение с WSGI на одном процессе: manage.py bench_cart_clicks.
 """
 
 import os
@@ -12,5 +25,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Shop.settings')
+os.environ.setdefault('SHOP_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -65,10 +65,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'product.context_processors.navbar_context',
-                'product.context_processors.cart_and_wishlist',
-                'product.context_processors.top_categories',
-                'product.context_processors.cart_context',
+                'product.context_processors.shopper',
             ],
         },
     },
@@ -86,6 +83,31 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+#
+# В кеше лежат не только копии данных, но и общее состояние: версии тегов страниц
+# и фрагментов, итоги корзин, наборы избранного, фасеты, поколение подсказок.
+# При нескольких процессах (uvicorn/gunicorn --workers N) кеш обязан быть общим,
+# иначе процессы расходятся: сброс тега в одном не виден другим, счётчики корзины
+# и избранное отстают на часы. Локальный LocMemCache — только для одного процесса
+# (разработка, тесты). Общий кеш: SHOP_REDIS_URL=redis://127.0.0.1:6379/1 (нужен пакет redis).
+
+if os.environ.get('SHOP_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['SHOP_REDIS_URL'],
+            'KEY_PREFIX': 'shop',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -124,6 +146,12 @@ STATICFILES_DIRS = [STATIC_DIR]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Async-версии AJAX-представлений (product/async_views.py); включает Shop/asgi.py
+ASYNC_VIEWS = os.environ.get('SHOP_ASYNC_VIEWS') == '1'
+
+# Процессы для генерации вариантов картинок (product/renditions.py); 0 — в процессе запроса
+RENDITION_WORKERS = 2
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
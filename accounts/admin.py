@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Profile, CartItem, Order, OrderItem
+from .models import Profile, CartItem, GuestCart, Order, OrderItem
 from product.models import Product
 
 
@@ -28,6 +28,20 @@ class CartItemAdmin(admin.ModelAdmin):
     search_fields = ("profile__user__username", "product__name")
 
 
+# ----------------------
+# GuestCart
+# ----------------------
+@admin.register(GuestCart)
+class GuestCartAdmin(admin.ModelAdmin):
+    list_display = ("token", "line_count", "updated_at")
+    readonly_fields = ("token", "items", "updated_at")
+
+    def line_count(self, obj):
+        return len(obj.items)
+
+    line_count.short_description = "Позиций"
+
+
 # ----------------------
 # Order
 # ----------------------
@@ -43,8 +57,9 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ("id", "profile", "created_at", "status", "payment_method", "is_processed", "total_order_price")
     list_filter = ("status", "payment_method", "is_processed", "created_at")
     search_fields = ("profile__user__username",)
+    list_select_related = ("profile__user",)
     inlines = [OrderItemInline]
 
     def total_order_price(self, obj):
-        return sum(item.total_price for item in obj.items.all())
+        return obj.total
     total_order_price.short_description = "Общая сумма"
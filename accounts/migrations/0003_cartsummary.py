@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_cart_summaries(apps, schema_editor):
+    CartItem = apps.get_model('accounts', 'CartItem')
+    CartSummary = apps.get_model('accounts', 'CartSummary')
+    summaries = {}
+    for item in CartItem.objects.select_related('product').iterator():
+        summary = summaries.setdefault(item.profile_id, CartSummary(profile_id=item.profile_id))
+        summary.item_count += item.quantity
+        summary.line_count += 1
+        summary.total += item.quantity * item.product.price
+    CartSummary.objects.bulk_create(summaries.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_remove_order_products_order_full_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartSummary',
+            fields=[
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cart_summary', serialize=False, to='accounts.profile')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='Товаров')),
+                ('line_count', models.PositiveIntegerField(default=0, verbose_name='Позиций')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма')),
+            ],
+            options={
+                'verbose_name': 'Итоги корзины',
+                'verbose_name_plural': 'Итоги корзин',
+            },
+        ),
+        migrations.RunPython(fill_cart_summaries, migrations.RunPython.noop),
+    ]
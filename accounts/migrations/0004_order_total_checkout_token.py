@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:50
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_order_totals(apps, schema_editor):
+    Order = apps.get_model('accounts', 'Order')
+    OrderItem = apps.get_model('accounts', 'OrderItem')
+    money = DecimalField(max_digits=12, decimal_places=2)
+    totals = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id').annotate(
+        total=Sum(F('price') * F('quantity'), output_field=money)
+    ).values('total')
+    Order.objects.update(total=Coalesce(Subquery(totals), Value(0), output_field=money))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_cartsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='checkout_token',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма заказа'),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
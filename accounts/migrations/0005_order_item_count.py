@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:52
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_item_counts(apps, schema_editor):
+    Order = apps.get_model('accounts', 'Order')
+    OrderItem = apps.get_model('accounts', 'OrderItem')
+    counts = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id').annotate(
+        n=Sum('quantity')
+    ).values('n')
+    Order.objects.update(item_count=Coalesce(Subquery(counts), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_order_total_checkout_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Товаров в заказе'),
+        ),
+        migrations.RunPython(fill_item_counts, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,15 @@
-from django.db import models
+import time
+import uuid
+from decimal import Decimal
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from product.models import Product
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 
 
@@ -36,6 +44,212 @@ class CartItem(models.Model):
         return f"{self.product.name} x {self.quantity}"
 
 
+class CartSummary(models.Model):
+    """Итоги корзины профиля; обновляются атомарно при каждом изменении CartItem"""
+    profile = models.OneToOneField(Profile, on_delete=models.CASCADE, primary_key=True, related_name='cart_summary')
+    item_count = models.PositiveIntegerField("Товаров", default=0)
+    line_count = models.PositiveIntegerField("Позиций", default=0)
+    total = models.DecimalField("Сумма", max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Итоги корзины"
+        verbose_name_plural = "Итоги корзин"
+
+    def __str__(self):
+        return f"{self.profile}: {self.item_count} шт. на {self.total}"
+
+    @staticmethod
+    def generation_key(profile_id):
+        return f'cart:summary:generation:{profile_id}'
+
+    @classmethod
+    def cache_key(cls, profile_id):
+        """
+        Ключ итогов с поколением профиля. Изменение корзины удаляет поколение, а не сами
+        итоги: запрос, прочитавший базу до изменения, кладёт их под старое поколение,
+        которое больше никто не читает.
+        """
+        generation_key = cls.generation_key(profile_id)
+        generation = cache.get(generation_key)
+        if generation is None:
+            # поколение из времени, чтобы после удаления ключа не вернуться к старому
+            generation = time.time_ns()
+            cache.add(generation_key, generation, None)
+        return f'cart:summary:{profile_id}:{generation}'
+
+    @classmethod
+    def invalidate(cls, *profile_ids):
+        cache.delete_many([cls.generation_key(pk) for pk in profile_ids])
+
+    @classmethod
+    def for_profile(cls, profile_id):
+        """Итоги корзины из кеша, при промахе — одна строка из базы"""
+        key = cls.cache_key(profile_id)
+        summary = cache.get(key)
+        if summary is None:
+            summary = cls.objects.filter(profile_id=profile_id).first()
+            if summary is None:
+                # строки ещё нет — сначала создаём, чтобы пересчёт был одним UPDATE
+                cls.objects.bulk_create([cls(profile_id=profile_id)], ignore_conflicts=True)
+                cls.recompute([profile_id], create=False)
+                summary = cls.objects.get(profile_id=profile_id)
+            cache.set(key, summary, 60 * 60)
+        return summary
+
+    @classmethod
+    def apply_delta(cls, profile_id, items=0, lines=0, total=Decimal('0')):
+        updated = cls.objects.filter(profile_id=profile_id).update(
+            item_count=F('item_count') + items,
+            line_count=F('line_count') + lines,
+            total=F('total') + total,
+        )
+        if not updated:
+            cls.recompute([profile_id])
+        cls.invalidate(profile_id)
+
+    @classmethod
+    def recompute(cls, profile_ids, create=True):
+        """Пересчитывает итоги корзин указанных профилей одним UPDATE"""
+        profile_ids = list(profile_ids)
+        if not profile_ids:
+            return
+        lines = CartItem.objects.filter(profile_id=OuterRef('profile_id')).order_by().values('profile_id')
+        money = DecimalField(max_digits=12, decimal_places=2)
+        totals = dict(
+            item_count=Coalesce(Subquery(lines.annotate(n=Sum('quantity')).values('n')), Value(0)),
+            line_count=Coalesce(Subquery(lines.annotate(n=Count('id')).values('n')), Value(0)),
+            total=Coalesce(
+                Subquery(lines.annotate(n=Sum(F('quantity') * F('product__price'), output_field=money)).values('n')),
+                Value(Decimal('0')),
+                output_field=money,
+            ),
+        )
+        updated = cls.objects.filter(profile_id__in=profile_ids).update(**totals)
+        if create and updated < len(set(profile_ids)):
+            # у части профилей строки итогов ещё нет
+            cls.objects.bulk_create([cls(profile_id=pk) for pk in profile_ids], ignore_conflicts=True)
+            cls.objects.filter(profile_id__in=profile_ids).update(**totals)
+        cls.invalidate(*profile_ids)
+
+
+@receiver(post_init, sender=CartItem)
+def remember_cart_line(sender, instance, **kwargs):
+    instance._summary_line = (instance.product_id, instance.quantity) if instance.pk else None
+
+
+@receiver(post_save, sender=CartItem)
+def update_cart_summary(sender, instance, created, **kwargs):
+    line = getattr(instance, '_summary_line', None)
+    if created or line is None:
+        CartSummary.apply_delta(
+            instance.profile_id, items=instance.quantity, lines=1, total=instance.quantity * instance.product.price
+        )
+    elif line[0] != instance.product_id:
+        CartSummary.recompute([instance.profile_id])
+    elif line[1] != instance.quantity:
+        delta = instance.quantity - line[1]
+        CartSummary.apply_delta(instance.profile_id, items=delta, total=delta * instance.product.price)
+    instance._summary_line = (instance.product_id, instance.quantity)
+
+
+@receiver(post_delete, sender=CartItem)
+def shrink_cart_summary(sender, instance, **kwargs):
+    # цену товара при каскадном удалении не читаем — пересчитываем корзину целиком;
+    # при удалении профиля его строка итогов уже удалена и не должна появиться снова
+    CartSummary.recompute([instance.profile_id], create=False)
+
+
+@receiver(post_init, sender=Product)
+def remember_product_price(sender, instance, **kwargs):
+    instance._cart_price = instance.__dict__.get('price')
+
+
+@receiver(post_save, sender=Product)
+def reprice_carts(sender, instance, created, **kwargs):
+    if created or instance._cart_price == instance.price:
+        return
+    instance._cart_price = instance.price
+    profile_ids = CartItem.objects.filter(product_id=instance.pk).values_list('profile_id', flat=True)
+    CartSummary.recompute(set(profile_ids))
+
+
+class GuestCart(models.Model):
+    """
+    Корзина гостя: только id товаров и количества, ключ — токен из подписанной куки.
+    Названия и цены читаются при показе, поэтому не устаревают.
+    """
+    COOKIE = 'guest_cart'
+    COOKIE_SALT = 'accounts.guestcart'
+    COOKIE_AGE = 30 * 24 * 60 * 60
+
+    token = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    items = models.JSONField("Товары и количества", default=dict)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Корзина гостя"
+        verbose_name_plural = "Корзины гостей"
+
+    def __str__(self):
+        return str(self.token)
+
+    @classmethod
+    def token_from(cls, request):
+        token = request.get_signed_cookie(cls.COOKIE, default=None, salt=cls.COOKIE_SALT)
+        try:
+            return uuid.UUID(token) if token else None
+        except ValueError:
+            return None
+
+    @classmethod
+    def remember(cls, response, token):
+        response.set_signed_cookie(
+            cls.COOKIE, str(token), salt=cls.COOKIE_SALT, max_age=cls.COOKIE_AGE, httponly=True, samesite='Lax',
+        )
+
+    @classmethod
+    def items_for(cls, token):
+        """{id товара: количество}; без лишних запросов, если токена нет"""
+        if token is None:
+            return {}
+        items = cls.objects.filter(token=token).values_list('items', flat=True).first() or {}
+        return {int(product_id): quantity for product_id, quantity in items.items()}
+
+    @classmethod
+    def add(cls, token, product_id, quantity):
+        """Добавляет товар; возвращает (токен, {id товара: количество})"""
+        with transaction.atomic():
+            cart = cls.objects.select_for_update().filter(token=token).first() if token else None
+            if cart is None:
+                cart = cls(token=token) if token else cls()
+            key = str(product_id)
+            cart.items[key] = cart.items.get(key, 0) + quantity
+            cart.save()
+        return cart.token, {int(product_id): quantity for product_id, quantity in cart.items.items()}
+
+    @classmethod
+    def merge(cls, token, profile):
+        """Переносит корзину гостя в CartItem профиля (прибавляя к имеющимся позициям) и удаляет её"""
+        from product.cart import increment_many
+
+        items = cls.items_for(token)
+        with transaction.atomic():
+            if items:
+                # товары, удалённые из каталога после добавления в корзину, пропускаются
+                increment_many(profile.pk, items)
+            if token is not None:
+                cls.objects.filter(token=token).delete()
+
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    token = GuestCart.token_from(request) if request is not None else None
+    if token is None:
+        return
+    profile, _ = Profile.objects.get_or_create(user=user)
+    GuestCart.merge(token, profile)
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('new', 'Новый'),
@@ -62,13 +276,42 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_processed = models.BooleanField(default=False)
     status = models.CharField("Статус", max_length=20, choices=STATUS_CHOICES, default='new')
+    total = models.DecimalField("Сумма заказа", max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField("Товаров в заказе", default=0)
+    # токен формы оформления: повторная отправка той же формы не создаёт второй заказ
+    checkout_token = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        # списки заказов идут курсором по (-created_at, -id): все, по статусу и «мои заказы»
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='order_created_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='order_status_created_idx'),
+            models.Index(fields=['profile', '-created_at', '-id'], name='order_profile_created_idx'),
+        ]
 
     def __str__(self):
         return f"Заказ #{self.id} ({self.profile.user.username})"
 
     def total_price(self):
-        """Сумма всех товаров в заказе"""
-        return sum(item.total_price for item in self.items.all())
+        """Сумма всех товаров в заказе (хранится в total)"""
+        return self.total
+
+    @classmethod
+    def recompute_totals(cls, order_ids):
+        """Пересчитывает total и item_count заказов одним UPDATE"""
+        order_ids = list(order_ids)
+        if not order_ids:
+            return
+        items = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+        money = DecimalField(max_digits=12, decimal_places=2)
+        cls.objects.filter(pk__in=order_ids).update(
+            total=Coalesce(
+                Subquery(items.annotate(n=Sum(F('price') * F('quantity'), output_field=money)).values('n')),
+                Value(Decimal('0')),
+                output_field=money,
+            ),
+            item_count=Coalesce(Subquery(items.annotate(n=Sum('quantity')).values('n')), Value(0)),
+        )
 
 
 class OrderItem(models.Model):
@@ -84,3 +327,9 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.name} x {self.quantity}"
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals(sender, instance, **kwargs):
+    Order.recompute_totals([instance.order_id])
@@ -1,3 +1,175 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+
+from product.models import Product
+from product.querybudget import QueryBudgetMixin
+from product.tests import seed_shop
+
+from . import urls as accounts_urls
+from .models import CartItem, CartSummary, GuestCart, Order, OrderItem
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+        self.profile = self.user.profile
+        self.phone = Product.objects.create(name="Phone", slug="phone", description="", price=100)
+        self.case = Product.objects.create(name="Case", slug="case", description="", price=15)
+
+    def assertSummary(self, items, lines, total):
+        summary = CartSummary.for_profile(self.profile.pk)
+        self.assertEqual((summary.item_count, summary.line_count, summary.total), (items, lines, Decimal(total)))
+
+    def test_follows_cart_changes(self):
+        item = CartItem.objects.create(profile=self.profile, product=self.phone, quantity=2)
+        CartItem.objects.create(profile=self.profile, product=self.case, quantity=1)
+        self.assertSummary(3, 2, "215")
+
+        item.quantity = 5
+        item.save()
+        self.assertSummary(6, 2, "515")
+
+        item.delete()
+        self.assertSummary(1, 1, "15")
+
+    def test_price_change_reprices_carts(self):
+        CartItem.objects.create(profile=self.profile, product=self.phone, quantity=2)
+        self.assertSummary(2, 1, "200")
+
+        self.phone.price = Decimal("80")
+        self.phone.save()
+        self.assertSummary(2, 1, "160")
+
+    def test_deleting_user_with_cart(self):
+        CartItem.objects.create(profile=self.profile, product=self.phone, quantity=1)
+        self.user.delete()
+        self.assertFalse(CartSummary.objects.exists())
+
+    def test_cached_read_runs_no_queries(self):
+        CartItem.objects.create(profile=self.profile, product=self.phone, quantity=1)
+        CartSummary.for_profile(self.profile.pk)
+        with self.assertNumQueries(0):
+            CartSummary.for_profile(self.profile.pk)
+
+    def test_stale_fill_does_not_outlive_change(self):
+        CartItem.objects.create(profile=self.profile, product=self.phone, quantity=1)
+        CartSummary.invalidate(self.profile.pk)
+        # промах кеша: ключ взят и строка прочитана до параллельного изменения корзины...
+        key = CartSummary.cache_key(self.profile.pk)
+        stale = CartSummary.objects.get(profile=self.profile)
+        CartItem.objects.create(profile=self.profile, product=self.case, quantity=2)
+        # ...а записана в кеш после него
+        cache.set(key, stale)
+        self.assertSummary(3, 2, "130")
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+        self.order = Order.objects.create(profile=self.user.profile, full_name="Buyer", phone="123")
+        self.phone = Product.objects.create(name="Phone", slug="phone", description="", price=100)
+
+    def test_follows_order_items(self):
+        item = OrderItem.objects.create(order=self.order, product=self.phone, name="Phone", price=100, quantity=2)
+        OrderItem.objects.create(order=self.order, product=self.phone, name="Phone", price=50, quantity=1)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total, self.order.item_count), (Decimal("250"), 3))
+
+        item.delete()
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total, self.order.item_count), (Decimal("50"), 1))
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.phone = Product.objects.create(
+            name="Phone", slug="phone", description="", price=100, image="products/phone.png"
+        )
+        self.case = Product.objects.create(name="Case", slug="case", description="", price=10, image="products/case.png")
+        self.user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+
+    def add(self, product, quantity=1):
+        response = self.client.post(reverse("add_to_cart", args=[product.pk]), {"quantity": quantity})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["cart_qty"]
+
+    def test_stores_only_ids_and_quantities(self):
+        self.assertEqual(self.add(self.phone), 1)
+        self.assertEqual(self.add(self.phone, 2), 3)
+        self.assertEqual(self.add(self.case), 4)
+        self.assertEqual(GuestCart.objects.get().items, {str(self.phone.pk): 3, str(self.case.pk): 1})
+        self.assertNotIn("cart", self.client.session)
+
+    def test_prices_are_read_at_render_time(self):
+        self.add(self.phone, 2)
+        self.phone.price = Decimal("80")
+        self.phone.save()
+        response = self.client.get(reverse("home"))
+        self.assertContains(response, '<div class="qty" id="cart-qty">2</div>', html=True)
+        self.assertEqual(response.context["cart_total"](), Decimal("160"))
+
+    def test_login_merges_into_profile_cart(self):
+        CartItem.objects.create(profile=self.user.profile, product=self.phone, quantity=1)
+        self.add(self.phone, 2)
+        self.add(self.case)
+
+        self.client.post(reverse("login"), {"username": "buyer", "password": "secret"})
+
+        lines = dict(CartItem.objects.filter(profile=self.user.profile).values_list("product__slug", "quantity"))
+        self.assertEqual(lines, {"phone": 3, "case": 1})
+        summary = CartSummary.for_profile(self.user.profile.pk)
+        self.assertEqual((summary.item_count, summary.total), (4, Decimal("310")))
+        self.assertFalse(GuestCart.objects.exists())
+
+    def test_merge_counts_popularity(self):
+        CartItem.objects.create(profile=self.user.profile, product=self.phone, quantity=2)
+        self.add(self.phone)
+        self.add(self.case, 3)
+        # гостевая корзина в популярности не участвует — до входа счётчики прежние
+        self.assertEqual(Product.objects.get(pk=self.case.pk).popularity, 0)
+
+        self.client.post(reverse("login"), {"username": "buyer", "password": "secret"})
+
+        self.assertEqual(CartItem.objects.get(profile=self.user.profile, product=self.phone).quantity, 3)
+        popularity = dict(Product.objects.values_list("slug", "popularity"))
+        self.assertEqual(popularity, {"phone": 3, "case": 3})
+
+
+class AccountViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Каждое представление accounts/urls.py: бюджет запросов и без N+1"""
+    # вход: пароль, сессия, last_login и перенос гостевой корзины одним upsert
+    QUERY_BUDGETS = {
+        'register': 7,
+        'login': 12,
+        'logout': 4,
+        'profile_detail': 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products, cls.buyer, cls.staff = seed_shop()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_every_view_has_budget(self):
+        names = {pattern.name for pattern in accounts_urls.urlpatterns}
+        self.assertEqual(names - self.QUERY_BUDGETS.keys(), set())
 
-# Create your tests here.
+    def test_registration_and_login(self):
+        self.request_within_budget("get", "register")
+        self.request_within_budget("post", "register", data={
+            "username": "new", "email": "new@example.com", "password": "secret", "password_confirm": "secret",
+        })
+        self.request_within_budget("get", "logout")
+        self.request_within_budget("get", "login")
+        # вход с переносом гостевой корзины
+        self.client.post(reverse("add_to_cart", args=[self.products[0].pk]), {"quantity": 1})
+        self.request_within_budget("post", "login", data={"username": "buyer", "password": "pass"})
+        self.request_within_budget("get", "profile_detail", args=[self.buyer.profile.pk])
@@ -6,4 +6,4 @@ class ProductConfig(AppConfig):
     name = 'product'
 
     def ready(self):
-        pass
+        from . import signals  # noqa: F401
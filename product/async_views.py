@@ -0,0 +1,143 @@
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+from django.views import View
+
+from accounts.models import CartSummary, GuestCart, Profile
+
+from . import cart, wishlist
+from .cart import apply_changes, changes_response_data, parse_changes
+from .conditional import conditional_view, quick_view_etag, quick_view_last_modified, suggestions_etag
+from .models import Product
+from .pagecache import add_tags, cached_page
+from .suggestions import index as suggestions_index
+from .views import (
+    added_to_cart_response, cart_action, cart_quantity, quick_view_response, suggestion_params,
+    updated_cart_response, wishlist_response,
+)
+
+
+# ----------------------
+# Пользователь и декораторы
+# ----------------------
+async def get_user(request):
+    """
+    Авторизованный пользователь или None. В Django 4.2 сессия и request.user
+    синхронные — читаются в потоке, как и транзакции с сигналами ниже.
+    """
+    return await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+
+
+def login_required(view_func):
+    @wraps(view_func)
+    async def wrapped(request, *args, **kwargs):
+        if await get_user(request) is None:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+
+    return wrapped
+
+
+def require_POST(view_func):
+    @wraps(view_func)
+    async def wrapped(request, *args, **kwargs):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        return await view_func(request, *args, **kwargs)
+
+    return wrapped
+
+
+async def _get_product(queryset, **lookup):
+    product = await queryset.filter(**lookup).afirst()
+    if product is None:
+        raise Http404("Товар не найден")
+    return product
+
+
+# ----------------------
+# Корзина
+# ----------------------
+@require_POST
+async def add_to_cart(request, product_id):
+    # цена нужна сигналу итогов корзины
+    product = await _get_product(Product.objects.only('id', 'name', 'price'), id=product_id)
+    quantity = cart_quantity(request)
+
+    user = await get_user(request)
+    if user is None:
+        token, items = await sync_to_async(GuestCart.add)(GuestCart.token_from(request), product.pk, quantity)
+        return added_to_cart_response(product, sum(items.values()), token)
+
+    profile, _ = await Profile.objects.aget_or_create(user=user)
+    # upsert с итогами корзины и популярностью — одна транзакция в потоке
+    await sync_to_async(cart.increment)(profile.pk, product, quantity)
+    summary = await sync_to_async(CartSummary.for_profile)(profile.pk)
+    return added_to_cart_response(product, summary.item_count)
+
+
+@require_POST
+@login_required
+async def update_cart(request, product_id):
+    action = cart_action(request)
+    if action not in ('increase', 'decrease'):
+        return JsonResponse({'status': 'error', 'message': 'Unknown action'}, status=400)
+
+    user = await get_user(request)
+    profile, _ = await Profile.objects.aget_or_create(user=user)
+    product = await _get_product(Product.objects.only('id', 'price'), pk=product_id)
+    change = cart.increment if action == 'increase' else cart.decrement
+    quantity = await sync_to_async(change)(profile.pk, product)
+
+    summary = await sync_to_async(CartSummary.for_profile)(profile.pk)
+    return updated_cart_response(quantity, product.price, summary.total)
+
+
+@require_POST
+@login_required
+async def update_cart_batch(request):
+    try:
+        changes = parse_changes(json.loads(request.body.decode('utf-8') or '{}'))
+    except (ValueError, UnicodeDecodeError) as exc:
+        return JsonResponse({'status': 'error', 'message': str(exc)}, status=400)
+    user = await get_user(request)
+    profile, _ = await Profile.objects.aget_or_create(user=user)
+    # одна транзакция с блокировкой строк — целиком в потоке
+    lines, summary = await sync_to_async(apply_changes)(profile, changes)
+    return JsonResponse(changes_response_data(lines, summary))
+
+
+# ----------------------
+# Избранное
+# ----------------------
+class WishlistAddView(View):
+    async def post(self, request, product_id):
+        user = await get_user(request)
+        if user is None:
+            return redirect_to_login(request.get_full_path())
+        profile, _ = await Profile.objects.aget_or_create(user=user)
+        product = await _get_product(Product.objects.only('id'), id=product_id)
+
+        added, ids = await sync_to_async(wishlist.toggle)(profile.pk, product.pk)
+        return wishlist_response(added, ids)
+
+
+# ----------------------
+# Каталог
+# ----------------------
+@conditional_view(suggestions_etag, vary_on_user=False)
+async def search_suggestions(request):
+    # индекс в памяти может перестраиваться из базы при смене поколения
+    suggestions = await sync_to_async(suggestions_index.lookup)(*suggestion_params(request), limit=5)
+    return JsonResponse({'suggestions': suggestions})
+
+
+@conditional_view(quick_view_etag, quick_view_last_modified, vary_on_user=False)
+@cached_page(vary_on_user=False)
+async def quick_view(request, pk):
+    product = await _get_product(Product.objects.select_related('category'), pk=pk)
+    add_tags(request, f'product:{product.pk}')
+    return quick_view_response(product)
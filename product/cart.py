@@ -0,0 +1,239 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import CartItem, CartSummary
+
+from .models import Product
+from .popularity import adjust_popularity, adjust_popularity_many
+
+OPERATIONS = ('set', 'increase', 'decrease', 'remove')
+MAX_CHANGES = 200
+
+
+class CartChangeError(ValueError):
+    pass
+
+
+def _positive_int(value, field, minimum):
+    if isinstance(value, bool):
+        raise CartChangeError(f"{field}: ожидается целое число")
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise CartChangeError(f"{field}: ожидается целое число")
+    if number < minimum:
+        raise CartChangeError(f"{field}: не меньше {minimum}")
+    return number
+
+
+def parse_changes(payload):
+    """
+    [(id товара, операция, количество)] из {"changes": [{"product": 1, "op": "set", "quantity": 3}, ...]}.
+    set — задать количество (0 удаляет позицию), increase/decrease — сдвинуть
+    на quantity (по умолчанию 1), remove — удалить.
+    """
+    changes = payload.get('changes') if isinstance(payload, dict) else None
+    if not isinstance(changes, list) or not changes:
+        raise CartChangeError("changes: ожидается непустой список")
+    if len(changes) > MAX_CHANGES:
+        raise CartChangeError(f"changes: не больше {MAX_CHANGES} изменений")
+
+    parsed = []
+    for change in changes:
+        if not isinstance(change, dict):
+            raise CartChangeError("changes: ожидаются объекты")
+        op = change.get('op')
+        if op not in OPERATIONS:
+            raise CartChangeError(f"op: одно из {', '.join(OPERATIONS)}")
+        product_id = _positive_int(change.get('product'), 'product', 1)
+        if op == 'remove':
+            quantity = 0
+        elif op == 'set':
+            quantity = _positive_int(change.get('quantity'), 'quantity', 0)
+        else:
+            quantity = _positive_int(change.get('quantity', 1), 'quantity', 1)
+        parsed.append((product_id, op, quantity))
+    return parsed
+
+
+def apply_changes(profile, changes):
+    """
+    Применяет изменения корзины в одной транзакции: строки корзины читаются
+    одним запросом с блокировкой, новые создаются одним INSERT, изменённые —
+    одним UPDATE, удалённые — одним DELETE. Изменения одного товара
+    применяются по порядку. Возвращает ({id товара: CartItem или None}, итоги корзины).
+    """
+    product_ids = {product_id for product_id, _, _ in changes}
+    with transaction.atomic():
+        existing = {
+            line.product_id: line
+            for line in CartItem.objects.select_for_update().filter(profile=profile, product_id__in=product_ids)
+        }
+        prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'price'))
+
+        quantities = {product_id: line.quantity for product_id, line in existing.items()}
+        for product_id, op, quantity in changes:
+            current = quantities.get(product_id, 0)
+            if op == 'increase':
+                current += quantity
+            elif op == 'decrease':
+                current = max(current - quantity, 0)
+            else:
+                current = quantity
+            quantities[product_id] = current
+
+        created, updated, deleted, lines, deltas = [], [], [], {}, {}
+        for product_id, quantity in quantities.items():
+            line = existing.get(product_id)
+            if product_id not in prices or quantity == 0:
+                # товара нет в каталоге или позиция удалена
+                if line is not None:
+                    deleted.append(line.pk)
+                    deltas[product_id] = -line.quantity
+                lines[product_id] = None
+                continue
+            if line is None:
+                line = CartItem(profile=profile, product_id=product_id, quantity=quantity)
+                created.append(line)
+                deltas[product_id] = quantity
+            elif line.quantity != quantity:
+                deltas[product_id] = quantity - line.quantity
+                line.quantity = quantity
+                updated.append(line)
+            line.unit_price = prices[product_id]
+            lines[product_id] = line
+
+        # без построчных сигналов: итоги корзины и популярность обновляются по разу на пачку
+        if created:
+            CartItem.objects.bulk_create(created)
+        if updated:
+            CartItem.objects.bulk_update(updated, ['quantity'])
+        if deleted:
+            delete_lines(deleted)
+        if deltas:
+            CartSummary.recompute([profile.pk])
+            adjust_popularity_many(deltas)
+    return lines, CartSummary.for_profile(profile.pk)
+
+
+def changes_response_data(lines, summary):
+    return {
+        'status': 'success',
+        'lines': [
+            {
+                'product': product_id,
+                'removed': line is None,
+                'quantity': line.quantity if line is not None else 0,
+                'item_total': f'{line.quantity * line.unit_price:.2f}' if line is not None else '0.00',
+            }
+            for product_id, line in lines.items()
+        ],
+        'cart_qty': summary.item_count,
+        'cart_total': f'{summary.total:.2f}',
+    }
+
+
+# ----------------------
+# Атомарные изменения одной позиции
+# ----------------------
+# Количество меняется одним SQL-оператором: параллельные клики не теряют прибавки
+# и не упираются в unique (profile, product). ON CONFLICT ... RETURNING есть
+# в SQLite 3.35+ и PostgreSQL.
+def _sql(template):
+    meta = CartItem._meta
+    return template.format(
+        table=connection.ops.quote_name(meta.db_table),
+        **{name: connection.ops.quote_name(meta.get_field(name).column) for name in (
+            'id', 'profile', 'product', 'quantity', 'added_at'
+        )},
+    )
+
+
+_UPSERT = (
+    'INSERT INTO {table} ({profile}, {product}, {quantity}, {added_at}) VALUES (%s, %s, %s, %s) '
+    'ON CONFLICT ({profile}, {product}) DO UPDATE SET {quantity} = {table}.{quantity} + excluded.{quantity} '
+    'RETURNING {quantity}'
+)
+_MERGE = (
+    'INSERT INTO {table} ({profile}, {product}, {quantity}, {added_at}) VALUES (%s, %s, %s, %s) '
+    'ON CONFLICT ({profile}, {product}) DO UPDATE SET {quantity} = {table}.{quantity} + excluded.{quantity}'
+)
+_DECREMENT = (
+    'UPDATE {table} SET {quantity} = {quantity} - %s '
+    'WHERE {profile} = %s AND {product} = %s AND {quantity} > %s RETURNING {quantity}'
+)
+_DELETE_LAST = (
+    'DELETE FROM {table} WHERE {profile} = %s AND {product} = %s AND {quantity} <= %s RETURNING {quantity}'
+)
+
+
+def delete_lines(line_ids):
+    """
+    Удаляет строки корзины одним DELETE без post_delete: итоги корзины
+    и популярность вызывающий код пересчитывает сам, один раз на пачку.
+    """
+    line_ids = list(line_ids)
+    if not line_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(line_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(_sql('DELETE FROM {table} WHERE {id} IN (%s)') % placeholders, line_ids)
+
+
+def _account(profile_id, product, delta, lines):
+    # сырой SQL не шлёт post_save/post_delete — итоги корзины и популярность сдвигаются здесь
+    CartSummary.apply_delta(profile_id, items=delta, lines=lines, total=delta * product.price)
+    adjust_popularity(product.pk, delta)
+
+
+def increment(profile_id, product, quantity=1):
+    """Прибавляет quantity к позиции (создаёт её при необходимости); возвращает новое количество"""
+    added_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(_sql(_UPSERT), [profile_id, product.pk, quantity, added_at])
+        new_quantity = cursor.fetchone()[0]
+        # строк с нулевым количеством не бывает, поэтому равенство значит «позиция создана»
+        _account(profile_id, product, quantity, 1 if new_quantity == quantity else 0)
+    return new_quantity
+
+
+def decrement(profile_id, product, quantity=1):
+    """
+    Убавляет позицию на quantity; позиция, дошедшая до нуля, удаляется.
+    Возвращает новое количество (0 — позиции больше нет).
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        while True:
+            cursor.execute(_sql(_DECREMENT), [quantity, profile_id, product.pk, quantity])
+            row = cursor.fetchone()
+            if row is not None:
+                _account(profile_id, product, -quantity, 0)
+                return row[0]
+            cursor.execute(_sql(_DELETE_LAST), [profile_id, product.pk, quantity])
+            row = cursor.fetchone()
+            if row is not None:
+                _account(profile_id, product, -row[0], -1)
+                return 0
+            # позиции нет — или её только что увеличили параллельно, тогда повторяем UPDATE
+            if not CartItem.objects.filter(profile_id=profile_id, product_id=product.pk).exists():
+                return 0
+
+
+def increment_many(profile_id, quantities):
+    """
+    Прибавляет {id товара: количество} к корзине тем же upsert, что и increment,
+    по строке на товар. Товары, которых уже нет в каталоге, пропускаются.
+    Возвращает {id товара: прибавленное количество}.
+    """
+    added_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    with transaction.atomic():
+        alive = Product.objects.filter(pk__in=quantities).values_list('pk', flat=True)
+        deltas = {product_id: quantities[product_id] for product_id in alive if quantities[product_id] > 0}
+        if deltas:
+            rows = [(profile_id, product_id, quantity, added_at) for product_id, quantity in deltas.items()]
+            with connection.cursor() as cursor:
+                cursor.executemany(_sql(_MERGE), rows)
+            # новые и изменённые строки перемешаны — итоги корзины пересчитываются целиком
+            CartSummary.recompute([profile_id])
+            adjust_popularity_many(deltas)
+    return deltas
@@ -0,0 +1,76 @@
+import uuid
+
+from django.db import IntegrityError, transaction
+
+from accounts.models import CartItem, CartSummary, Order, OrderItem
+
+from .cart import delete_lines
+
+
+class EmptyCartError(Exception):
+    pass
+
+
+def parse_checkout_token(value):
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def place_order(profile, full_name=None, phone=None, payment_method=None, token=None):
+    """
+    Оформляет заказ из корзины профиля в одной транзакции: блокирует строки корзины,
+    фиксирует цены, создаёт заказ и все его позиции одним INSERT и очищает корзину.
+    Возвращает (order, created); повтор с тем же token возвращает уже созданный заказ.
+    """
+    if payment_method not in dict(Order.PAYMENT_METHODS):
+        payment_method = 'bank'
+
+    try:
+        with transaction.atomic():
+            if token:
+                existing = Order.objects.filter(profile=profile, checkout_token=token).first()
+                if existing:
+                    return existing, False
+
+            lines = list(
+                CartItem.objects.select_for_update().select_related('product').filter(profile=profile).order_by('id')
+            )
+            if not lines:
+                raise EmptyCartError
+
+            items = [
+                OrderItem(
+                    product=line.product,
+                    name=line.product.name,
+                    price=line.product.price,
+                    quantity=line.quantity,
+                )
+                for line in lines
+            ]
+            order = Order.objects.create(
+                profile=profile,
+                full_name=full_name,
+                phone=phone,
+                payment_method=payment_method,
+                total=sum(item.total_price for item in items),
+                item_count=sum(item.quantity for item in items),
+                checkout_token=token,
+            )
+            for item in items:
+                item.order = order
+            OrderItem.objects.bulk_create(items)
+
+            # Удаление без построчных сигналов: количество переходит из корзины в заказ,
+            # поэтому популярность товаров не меняется, а итоги корзины пересчитываются один раз
+            delete_lines(line.pk for line in lines)
+            CartSummary.recompute([profile.pk])
+    except IntegrityError:
+        # параллельная отправка той же формы успела создать заказ с этим токеном
+        existing = Order.objects.filter(profile=profile, checkout_token=token).first() if token else None
+        if existing is None:
+            raise
+        return existing, False
+
+    return order, True
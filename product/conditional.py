@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from accounts.models import CartSummary, GuestCart
+
+from . import pagecache
+from .facets import catalog_version
+from .models import Product, ProductNeighbor
+from .shopper import get_shopper
+from .suggestions import GENERATION_KEY, normalize
+
+# Сколько браузер и прокси могут не переспрашивать общую страницу
+PUBLIC_MAX_AGE = 60
+
+
+def is_shared(request):
+    """Одинакова ли страница для всех: гость без корзины"""
+    return not request.user.is_authenticated and GuestCart.COOKIE not in request.COOKIES
+
+
+def _digest(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _shopper_parts(request):
+    """
+    Персональная часть ETag: кто смотрит, его корзина и избранное. Названия и цены
+    в корзине берутся из каталога, поэтому его версия тоже входит.
+    """
+    if is_shared(request):
+        return ()
+    state = get_shopper(request)
+    if state.profile is None:
+        items = GuestCart.items_for(GuestCart.token_from(request))
+        return (request.user.pk, catalog_version(), *sorted(items.items()))
+    # первое обращение создаёт строку итогов и меняет поколение — читаем его после
+    state.cart_summary
+    return (
+        request.user.pk, request.user.get_username(), catalog_version(),
+        CartSummary.cache_key(state.profile.pk), *state.wishlist_ids,
+    )
+
+
+def _product_row(request, **lookup):
+    # etag_func и last_modified_func вызываются по отдельности — строка читается один раз
+    row = getattr(request, '_validator_row', None)
+    if row is None:
+        row = request._validator_row = (
+            Product.objects.filter(**lookup).values('pk', 'updated_at', 'category_id').first() or {}
+        )
+    return row
+
+
+# ----------------------
+# Валидаторы
+# ----------------------
+def product_detail_etag(request, slug):
+    row = _product_row(request, slug=slug)
+    if not row:
+        return None
+    # те же теги, что страница регистрирует в кеше: товар, его категория (в ней и
+    # запасные похожие товары), названия категорий и все предрасчитанные соседи
+    neighbor_ids = ProductNeighbor.objects.filter(product_id=row['pk']).values_list('neighbor_id', flat=True)
+    tags = [f"product:{row['pk']}", f"category:{row['category_id']}", 'taxonomy']
+    tags += [f'product:{pk}' for pk in sorted(neighbor_ids)]
+    return _digest(
+        row['pk'], row['updated_at'].timestamp(), *sorted(pagecache.tag_versions(tags).items()),
+        *_shopper_parts(request),
+    )
+
+
+def quick_view_etag(request, pk):
+    row = _product_row(request, pk=pk)
+    if not row:
+        return None
+    return _digest(row['pk'], row['updated_at'].timestamp(), pagecache.tag_versions(['taxonomy'])['taxonomy'])
+
+
+def quick_view_last_modified(request, pk):
+    return _product_row(request, pk=pk).get('updated_at')
+
+
+def price_histogram_etag(request):
+    return _digest(catalog_version(), *sorted(request.GET.getlist('category')))
+
+
+def suggestions_etag(request):
+    return _digest(
+        catalog_version(), cache.get(GENERATION_KEY),
+        normalize(request.GET.get('q', '')), request.GET.get('category', ''),
+    )
+
+
+# ----------------------
+# Декоратор
+# ----------------------
+def _validators(request, etag_func, last_modified_func, args, kwargs):
+    etag = etag_func(request, *args, **kwargs)
+    last_modified = last_modified_func(request, *args, **kwargs) if last_modified_func else None
+    return (
+        quote_etag(etag) if etag is not None else None,
+        int(last_modified.timestamp()) if last_modified else None,
+    )
+
+
+def _finish(request, response, etag, last_modified, vary_on_user):
+    if request.method in ('GET', 'HEAD'):
+        if last_modified and not response.has_header('Last-Modified'):
+            response.headers['Last-Modified'] = http_date(last_modified)
+        if etag:
+            response.headers.setdefault('ETag', etag)
+    if response.status_code not in (200, 304):
+        return response
+    if vary_on_user and not is_shared(request):
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=PUBLIC_MAX_AGE)
+    if vary_on_user:
+        patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def conditional_view(etag_func, last_modified_func=None, vary_on_user=True):
+    """
+    Условный GET (304 Not Modified) и Cache-Control — как condition() из Django,
+    но и для async-представлений. Общие для всех ответы можно хранить браузеру
+    и прокси; персональные — только браузеру, с проверкой.
+    """
+    def decorator(view_func):
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapped(request, *args, **kwargs):
+                etag, last_modified = await sync_to_async(_validators)(
+                    request, etag_func, last_modified_func, args, kwargs
+                )
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = await view_func(request, *args, **kwargs)
+                return await sync_to_async(_finish)(request, response, etag, last_modified, vary_on_user)
+
+            return async_wrapped
+
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            etag, last_modified = _validators(request, etag_func, last_modified_func, args, kwargs)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+            return _finish(request, response, etag, last_modified, vary_on_user)
+
+        return wrapped
+
+    return decorator
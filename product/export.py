@@ -0,0 +1,167 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import Max
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import filepath_to_uri
+
+from .models import Product, ProductImage, ProductTombstone
+
+CHUNK_SIZE = 2000
+
+FIELDS = (
+    'id', 'slug', 'url', 'name', 'description', 'price', 'old_price', 'discount', 'status', 'is_available',
+    'category', 'category_slug', 'brand', 'image', 'images', 'updated_at', 'deleted',
+)
+
+_COLUMNS = (
+    'id', 'slug', 'name', 'description', 'price', 'old_price', 'discount', 'status', 'is_available',
+    'category__name', 'category__slug', 'brand__name', 'image', 'updated_at',
+)
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+def parse_since(value):
+    """Водяной знак ?since= (ISO 8601) или None"""
+    if not value:
+        return None
+    try:
+        return parse_datetime(value)
+    except ValueError:
+        return None
+
+
+def export_queryset(since=None):
+    """
+    (queryset, deleted, watermark): товары, изменённые после since, и удалённые
+    после since товары (id, slug, deleted_at) — всё не позже watermark.
+    Верхняя граница фиксирует срез — изменения во время выгрузки попадут в следующую.
+    Полная выгрузка удалённых не содержит: потребитель заменяет ею весь каталог.
+    Переименование категории или бренда обновляет updated_at их товаров (product/signals.py).
+    """
+    queryset = Product.objects.all()
+    deleted = ProductTombstone.objects.none()
+    if since is not None:
+        queryset = queryset.filter(updated_at__gt=since)
+        deleted = ProductTombstone.objects.filter(deleted_at__gt=since)
+    watermarks = [
+        queryset.aggregate(watermark=Max('updated_at'))['watermark'],
+        deleted.aggregate(watermark=Max('deleted_at'))['watermark'],
+    ]
+    watermark = max(filter(None, watermarks), default=None)
+    if watermark is None:
+        return queryset.none(), deleted.none(), since
+    queryset = queryset.filter(updated_at__lte=watermark)
+    deleted = deleted.filter(deleted_at__lte=watermark).order_by('deleted_at', 'id')
+    # полная выгрузка идёт по первичному ключу, инкрементальная — по индексу (updated_at, id)
+    ordering = ('updated_at', 'id') if since is not None else ('id',)
+    return (
+        queryset.order_by(*ordering).values_list(*_COLUMNS),
+        deleted.values_list('product_id', 'slug', 'deleted_at'),
+        watermark,
+    )
+
+
+def _gallery(product_ids):
+    images = {}
+    rows = ProductImage.objects.filter(product_id__in=product_ids).order_by('id').values_list('product_id', 'image')
+    for product_id, name in rows:
+        images.setdefault(product_id, []).append(name)
+    return images
+
+
+def iter_records(rows, base_url, deleted=()):
+    """
+    Словари товаров пачками по CHUNK_SIZE: строки читаются итератором
+    без кеша QuerySet, галерея — одним запросом на пачку.
+    Удалённые товары идут в конце записями с deleted=True, только id и slug.
+    """
+    url_template = reverse('product_detail', kwargs={'slug': 'slug-placeholder'})
+
+    def absolute(path):
+        return base_url + path if path.startswith('/') else path
+
+    if isinstance(default_storage, FileSystemStorage):
+        # storage.url() с urljoin на каждую картинку — основная часть времени выгрузки
+        media_url = absolute(default_storage.base_url)
+
+        def storage_url(name):
+            return media_url + filepath_to_uri(name)
+    else:
+        def storage_url(name):
+            return absolute(default_storage.url(name))
+
+    rows = rows.iterator(chunk_size=CHUNK_SIZE)
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        gallery = _gallery([row[0] for row in chunk])
+        yield [
+            {
+                'id': pk,
+                'slug': slug,
+                'url': absolute(url_template.replace('slug-placeholder', slug)),
+                'name': name,
+                'description': description,
+                'price': str(price),
+                'old_price': str(old_price) if old_price is not None else None,
+                'discount': discount,
+                'status': status,
+                'is_available': is_available,
+                'category': category,
+                'category_slug': category_slug,
+                'brand': brand,
+                'image': storage_url(image) if image else None,
+                'images': [storage_url(gallery_image) for gallery_image in gallery.get(pk, ())],
+                'updated_at': updated_at.isoformat(),
+                'deleted': False,
+            }
+            for (pk, slug, name, description, price, old_price, discount, status, is_available,
+                 category, category_slug, brand, image, updated_at) in chunk
+        ]
+
+    tombstone = dict.fromkeys(FIELDS, None)
+    deleted = iter(deleted)
+    while True:
+        chunk = list(islice(deleted, CHUNK_SIZE))
+        if not chunk:
+            return
+        yield [
+            {**tombstone, 'id': pk, 'slug': slug, 'images': [], 'updated_at': deleted_at.isoformat(), 'deleted': True}
+            for pk, slug, deleted_at in chunk
+        ]
+
+
+# ----------------------
+# Форматы
+# ----------------------
+def stream_jsonl(rows, base_url, deleted=()):
+    for records in iter_records(rows, base_url, deleted):
+        yield ''.join(_encode(record) + '\n' for record in records)
+
+
+def stream_csv(rows, base_url, deleted=()):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for records in iter_records(rows, base_url, deleted):
+        for record in records:
+            record['images'] = ' '.join(record['images'])
+            writer.writerow([record[field] for field in FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+FORMATS = {
+    'jsonl': (stream_jsonl, 'application/x-ndjson; charset=utf-8'),
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+}
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Min, Q
+
+from . import search
+from .models import Product
+
+FACETS_VERSION_KEY = 'catalog:facets:version'
+FACETS_TIMEOUT = 60 * 60
+
+
+# ----------------------
+# Разбор параметров фильтра
+# ----------------------
+def _parse_ids(values):
+    ids = set()
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return sorted(ids)
+
+
+def _parse_price(value):
+    if value in (None, ''):
+        return None
+    try:
+        price = Decimal(str(value).replace(',', '.'))
+    except InvalidOperation:
+        return None
+    return price if price.is_finite() else None
+
+
+def parse_catalog_filters(params):
+    """Нормализованное состояние фильтра из GET-параметров каталога"""
+    category_ids = params.getlist('category')
+    brand_ids = params.getlist('brand')
+    statuses = {value for value, _ in Product.STATUS_CHOICES}
+    return {
+        'q': params.get('q', '').strip(),
+        # "0" означает "все категории"/"все бренды"
+        'category': [] if '0' in category_ids else _parse_ids(category_ids),
+        'brand': [] if '0' in brand_ids else _parse_ids(brand_ids),
+        'status': sorted(set(params.getlist('status')) & statuses),
+        'price_min': _parse_price(params.get('price_min')),
+        'price_max': _parse_price(params.get('price_max')),
+        'discounted': params.get('discounted') == '1',
+    }
+
+
+def apply_catalog_filters(queryset, filters, exclude=()):
+    """Применяет фильтры к queryset товаров; ключи из exclude пропускаются"""
+    if filters['q'] and 'q' not in exclude:
+        queryset = search.filter_by_query(queryset, filters['q'])
+    if filters['category'] and 'category' not in exclude:
+        queryset = queryset.filter(category_id__in=filters['category'])
+    if filters['brand'] and 'brand' not in exclude:
+        queryset = queryset.filter(brand_id__in=filters['brand'])
+    if filters['status'] and 'status' not in exclude:
+        queryset = queryset.filter(status__in=filters['status'])
+    if 'price' not in exclude:
+        queryset = queryset.filter(_price_q(filters))
+    if filters['discounted'] and 'discounted' not in exclude:
+        queryset = queryset.filter(Q(discount__gt=0) | Q(old_price__gt=F('price')))
+    return queryset
+
+
+def _price_q(filters):
+    condition = Q()
+    if filters['price_min'] is not None:
+        condition &= Q(price__gte=filters['price_min'])
+    if filters['price_max'] is not None:
+        condition &= Q(price__lte=filters['price_max'])
+    return condition
+
+
+def filters_signature(filters):
+    payload = json.dumps(filters, sort_keys=True, default=str)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+# ----------------------
+# Подсчёт фасетов
+# ----------------------
+def _matches(row, filters, skip):
+    for key, field in (('category', 'category_id'), ('brand', 'brand_id'), ('status', 'status')):
+        if key != skip and filters[key] and row[field] not in filters[key]:
+            return False
+    return True
+
+
+def compute_facets(filters):
+    """
+    Считает фасеты одним запросом: товары группируются по (категория, бренд, состояние),
+    а счётчики каждого фасета собираются в Python с учётом остальных выбранных фильтров.
+    Диапазон цен не зависит от выбранной цены, чтобы слайдер не "схлопывался".
+    """
+    base = apply_catalog_filters(
+        Product.objects.all(), filters, exclude=('category', 'brand', 'status', 'price')
+    )
+    rows = base.values('category_id', 'brand_id', 'status').annotate(
+        count=Count('id', filter=_price_q(filters)),
+        min_price=Min('price'),
+        max_price=Max('price'),
+    ).order_by()
+
+    categories, brands, statuses = {}, {}, {}
+    total = 0
+    min_price = max_price = None
+    for row in rows:
+        count = row['count']
+        if count and _matches(row, filters, 'category') and row['category_id'] is not None:
+            categories[row['category_id']] = categories.get(row['category_id'], 0) + count
+        if count and _matches(row, filters, 'brand') and row['brand_id'] is not None:
+            brands[row['brand_id']] = brands.get(row['brand_id'], 0) + count
+        if count and _matches(row, filters, 'status'):
+            statuses[row['status']] = statuses.get(row['status'], 0) + count
+        if _matches(row, filters, None):
+            total += count
+            if min_price is None or row['min_price'] < min_price:
+                min_price = row['min_price']
+            if max_price is None or row['max_price'] > max_price:
+                max_price = row['max_price']
+
+    return {
+        'categories': categories,
+        'brands': brands,
+        'statuses': statuses,
+        'total': total,
+        'min_price': min_price or 0,
+        'max_price': max_price or 0,
+    }
+
+
+def catalog_version():
+    """Версия каталога: меняется при любом изменении товаров, категорий и брендов"""
+    version = cache.get(FACETS_VERSION_KEY)
+    if version is None:
+        # версия из времени, чтобы после вытеснения ключа не поднять старые записи
+        version = time.time_ns()
+        cache.add(FACETS_VERSION_KEY, version, None)
+    return version
+
+
+def get_facets(filters):
+    """Фасеты для состояния фильтра с кешированием по нормализованной сигнатуре"""
+    key = f'catalog:facets:{catalog_version()}:{filters_signature(filters)}'
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(filters)
+        cache.set(key, facets, FACETS_TIMEOUT)
+    return facets
+
+
+def invalidate_facets():
+    """Сбрасывает все закешированные фасеты сменой версии"""
+    try:
+        cache.incr(FACETS_VERSION_KEY)
+    except ValueError:
+        cache.set(FACETS_VERSION_KEY, time.time_ns(), None)
@@ -0,0 +1,69 @@
+import time
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+CARD_TEMPLATE = 'partials/product_card.html'
+CARDS_VERSION_KEY = 'catalog:fragments:cards'
+FRAGMENT_TIMEOUT = 60 * 60
+
+# Варианты карточки: кнопки зависят только от входа и от того, в избранном ли товар
+GUEST, USER, WISHED = 'guest', 'user', 'wished'
+
+
+def cards_version():
+    version = cache.get(CARDS_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.add(CARDS_VERSION_KEY, version, None)
+    return version
+
+
+def invalidate_cards():
+    """
+    Сбрасывает все карточки. Изменения самого товара меняют updated_at и ключ,
+    а переименование категории или бренда — нет, поэтому для них меняем версию.
+    """
+    try:
+        cache.incr(CARDS_VERSION_KEY)
+    except ValueError:
+        cache.set(CARDS_VERSION_KEY, time.time_ns(), None)
+
+
+def card_key(version, product, variant):
+    return f'fragment:card:{version}:{product.pk}:{product.updated_at.timestamp()}:{variant}'
+
+
+def _variant(product, authenticated, wishlist_ids):
+    if not authenticated:
+        return GUEST
+    return WISHED if product.pk in wishlist_ids else USER
+
+
+def render_cards(products, authenticated=False, wishlist_ids=frozenset()):
+    """
+    HTML карточек товаров в исходном порядке: все ключи читаются одним get_many,
+    недостающие карточки рендерятся и записываются одним set_many.
+    """
+    version = cards_version()
+    rows = []
+    for product in products:
+        variant = _variant(product, authenticated, wishlist_ids)
+        rows.append((product, variant, card_key(version, product, variant)))
+
+    cached = cache.get_many([key for _, _, key in rows])
+    missing = {}
+    cards = []
+    for product, variant, key in rows:
+        html = cached.get(key)
+        if html is None:
+            html = missing[key] = render_to_string(CARD_TEMPLATE, {
+                'product': product,
+                'authenticated': variant != GUEST,
+                'in_wishlist': variant == WISHED,
+            })
+        cards.append(mark_safe(html))
+    if missing:
+        cache.set_many(missing, FRAGMENT_TIMEOUT)
+    return cards
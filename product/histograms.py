@@ -0,0 +1,112 @@
+import math
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .facets import FACETS_TIMEOUT, catalog_version
+from .models import PriceBucket, Product
+
+CATALOG = 0
+# интервалы в логарифмической шкале: цены от сотен до сотен тысяч рублей
+# получают одинаково подробную картинку, а границы не зависят от товаров
+STEPS_PER_DECADE = 8
+
+
+# ----------------------
+# Интервалы
+# ----------------------
+def bucket_of(price):
+    """Номер интервала цены: 0 — дешевле 1, дальше по STEPS_PER_DECADE на порядок"""
+    if price is None or price < 1:
+        return 0
+    # поправка, чтобы 10, 100... попадали в свой интервал, а не в предыдущий
+    return 1 + math.floor(math.log10(float(price)) * STEPS_PER_DECADE + 1e-9)
+
+
+def bucket_bounds(bucket):
+    if bucket == 0:
+        return 0, 1
+    return 10 ** ((bucket - 1) / STEPS_PER_DECADE), 10 ** (bucket / STEPS_PER_DECADE)
+
+
+def _scopes(category_id):
+    # товар учитывается в своей категории и во всём каталоге
+    return (CATALOG, category_id) if category_id else (CATALOG,)
+
+
+# ----------------------
+# Изменение
+# ----------------------
+_ADJUST = (
+    'INSERT INTO {table} ({category}, {bucket}, {count}) VALUES (%s, %s, %s) '
+    'ON CONFLICT ({category}, {bucket}) DO UPDATE SET {count} = {table}.{count} + excluded.{count}'
+)
+
+
+def adjust(deltas):
+    """Сдвигает счётчики {(категория, интервал): delta} одним upsert на строку"""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    meta = PriceBucket._meta
+    sql = _ADJUST.format(
+        table=connection.ops.quote_name(meta.db_table),
+        **{name: connection.ops.quote_name(meta.get_field(name).column) for name in ('category', 'bucket', 'count')},
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(category, bucket, delta) for (category, bucket), delta in deltas.items()])
+
+
+def product_moved(old, new):
+    """
+    Учитывает изменение товара: old и new — (id категории, цена) или None,
+    если товара до/после изменения нет.
+    """
+    deltas = Counter()
+    for state, sign in ((old, -1), (new, 1)):
+        if state is not None:
+            category_id, price = state
+            for scope in _scopes(category_id):
+                deltas[scope, bucket_of(price)] += sign
+    adjust(deltas)
+
+
+def rebuild():
+    """Пересчёт с нуля — после импорта и массовых UPDATE, которые не шлют сигналов"""
+    counts = Counter()
+    for category_id, price in Product.objects.values_list('category_id', 'price').iterator(chunk_size=5000):
+        for scope in _scopes(category_id):
+            counts[scope, bucket_of(price)] += 1
+    with transaction.atomic():
+        PriceBucket.objects.all().delete()
+        PriceBucket.objects.bulk_create(
+            [PriceBucket(category=category, bucket=bucket, count=count) for (category, bucket), count in counts.items()],
+            batch_size=1000,
+        )
+    return len(counts)
+
+
+# ----------------------
+# Чтение
+# ----------------------
+def get_histogram(category_ids=()):
+    """
+    [{'from', 'to', 'count'}] по возрастанию цены для выбранных категорий
+    (пусто — весь каталог). Кешируется до следующего изменения каталога.
+    """
+    scopes = sorted(set(category_ids)) or [CATALOG]
+    key = f"price-histogram:{catalog_version()}:{','.join(map(str, scopes))}"
+    histogram = cache.get(key)
+    if histogram is None:
+        counts = Counter()
+        for bucket, count in PriceBucket.objects.filter(category__in=scopes, count__gt=0).values_list(
+            'bucket', 'count',
+        ):
+            counts[bucket] += count
+        histogram = []
+        for bucket in sorted(counts):
+            low, high = bucket_bounds(bucket)
+            histogram.append({'from': round(low, 2), 'to': round(high, 2), 'count': counts[bucket]})
+        cache.set(key, histogram, FACETS_TIMEOUT)
+    return histogram
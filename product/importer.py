@@ -0,0 +1,418 @@
+import csv
+import json
+import os
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from accounts.models import CartItem, CartSummary
+
+from . import fragments, histograms, pagecache, search
+from .facets import invalidate_facets
+from .models import Brand, Category, Product, ProductImage
+from .suggestions import bump_generation
+
+DEFAULT_BATCH_SIZE = 2000
+SLUG_PREFIX_CHUNK = 200
+CART_CHUNK = 500
+
+PRODUCT_FIELDS = (
+    'name', 'description', 'price', 'old_price', 'discount', 'status', 'is_available', 'complectation',
+    'category_id', 'brand_id', 'image',
+)
+_STATUSES = {value for value, _ in Product.STATUS_CHOICES}
+_PRICE = Product._meta.get_field('price')
+_CENT = Decimal(1).scaleb(-_PRICE.decimal_places)
+# DecimalField(max_digits=10, decimal_places=2): не больше 8 цифр до запятой
+_PRICE_LIMIT = Decimal(10) ** (_PRICE.max_digits - _PRICE.decimal_places)
+_TRUE = {'1', 'true', 'yes', 'да'}
+
+
+class RowError(ValueError):
+    pass
+
+
+# ----------------------
+# Чтение файлов
+# ----------------------
+def read_records(path, skip=0):
+    """(номер строки, dict) из .csv или .jsonl; первые skip записей пропускаются"""
+    with open(path, encoding='utf-8', newline='') as file:
+        if path.endswith('.jsonl'):
+            records = (json.loads(line) for line in file if line.strip())
+        elif path.endswith('.csv'):
+            records = csv.DictReader(file)
+        else:
+            raise ValueError(f"Неизвестный формат файла: {path}")
+        for number, record in enumerate(records, start=1):
+            if number > skip:
+                yield number, record
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Checkpoint:
+    """
+    Сколько записей каждого файла уже загружено. Пишется после каждой пачки
+    (пачка — одна транзакция), поэтому прерванный импорт продолжается с неё.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.state = {}
+        if path and resume and os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                self.state = json.load(file)
+
+    def _key(self, step, source):
+        return f"{step}:{os.path.abspath(source)}"
+
+    def done(self, step, source):
+        return self.state.get(self._key(step, source), 0)
+
+    def save(self, step, source, count):
+        self.state[self._key(step, source)] = count
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as file:
+            json.dump(self.state, file)
+        os.replace(tmp, self.path)
+
+
+# ----------------------
+# Значения
+# ----------------------
+def _text(record, field, default=''):
+    value = record.get(field)
+    if value is None:
+        return default
+    return str(value).strip()
+
+
+def _decimal(record, field, required=False):
+    value = _text(record, field)
+    if not value:
+        if required:
+            raise RowError(f"нет поля {field}")
+        return None
+    try:
+        number = Decimal(value.replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        raise RowError(f"{field}: не число {value!r}")
+    # NaN и Infinity Decimal принимает, а колонка — нет
+    if not number.is_finite() or number < 0:
+        raise RowError(f"{field}: недопустимая цена {value!r}")
+    # 1e999 и 99999999.999 (после округления до копеек) в колонку не помещаются
+    if number >= _PRICE_LIMIT or (number := number.quantize(_CENT)) >= _PRICE_LIMIT:
+        raise RowError(f"{field}: слишком большая цена {value!r}")
+    return number
+
+
+def _int(record, field, minimum=None, maximum=None):
+    value = _text(record, field)
+    if not value:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise RowError(f"{field}: не целое {value!r}")
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise RowError(f"{field}: {number} вне диапазона {minimum}–{maximum}")
+    return number
+
+
+def _bool(record, field, default=True):
+    value = record.get(field)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in _TRUE
+
+
+# ----------------------
+# Слаги
+# ----------------------
+class SlugAllocator:
+    """
+    Слаги для объектов без слага. Сначала — слаги уже загруженных строк с тем же
+    названием (по порядку id), чтобы повторный импорт того же файла обновлял их,
+    а не дублировал каталог. Остальным — новые уникальные, как в Model.save():
+    base, base-1, base-2... Занятые слаги читаются одним запросом по префиксам
+    на пачку и запоминаются: префикс, уже встречавшийся в импорте, повторно не запрашивается.
+    """
+
+    def __init__(self, model, fallback):
+        self.model = model
+        self.fallback = fallback
+        self.taken = set()
+        self.counters = {}
+        # слаги, уже выданные в этом импорте, — второй объект с тем же названием их не получит
+        self.used = set()
+
+    def _load(self, bases):
+        # SQLite ограничивает глубину выражения — префиксы идут группами
+        for group in batched(sorted(bases), SLUG_PREFIX_CHUNK):
+            prefixes = Q()
+            for base in group:
+                prefixes |= Q(slug=base) | Q(slug__startswith=f"{base}-")
+            self.taken.update(self.model.objects.filter(prefixes).values_list('slug', flat=True))
+        self.counters.update(dict.fromkeys(bases, 0))
+
+    def _match(self, objects):
+        existing = {}
+        rows = self.model.objects.filter(name__in={obj.name for obj in objects}).order_by('pk')
+        for name, slug in rows.values_list('name', 'slug'):
+            existing.setdefault(name, []).append(slug)
+        pending = []
+        for obj in objects:
+            slug = next((slug for slug in existing.get(obj.name, ()) if slug not in self.used), None)
+            if slug is None:
+                pending.append(obj)
+            else:
+                obj.slug = slug
+                self.used.add(slug)
+        return pending
+
+    def allocate(self, objects):
+        given = {obj.slug for obj in objects if obj.slug}
+        self.taken.update(given)
+        self.used.update(given)
+        pending = self._match([obj for obj in objects if not obj.slug])
+        pending = [(obj, slugify(obj.name) or self.fallback) for obj in pending]
+        self._load({base for _, base in pending} - self.counters.keys())
+        for obj, base in pending:
+            counter = self.counters[base]
+            slug = f"{base}-{counter}" if counter else base
+            while slug in self.taken:
+                counter += 1
+                slug = f"{base}-{counter}"
+            self.counters[base] = counter + 1
+            self.taken.add(slug)
+            self.used.add(slug)
+            obj.slug = slug
+
+
+def _dedupe(objects, key):
+    # в одной пачке запись с тем же ключом встречается один раз — побеждает последняя
+    unique = {}
+    for obj in objects:
+        unique[key(obj) or id(obj)] = obj
+    return list(unique.values())
+
+
+# ----------------------
+# Категории
+# ----------------------
+def rebuild_category_paths():
+    """Пути и уровни всего дерева в памяти и одним bulk_update; возвращает id категорий в цикле"""
+    categories = list(Category.objects.only('id', 'parent_id', 'path', 'depth'))
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+    stack = [(category, '') for category in children.get(None, [])]
+    placed = set()
+    while stack:
+        category, parent_path = stack.pop()
+        category.path = f"{parent_path}{category.pk:0{Category.PATH_STEP}d}/"
+        category.depth = category.path.count('/') - 1
+        placed.add(category.pk)
+        stack.extend((child, category.path) for child in children.get(category.pk, []))
+    Category.objects.bulk_update([c for c in categories if c.pk in placed], ['path', 'depth'], batch_size=500)
+    return [category.pk for category in categories if category.pk not in placed]
+
+
+def import_categories(path, report):
+    """Категорий немного — загружаются целиком: upsert по слагу, затем родители и пути"""
+    objects, parents = [], {}
+    for number, record in read_records(path):
+        name = _text(record, 'name')
+        if not name:
+            report.error(path, number, "нет названия")
+            continue
+        category = Category(name=name, slug=_text(record, 'slug'), image=_text(record, 'image') or None)
+        objects.append(category)
+        parents[id(category)] = _text(record, 'parent')
+
+    with transaction.atomic():
+        SlugAllocator(Category, 'category').allocate(objects)
+        objects = _dedupe(objects, lambda obj: obj.slug)
+        # пустая колонка image не стирает картинку, уже загруженную в категорию
+        for update_fields in (['name', 'image'], ['name']):
+            Category.objects.bulk_create(
+                [obj for obj in objects if bool(obj.image) == ('image' in update_fields)], batch_size=500,
+                update_conflicts=True, unique_fields=['slug'], update_fields=update_fields,
+            )
+        ids = dict(Category.objects.values_list('slug', 'id'))
+        updates = []
+        for category in objects:
+            category.pk = ids[category.slug]
+            parent_slug = parents.get(id(category))
+            category.parent_id = ids.get(parent_slug) if parent_slug else None
+            if parent_slug and category.parent_id is None:
+                report.error(path, None, f"{category.slug}: нет родителя {parent_slug}")
+            updates.append(category)
+        Category.objects.bulk_update(updates, ['parent'], batch_size=500)
+        cycle = rebuild_category_paths()
+        if cycle:
+            raise ValueError(f"Категории образуют цикл: {sorted(cycle)}")
+    report.count('categories', len(objects))
+
+
+# ----------------------
+# Бренды
+# ----------------------
+def import_brands(path, report):
+    objects = []
+    for number, record in read_records(path):
+        name = _text(record, 'name')
+        if not name:
+            report.error(path, number, "нет названия")
+            continue
+        objects.append(Brand(name=name, slug=_text(record, 'slug'), description=_text(record, 'description') or None))
+
+    with transaction.atomic():
+        existing = dict(Brand.objects.filter(name__in=[b.name for b in objects]).values_list('name', 'slug'))
+        for brand in objects:
+            brand.slug = brand.slug or existing.get(brand.name, '')
+        SlugAllocator(Brand, 'brand').allocate(objects)
+        objects = _dedupe(objects, lambda obj: obj.name)
+        Brand.objects.bulk_create(
+            objects, batch_size=500,
+            update_conflicts=True, unique_fields=['name'], update_fields=['slug', 'description'],
+        )
+    report.count('brands', len(objects))
+
+
+# ----------------------
+# Товары
+# ----------------------
+def _lookup_maps():
+    categories = dict(Category.objects.values_list('slug', 'id'))
+    brands = {}
+    for pk, name, slug in Brand.objects.values_list('id', 'name', 'slug'):
+        brands[name.lower()] = pk
+        brands[slug] = pk
+    return categories, brands
+
+
+def _product(record, categories, brands):
+    name = _text(record, 'name')
+    if not name:
+        raise RowError("нет названия")
+    status = _text(record, 'status') or 'new'
+    if status not in _STATUSES:
+        raise RowError(f"неизвестное состояние {status!r}")
+    category, brand = _text(record, 'category'), _text(record, 'brand')
+    if category and category not in categories:
+        raise RowError(f"нет категории {category!r}")
+    if brand and brand.lower() not in brands and brand not in brands:
+        raise RowError(f"нет бренда {brand!r}")
+    return Product(
+        name=name,
+        slug=_text(record, 'slug'),
+        description=_text(record, 'description'),
+        price=_decimal(record, 'price', required=True),
+        old_price=_decimal(record, 'old_price'),
+        discount=_int(record, 'discount', minimum=0, maximum=100),
+        status=status,
+        is_available=_bool(record, 'is_available'),
+        complectation=_text(record, 'complectation') or None,
+        category_id=categories.get(category),
+        brand_id=brands.get(brand.lower(), brands.get(brand)) if brand else None,
+        image=_text(record, 'image') or None,
+    )
+
+
+def import_products(path, report, checkpoint, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Пачками: запросы на слаги, один upsert по слагу, один запрос id
+    для полнотекстового индекса. Категории и бренды — из словарей в памяти.
+    id загруженных товаров копятся в report.product_ids для finish_import.
+    """
+    categories, brands = _lookup_maps()
+    slugs = SlugAllocator(Product, 'product')
+    done = checkpoint.done('products', path)
+    for batch in batched(read_records(path, skip=done), batch_size):
+        objects = []
+        for number, record in batch:
+            try:
+                objects.append(_product(record, categories, brands))
+            except RowError as exc:
+                report.error(path, number, str(exc))
+
+        with transaction.atomic():
+            slugs.allocate(objects)
+            objects = _dedupe(objects, lambda obj: obj.slug)
+            Product.objects.bulk_create(
+                objects, update_conflicts=True, unique_fields=['slug'], update_fields=PRODUCT_FIELDS + ('updated_at',),
+            )
+            ids = list(Product.objects.filter(slug__in=[obj.slug for obj in objects]).values_list('id', flat=True))
+            search.index_products(ids)
+        report.product_ids.update(ids)
+        done = batch[-1][0]
+        checkpoint.save('products', path, done)
+        report.count('products', len(objects))
+        report.progress('products', done)
+
+
+# ----------------------
+# Галерея
+# ----------------------
+def import_images(path, report, checkpoint, batch_size=DEFAULT_BATCH_SIZE):
+    """Фотографии товаров; уже загруженные пары (товар, файл) пропускаются"""
+    done = checkpoint.done('images', path)
+    for batch in batched(read_records(path, skip=done), batch_size):
+        rows = [(number, _text(record, 'product'), _text(record, 'image')) for number, record in batch]
+        products = dict(Product.objects.filter(slug__in={slug for _, slug, _ in rows}).values_list('slug', 'id'))
+        existing = set(
+            ProductImage.objects.filter(product_id__in=products.values()).values_list('product_id', 'image')
+        )
+        objects = []
+        for number, slug, image in rows:
+            product_id = products.get(slug)
+            if product_id is None or not image:
+                report.error(path, number, f"нет товара {slug!r}" if product_id is None else "нет файла")
+                continue
+            if (product_id, image) not in existing:
+                existing.add((product_id, image))
+                objects.append(ProductImage(product_id=product_id, image=image))
+
+        with transaction.atomic():
+            ProductImage.objects.bulk_create(objects)
+        done = batch[-1][0]
+        checkpoint.save('images', path, done)
+        report.count('images', len(objects))
+
+
+def reprice_carts(product_ids):
+    """Итоги корзин, в которых лежат загруженные товары: цены могли измениться"""
+    profile_ids = set()
+    for chunk in batched(sorted(product_ids), CART_CHUNK):
+        profile_ids.update(CartItem.objects.filter(product_id__in=chunk).values_list('profile_id', flat=True))
+    for chunk in batched(sorted(profile_ids), CART_CHUNK):
+        CartSummary.recompute(chunk, create=False)
+
+
+def finish_import(product_ids=()):
+    """
+    bulk_create не шлёт сигналы — пересчитываем итоги затронутых корзин и гистограмму
+    цен и сбрасываем кеши каталога одним разом
+    """
+    reprice_carts(product_ids)
+    histograms.rebuild()
+    invalidate_facets()
+    fragments.invalidate_cards()
+    pagecache.purge('catalog', 'taxonomy')
+    bump_generation()
@@ -0,0 +1,217 @@
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from django.db import connections
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from product.models import Product
+
+CSRF_TOKEN = 'b' * 32
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест кликов «в корзину» на одном процессе: WSGI с пулом потоков "
+        "против ASGI с async-представлениями (на временной копии схемы базы, рабочие данные не трогаются)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clicks', type=int, default=2000, help="Всего запросов")
+        parser.add_argument('--concurrency', type=int, default=100, help="Одновременных запросов")
+        parser.add_argument('--threads', type=int, default=8, help="Потоков WSGI-воркера")
+        parser.add_argument('--users', type=int, default=50, help="Покупателей")
+        parser.add_argument('--db-latency', type=float, default=2.0, help="Задержка на запрос к базе, мс")
+        parser.add_argument('--mode', choices=('wsgi', 'asgi'), help="Только один режим (внутренний запуск)")
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            self.stdout.write(json.dumps(self.run_mode(options)))
+            return
+
+        # urls.py выбирает представления по SHOP_ASYNC_VIEWS при импорте — каждый режим в своём процессе
+        results = {}
+        for mode, async_views in (('wsgi', '0'), ('asgi', '1')):
+            command = [sys.executable, sys.argv[0], 'bench_cart_clicks', '--mode', mode]
+            for name in ('clicks', 'concurrency', 'threads', 'users', 'db_latency'):
+                command += [f"--{name.replace('_', '-')}", str(options[name])]
+            output = subprocess.run(
+                command, env={**os.environ, 'SHOP_ASYNC_VIEWS': async_views},
+                capture_output=True, text=True, check=True,
+            ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+
+        self.stdout.write(
+            f"Запросов: {options['clicks']}, одновременно: {options['concurrency']}, "
+            f"задержка базы: {options['db_latency']} мс, потоков WSGI: {options['threads']}"
+        )
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode.upper()}: {result['rps']:.0f} запросов/с, ошибок {result['errors']}, "
+                f"мс: median {result['median']:.1f} / p95 {result['p95']:.1f} / max {result['max']:.1f}"
+            )
+
+    # ----------------------
+    # Один режим
+    # ----------------------
+    def run_mode(self, options):
+        # запросы идут из многих потоков и соединений, поэтому откатить их одной транзакцией,
+        # как в bench_checkout, нельзя — замер идёт на отдельной базе, которая удаляется целиком;
+        # кеш тоже свой: id покупателей временной базы совпадают с id настоящих
+        connection = connections['default']
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench'},
+        }):
+            if connection.vendor == 'sqlite':
+                # файл, а не база в памяти: потоки пишут параллельно через свои соединения
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                return self.measure(options)
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def measure(self, options):
+        latency = options['db_latency'] / 1000
+
+        def delay(execute, sql, params, many, context):
+            # SQLite в процессе отвечает мгновенно — имитируем сетевую базу
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_delay(sender, connection, **kwargs):
+            if connection.vendor == 'sqlite':
+                # без WAL читатели ждут писателя и замер показывает только блокировки файла;
+                # режим остаётся в файле временной базы и удаляется вместе с ней
+                with connection.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode=WAL')
+                    cursor.execute('PRAGMA synchronous=NORMAL')
+            # объект соединения потока переживает переподключения между запросами
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        products = Product.objects.bulk_create([
+            Product(name=f"Bench {i}", slug=f"bench-{i}", description="", price=100 + i) for i in range(20)
+        ])
+        users = [User.objects.create_user(f"bench-{i}") for i in range(options['users'])]
+        cookies = [self.session_cookie(user) for user in users]
+        paths = [reverse('add_to_cart', args=[product.pk]) for product in products]
+        requests = [(paths[i % len(paths)], cookies[i % len(cookies)]) for i in range(options['clicks'])]
+
+        connections.close_all()
+        connection_created.connect(add_delay)
+        try:
+            if options['mode'] == 'asgi':
+                timings, errors, elapsed = asyncio.run(self.run_asgi(requests, options['concurrency']))
+            else:
+                timings, errors, elapsed = self.run_wsgi(requests, options['concurrency'], options['threads'])
+        finally:
+            connection_created.disconnect(add_delay)
+            connections.close_all()
+
+        timings.sort()
+        return {
+            'rps': len(requests) / elapsed,
+            'errors': errors,
+            'median': statistics.median(timings),
+            'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+            'max': timings[-1],
+        }
+
+    def session_cookie(self, user):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return f"{settings.SESSION_COOKIE_NAME}={session.session_key}; {settings.CSRF_COOKIE_NAME}={CSRF_TOKEN}"
+
+    def run_wsgi(self, requests, concurrency, threads):
+        # как gthread-воркер gunicorn: один процесс, threads потоков; время — с учётом очереди к потокам
+        application = get_wsgi_application()
+        timings, errors = [], []
+        gate = threading.BoundedSemaphore(concurrency)
+
+        def click(request, queued):
+            path, cookie = request
+            status = []
+            environ = {
+                'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'QUERY_STRING': '',
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'CONTENT_TYPE': 'application/x-www-form-urlencoded', 'CONTENT_LENGTH': '10',
+                'HTTP_COOKIE': cookie, 'HTTP_X_CSRFTOKEN': CSRF_TOKEN,
+                'wsgi.input': io.BytesIO(b'quantity=1'), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+            }
+            try:
+                response = application(environ, lambda code, headers: status.append(code))
+                b''.join(response)
+                response.close()
+            finally:
+                timings.append((time.perf_counter() - queued) * 1000)
+                gate.release()
+            if not status[0].startswith('200'):
+                errors.append(status[0])
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            for request in requests:
+                gate.acquire()
+                pool.submit(click, request, time.perf_counter())
+        return timings, len(errors), time.perf_counter() - started
+
+    async def run_asgi(self, requests, concurrency):
+        application = get_asgi_application()
+        timings, errors = [], []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def click(request):
+            path, cookie = request
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+                'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+                'headers': [
+                    (b'host', b'localhost'), (b'cookie', cookie.encode()), (b'x-csrftoken', CSRF_TOKEN.encode()),
+                    (b'content-type', b'application/x-www-form-urlencoded'), (b'content-length', b'10'),
+                ],
+            }
+            messages = [{'type': 'http.request', 'body': b'quantity=1', 'more_body': False}]
+            status = []
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            async with semaphore:
+                started = time.perf_counter()
+                await application(scope, receive, send)
+                timings.append((time.perf_counter() - started) * 1000)
+            if status[0] != 200:
+                errors.append(status[0])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(click(request) for request in requests))
+        return timings, len(errors), time.perf_counter() - started
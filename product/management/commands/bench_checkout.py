@@ -0,0 +1,56 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import CartItem, CartSummary
+from product.checkout import place_order
+from product.models import Product
+
+
+class Command(BaseCommand):
+    help = "Замеряет время оформления заказа для корзины из N позиций (данные откатываются)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=50, help="Позиций в корзине")
+        parser.add_argument('--runs', type=int, default=20, help="Количество оформлений")
+
+    def handle(self, *args, **options):
+        lines, runs = options['lines'], options['runs']
+        timings, queries = [], []
+
+        with transaction.atomic():
+            marker = uuid.uuid4().hex[:8]
+            profile = User.objects.create_user(f"bench-{marker}").profile
+            products = Product.objects.bulk_create([
+                Product(name=f"Bench {i}", slug=f"bench-{marker}-{i}", description="", price=100 + i)
+                for i in range(lines)
+            ])
+
+            for _ in range(runs):
+                CartItem.objects.bulk_create([
+                    CartItem(profile=profile, product=product, quantity=1 + i % 3)
+                    for i, product in enumerate(products)
+                ])
+                CartSummary.recompute([profile.pk])
+
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    place_order(profile, full_name="Bench", phone="0", token=uuid.uuid4())
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries.append(len(context.captured_queries))
+
+            transaction.set_rollback(True)
+
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(f"Позиций в корзине: {lines}, оформлений: {runs}")
+        self.stdout.write(f"Запросов на заказ: {max(queries)}")
+        self.stdout.write(
+            f"Время, мс: min {timings[0]:.2f} / median {statistics.median(timings):.2f} "
+            f"/ p95 {p95:.2f} / max {timings[-1]:.2f}"
+        )
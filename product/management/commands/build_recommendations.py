@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from product import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Обновляет рекомендации «с этим покупают» по заказам и корзинам. "
+        "Запускается по расписанию (например, cron раз в час): учитываются только новые данные"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Пересчитать всё заново")
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K, help="Рекомендаций на товар")
+
+    def handle(self, *args, **options):
+        last_order_id, count = recommendations.refresh(full=options['full'], top_k=options['top_k'])
+        engine = 'scipy' if recommendations.sparse is not None else 'python'
+        self.stdout.write(self.style.SUCCESS(
+            f"Пересчитано товаров: {count}, учтены заказы до #{last_order_id} ({engine})"
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from product import renditions
+from product.models import Category, Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = "Создаёт WebP/JPEG варианты для уже загруженных картинок товаров, галерей и категорий"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Число процессов (0 — в текущем процессе)")
+        parser.add_argument("--force", action="store_true", help="Пересоздать уже существующие варианты")
+
+    def handle(self, *args, **options):
+        names = set()
+        for model in (Product, ProductImage, Category):
+            names.update(model.objects.exclude(image="").exclude(image=None).values_list("image", flat=True))
+        if not options["force"]:
+            names = {name for name in names if not renditions.renditions_ready(name)}
+
+        results = renditions.generate_many(sorted(names), workers=options["workers"])
+        failed = [(name, error) for name, error in results if error]
+        for name, error in failed:
+            self.stderr.write(f"{name}: {error}")
+        self.stdout.write(self.style.SUCCESS(f"Обработано картинок: {len(results) - len(failed)}, ошибок: {len(failed)}"))
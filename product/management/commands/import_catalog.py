@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from product import importer
+
+
+class Report:
+    def __init__(self, command, max_errors=50):
+        self.command = command
+        self.max_errors = max_errors
+        self.errors = 0
+        self.counts = {}
+        self.product_ids = set()
+        self.started = time.monotonic()
+
+    def error(self, path, number, message):
+        self.errors += 1
+        if self.errors <= self.max_errors:
+            where = f"{path}:{number}" if number else path
+            self.command.stderr.write(f"{where}: {message}")
+
+    def count(self, step, value):
+        self.counts[step] = self.counts.get(step, 0) + value
+
+    def progress(self, step, line):
+        rate = self.counts.get(step, 0) / max(time.monotonic() - self.started, 1e-6)
+        self.command.stdout.write(f"{step}: строка {line}, {rate:.0f} записей/с")
+
+
+class Command(BaseCommand):
+    help = "Загружает категории, бренды, товары и фотографии из CSV/JSONL пачками с upsert"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", help="Файл категорий: name, slug, parent (слаг), image")
+        parser.add_argument("--brands", help="Файл брендов: name, slug, description")
+        parser.add_argument(
+            "--products",
+            help="Файл товаров: name, slug, description, price, old_price, discount, status, "
+                 "is_available, complectation, category (слаг), brand (название или слаг), image",
+        )
+        parser.add_argument("--images", help="Файл фотографий: product (слаг), image")
+        parser.add_argument("--batch-size", type=int, default=importer.DEFAULT_BATCH_SIZE)
+        parser.add_argument("--checkpoint", default=".import_catalog.json", help="Файл контрольной точки")
+        parser.add_argument("--resume", action="store_true", help="Продолжить с контрольной точки")
+
+    def handle(self, *args, **options):
+        if not any(options[name] for name in ("categories", "brands", "products", "images")):
+            raise CommandError("Укажите хотя бы один файл")
+
+        report = Report(self)
+        checkpoint = importer.Checkpoint(options["checkpoint"], resume=options["resume"])
+        try:
+            if options["categories"]:
+                importer.import_categories(options["categories"], report)
+            if options["brands"]:
+                importer.import_brands(options["brands"], report)
+            if options["products"]:
+                importer.import_products(options["products"], report, checkpoint, options["batch_size"])
+            if options["images"]:
+                importer.import_images(options["images"], report, checkpoint, options["batch_size"])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        finally:
+            if report.counts:
+                importer.finish_import(report.product_ids)
+
+        summary = ", ".join(f"{step}: {count}" for step, count in report.counts.items()) or "ничего"
+        elapsed = time.monotonic() - report.started
+        self.stdout.write(self.style.SUCCESS(f"Загружено — {summary}; ошибок: {report.errors}; {elapsed:.1f} с"))
+        if report.counts.get("products") or report.counts.get("images"):
+            self.stdout.write("Варианты картинок: manage.py build_renditions")
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.models import GuestCart
+
+
+class Command(BaseCommand):
+    help = "Удаляет корзины гостей, которые не менялись дольше срока жизни куки"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=GuestCart.COOKIE_AGE // (24 * 60 * 60))
+
+    def handle(self, *args, **options):
+        border = timezone.now() - timedelta(days=options["days"])
+        deleted, _ = GuestCart.objects.filter(updated_at__lt=border).delete()
+        self.stdout.write(self.style.SUCCESS(f"Удалено корзин: {deleted}"))
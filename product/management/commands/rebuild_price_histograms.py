@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from product.facets import invalidate_facets
+from product.histograms import rebuild
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает гистограммы цен каталога и категорий (после массовых UPDATE цен)"
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        # закешированные гистограммы привязаны к версии каталога
+        invalidate_facets()
+        self.stdout.write(self.style.SUCCESS(f"Интервалов с товарами: {count}"))
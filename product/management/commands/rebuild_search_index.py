@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from product import search
+
+
+class Command(BaseCommand):
+    help = "Пересобирает полнотекстовый индекс товаров (SQLite FTS5)"
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            self.stdout.write(self.style.WARNING("Полнотекстовый индекс поддерживается только в SQLite"))
+            return
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано товаров: {count}"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from product.popularity import recompute_popularity
+from product.suggestions import bump_generation
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает популярность товаров по корзинам и заказам"
+
+    def handle(self, *args, **options):
+        count = recompute_popularity()
+        # индексы подсказок в процессах сервера перестроятся с новыми значениями
+        bump_generation()
+        self.stdout.write(self.style.SUCCESS(f"Обновлено товаров: {count}"))
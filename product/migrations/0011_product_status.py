@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0010_category_image'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='product',
+            name='is_new',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='status',
+            field=models.CharField(choices=[('new', 'Новый товар'), ('excellent', 'Состояние отличное'), ('defect', 'Есть дефекты'), ('marriage', 'На запчасти')], default='new', max_length=10, verbose_name='Состояние товара'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from product.search import SEARCH_TABLE, _SOURCE_SQL, create_index
+
+    with schema_editor.connection.cursor() as cursor:
+        create_index(cursor)
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}(rowid, name, description, brand, category) {_SOURCE_SQL}")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from product.search import drop_index
+
+    with schema_editor.connection.cursor() as cursor:
+        drop_index(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0011_product_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:45
+
+from django.db import migrations, models
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_popularity(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    CartItem = apps.get_model('accounts', 'CartItem')
+    OrderItem = apps.get_model('accounts', 'OrderItem')
+
+    def quantity(model):
+        total = model.objects.filter(product_id=OuterRef('pk')).order_by().values('product_id').annotate(
+            total=Sum('quantity')
+        ).values('total')
+        return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+    Product.objects.update(popularity=quantity(CartItem) + quantity(OrderItem))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0012_product_search_index'),
+        ('accounts', '0002_remove_order_products_order_full_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='popularity',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Популярность'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-popularity', '-id'], name='product_popularity_idx'),
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
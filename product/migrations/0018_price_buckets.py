@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:43
+
+import math
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_buckets(apps, schema_editor):
+    # как product.histograms.rebuild на момент миграции
+    Product = apps.get_model('product', 'Product')
+    PriceBucket = apps.get_model('product', 'PriceBucket')
+    counts = Counter()
+    for category_id, price in Product.objects.values_list('category_id', 'price').iterator():
+        bucket = 0 if price is None or price < 1 else 1 + math.floor(math.log10(float(price)) * 8 + 1e-9)
+        for scope in (0, category_id) if category_id else (0,):
+            counts[scope, bucket] += 1
+    PriceBucket.objects.bulk_create(
+        [PriceBucket(category=category, bucket=bucket, count=count) for (category, bucket), count in counts.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0017_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.PositiveIntegerField()),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pricebucket',
+            constraint=models.UniqueConstraint(fields=('category', 'bucket'), name='price_bucket_uniq'),
+        ),
+        migrations.RunPython(fill_buckets, migrations.RunPython.noop),
+    ]
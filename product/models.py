@@ -1,4 +1,7 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.utils.text import slugify
@@ -20,6 +23,11 @@ class Category(models.Model):
         null=True,
         verbose_name="Родительская категория"
     )
+    # материализованный путь: id предков и свой id по PATH_STEP цифр, каждый с "/" на конце
+    path = models.CharField("Путь в дереве", max_length=255, db_index=True, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField("Уровень", default=0, editable=False)
+
+    PATH_STEP = 8
 
     class Meta:
         verbose_name = "Категория"
@@ -31,6 +39,17 @@ class Category(models.Model):
     def get_absolute_url(self):
         return reverse('category_detail', kwargs={'slug': self.slug})
 
+    def _parent_path(self):
+        if not self.parent_id:
+            return ''
+        parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+        if self.path and parent_path.startswith(self.path):
+            raise ValidationError({'parent': "Категория не может быть вложена в саму себя"})
+        return parent_path
+
+    def clean(self):
+        self._parent_path()
+
     def save(self, *args, **kwargs):
         if not self.slug:
             base_slug = slugify(self.name)
@@ -40,7 +59,74 @@ class Category(models.Model):
                 slug = f"{base_slug}-{counter}"
                 counter += 1
             self.slug = slug
+        parent_path = self._parent_path()
         super().save(*args, **kwargs)
+        self._update_path(parent_path)
+
+    def _update_path(self, parent_path):
+        path = f"{parent_path}{self.pk:0{self.PATH_STEP}d}/"
+        if path == self.path:
+            return
+        old_path, old_depth = self.path, self.depth
+        depth = path.count('/') - 1
+        Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        if old_path:
+            # перенос поддерева: переписываем префикс пути у всех потомков одним UPDATE
+            Category.objects.filter(self.subtree_q('path', old_path)).exclude(pk=self.pk).update(
+                path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (depth - old_depth),
+            )
+        self.path, self.depth = path, depth
+
+    # ----------------------
+    # Дерево
+    # ----------------------
+    @staticmethod
+    def subtree_q(field, path):
+        """Условие "путь начинается с path" диапазоном, чтобы работал индекс: '/' < '0'"""
+        return Q(**{f"{field}__gte": path, f"{field}__lt": path[:-1] + '0'})
+
+    def ancestor_ids(self):
+        step = self.PATH_STEP + 1
+        return [int(self.path[i:i + self.PATH_STEP]) for i in range(0, len(self.path) - step, step)]
+
+    def get_descendants(self, include_self=False):
+        descendants = Category.objects.filter(self.subtree_q('path', self.path)).order_by('path')
+        return descendants if include_self else descendants.exclude(pk=self.pk)
+
+    def get_ancestors(self):
+        return Category.objects.filter(pk__in=self.ancestor_ids()).order_by('depth')
+
+    def get_breadcrumbs(self):
+        """Предки от корня и сама категория — один запрос"""
+        return list(self.get_ancestors()) + [self]
+
+    def get_products(self):
+        """Товары категории вместе с товарами всех подкатегорий"""
+        return Product.objects.filter(self.subtree_q('category__path', self.path))
+
+    @classmethod
+    def tree(cls, queryset=None):
+        """
+        Всё дерево одним запросом: корни со списками children, у каждого узла
+        product_count (свои товары) и subtree_product_count (с подкатегориями).
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        nodes = list(queryset.annotate(product_count=Count('products')).order_by('path'))
+        by_id = {node.pk: node for node in nodes}
+        roots = []
+        for node in nodes:
+            node.children = []
+            node.subtree_product_count = node.product_count
+            parent = by_id.get(node.parent_id)
+            (parent.children if parent else roots).append(node)
+        # в порядке path потомки идут после предков — суммируем с конца
+        for node in reversed(nodes):
+            parent = by_id.get(node.parent_id)
+            if parent:
+                parent.subtree_product_count += node.subtree_product_count
+        return roots
 
 
 class Brand(models.Model):
@@ -112,12 +198,29 @@ class Product(models.Model):
         null=True, blank=True
     )
     image = models.ImageField("Картинка", upload_to="products/", blank=True, null=True)
+    # в корзинах + заказано; поддерживается сигналами CartItem/OrderItem
+    popularity = models.PositiveIntegerField("Популярность", default=0, editable=False)
     created_at = models.DateTimeField("Дата добавления", auto_now_add=True)
     updated_at = models.DateTimeField("Дата обновления", auto_now=True)
 
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
+        indexes = [
+            models.Index(fields=['-popularity', '-id'], name='product_popularity_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['updated_at', 'id'], name='product_updated_idx'),
+            # каталог с фильтром по категории или бренду и сортировкой по цене/популярности;
+            # «новинки» (-id) в категории обслуживает индекс внешнего ключа
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['category', '-popularity', '-id'], name='product_category_popular_idx'),
+            models.Index(fields=['brand', 'price', 'id'], name='product_brand_price_idx'),
+            # блок «Новые товары»: частичный индекс только по показываемым строкам
+            models.Index(
+                fields=['-created_at'], name='product_new_arrivals_idx',
+                condition=Q(status='new', is_available=True),
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -128,6 +231,14 @@ class Product(models.Model):
                 slug = f"{base_slug}-{counter}"
                 counter += 1
             self.slug = slug
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # popularity меняется только атомарными UPDATE — не затираем его устаревшим значением;
+            # отложенные поля (only()/defer()) не загружаем и не перезаписываем
+            skipped = self.get_deferred_fields() | {'popularity'}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped and field.name not in skipped
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -150,3 +261,66 @@ class ProductImage(models.Model):
 
     def __str__(self):
         return f"{self.product.name} Image"
+
+
+# ----------------------
+# Рекомендации «с этим покупают»
+# ----------------------
+# Строит команда build_recommendations (product/recommendations.py)
+class CoPurchase(models.Model):
+    """Сколько заказов содержат оба товара; хранится в обе стороны"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='copurchase_pair_uniq'),
+        ]
+
+
+class ProductNeighbor(models.Model):
+    """Первые K рекомендаций товара; уникальный индекс (product, rank) — выдача одним поиском по индексу"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_with')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='product_neighbor_rank_uniq'),
+        ]
+
+
+class RecommendationState(models.Model):
+    """Одна строка: докуда учтены заказы и когда последний раз смотрели корзины"""
+    last_order_id = models.PositiveBigIntegerField(default=0)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+
+# ----------------------
+# Гистограмма цен
+# ----------------------
+class PriceBucket(models.Model):
+    """
+    Сколько товаров категории попадает в ценовой интервал (product/histograms.py).
+    category — id категории без внешнего ключа, 0 — весь каталог.
+    """
+    category = models.PositiveIntegerField()
+    bucket = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'bucket'], name='price_bucket_uniq'),
+        ]
+
+
+class ProductTombstone(models.Model):
+    """
+    Удалённый товар для инкрементальной выгрузки (product/export.py).
+    product_id — id товара без внешнего ключа: самого товара уже нет.
+    """
+    product_id = models.PositiveIntegerField()
+    slug = models.SlugField(max_length=255)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
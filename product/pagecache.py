@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import re
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.http import urlencode
+
+PAGE_FRESH = 5 * 60          # сколько страница считается свежей
+PAGE_TIMEOUT = 24 * 60 * 60  # сколько устаревшая страница ещё может отдаваться, пока её пересобирают
+LOCK_TIMEOUT = 30
+
+# Все страницы показывают список категорий в навбаре
+DEFAULT_TAGS = ('taxonomy',)
+
+# Параметры, которые не меняют содержимое страницы
+IGNORED_PARAMS = {'fbclid', 'gclid', 'yclid'}
+
+_TAG_KEY = 'pagecache:tag:{}'
+_HOLE_RE = re.compile(r'<!--personal:([\w./-]+)-->.*?<!--/personal-->', re.S)
+
+
+# ----------------------
+# Теги и версии
+# ----------------------
+def add_tags(request, *tags):
+    """Данные, от которых зависит страница: при их изменении страница устаревает"""
+    if hasattr(request, '_page_tags'):
+        request._page_tags.update(str(tag) for tag in tags)
+
+
+def tag_versions(tags):
+    keys = {_TAG_KEY.format(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    for key, version in missing.items():
+        cache.add(key, version, None)
+    found.update(missing)
+    return {tag: found[key] for key, tag in keys.items()}
+
+
+def purge(*tags):
+    """Помечает устаревшими все страницы с этими тегами"""
+    for tag in tags:
+        key = _TAG_KEY.format(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+# ----------------------
+# Ключ страницы
+# ----------------------
+def normalize_query(params):
+    """Отсортированные непустые параметры без меток рекламных кампаний"""
+    pairs = sorted(
+        (key, value)
+        for key, values in params.lists()
+        if key not in IGNORED_PARAMS and not key.startswith('utm_')
+        for value in values
+        if value != ''
+    )
+    return urlencode(pairs)
+
+
+def page_key(request, variant):
+    url = f'{request.path}?{normalize_query(request.GET)}'
+    return f'pagecache:page:{variant}:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def _variant(request, vary_on_user):
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    # непоказанные сообщения выводятся в base.html — такую страницу не кешируем
+    if 'messages' in request.COOKIES or request.session.get('_messages'):
+        return None
+    if not vary_on_user:
+        return 'all'
+    return 'member' if request.user.is_authenticated else 'guest'
+
+
+# ----------------------
+# Персональные вставки
+# ----------------------
+def mark_hole(name, html):
+    return f'<!--personal:{name}-->{html}<!--/personal-->'
+
+
+def _shell(content):
+    return _HOLE_RE.sub(lambda match: mark_hole(match.group(1), ''), content)
+
+
+def _fill(request, shell):
+    rendered = {}
+
+    def render(match):
+        name = match.group(1)
+        if name not in rendered:
+            rendered[name] = render_to_string(name, request=request)
+        return mark_hole(name, rendered[name])
+
+    return _HOLE_RE.sub(render, shell)
+
+
+# ----------------------
+# Декоратор
+# ----------------------
+def _response(request, entry, state):
+    content = entry['content']
+    if entry['holes']:
+        content = _fill(request, content)
+    response = HttpResponse(content, content_type=entry['content_type'])
+    response['X-Page-Cache'] = state
+    return response
+
+
+def _cacheable(request, response):
+    if response.status_code != 200 or response.cookies or request.session.modified:
+        return False
+    return 'private' not in response.get('Cache-Control', '')
+
+
+def _lookup(request, variant):
+    """(ответ из кеша или None, ключ, взята ли блокировка пересборки)"""
+    key = page_key(request, variant)
+    entry = cache.get(key)
+    if entry is None:
+        return None, key, False
+    fresh = entry['fresh_until'] > time.time() and tag_versions(entry['tags']) == entry['versions']
+    if fresh:
+        return _response(request, entry, 'hit'), key, False
+    # пересобирает тот, кто взял блокировку; остальные получают устаревшую копию
+    if not cache.add(f'{key}:lock', 1, LOCK_TIMEOUT):
+        return _response(request, entry, 'stale'), key, False
+    return None, key, True
+
+
+def _begin(request):
+    request._page_tags = set(DEFAULT_TAGS)
+    request._page_shell = True
+
+
+def _store(request, response, key, locked):
+    try:
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        if _cacheable(request, response):
+            content = response.content.decode(response.charset)
+            shell = _shell(content)
+            cache.set(key, {
+                'content': shell,
+                'content_type': response['Content-Type'],
+                'holes': '<!--personal:' in shell,
+                'tags': sorted(request._page_tags),
+                'versions': tag_versions(request._page_tags),
+                'fresh_until': time.time() + PAGE_FRESH,
+            }, PAGE_TIMEOUT)
+            response['X-Page-Cache'] = 'miss'
+    finally:
+        if locked:
+            cache.delete(f'{key}:lock')
+    return response
+
+
+def cached_page(view=None, vary_on_user=True):
+    """
+    Кеш страницы целиком для одинаковых у всех покупателей ответов.
+
+    Ключ — путь и нормализованная строка запроса. Вместе со страницей хранятся
+    версии её тегов (add_tags): изменение товара или категории делает страницу
+    устаревшей. Устаревшую страницу пересобирает один запрос, остальные в это
+    время получают прежнюю версию (stale-while-revalidate).
+
+    Персональные части ({% personal %}: вход, корзина, избранное) в кеш не
+    попадают и дорисовываются для каждого запроса.
+
+    Работает и с async-представлениями: кеш и вставки читаются в потоке.
+    """
+    def decorator(view_func):
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapped(request, *args, **kwargs):
+                variant = await sync_to_async(_variant)(request, vary_on_user)
+                if variant is None:
+                    return await view_func(request, *args, **kwargs)
+                response, key, locked = await sync_to_async(_lookup)(request, variant)
+                if response is not None:
+                    return response
+                _begin(request)
+                try:
+                    response = await view_func(request, *args, **kwargs)
+                except BaseException:
+                    if locked:
+                        await cache.adelete(f'{key}:lock')
+                    raise
+                return await sync_to_async(_store)(request, response, key, locked)
+
+            return async_wrapped
+
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            variant = _variant(request, vary_on_user)
+            if variant is None:
+                return view_func(request, *args, **kwargs)
+            response, key, locked = _lookup(request, variant)
+            if response is not None:
+                return response
+            _begin(request)
+            try:
+                response = view_func(request, *args, **kwargs)
+            except BaseException:
+                if locked:
+                    cache.delete(f'{key}:lock')
+                raise
+            return _store(request, response, key, locked)
+
+        return wrapped
+
+    if view is not None:
+        return decorator(view)
+    return decorator
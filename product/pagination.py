@@ -0,0 +1,124 @@
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+PAGE_SIZES = (20, 50, 100)
+DEFAULT_PAGE_SIZE = PAGE_SIZES[0]
+
+# Порядок сортировки каталога -> поля ключа (поле, по убыванию); id — стабильный разрыв ничьих
+SORT_KEYS = {
+    'newest': (('id', True),),
+    'price_asc': (('price', False), ('id', False)),
+    'price_desc': (('price', True), ('id', True)),
+    'popular': (('popularity', True), ('id', True)),
+}
+
+# Списки заказов: новые сверху
+ORDER_SORT_KEYS = {
+    'newest': (('created_at', True), ('id', True)),
+}
+ORDERS_PAGE_SIZE = 50
+
+_CURSOR_SALT = 'product.pagination.cursor'
+
+
+def clamp_page_size(value):
+    """Размер страницы из параметра show, приведённый к допустимому набору"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    allowed = [size for size in PAGE_SIZES if size <= value]
+    return allowed[-1] if allowed else DEFAULT_PAGE_SIZE
+
+
+def order_by_keys(queryset, sort, sort_keys=SORT_KEYS):
+    return queryset.order_by(*[f"-{field}" if desc else field for field, desc in sort_keys[sort]])
+
+
+# ----------------------
+# Курсоры
+# ----------------------
+def encode_cursor(sort, keys, obj, direction):
+    values = [str(getattr(obj, field)) for field, _ in keys]
+    return signing.dumps({'s': sort, 'd': direction, 'v': values}, salt=_CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token, sort, keys, model):
+    """(direction, values) из токена или None, если токен битый или от другой сортировки"""
+    try:
+        data = signing.loads(token, salt=_CURSOR_SALT)
+        if data['s'] != sort or data['d'] not in ('next', 'prev') or len(data['v']) != len(keys):
+            return None
+        values = [model._meta.get_field(field).to_python(value) for (field, _), value in zip(keys, data['v'])]
+    except (signing.BadSignature, KeyError, TypeError, ValueError, ValidationError):
+        return None
+    return data['d'], values
+
+
+def _seek(keys, values, backwards):
+    # (a, b) после (x, y): a > x ИЛИ (a = x И b > y); знак зависит от направления поля
+    condition = Q()
+    for position, (field, desc) in enumerate(keys):
+        equal = {name: value for (name, _), value in zip(keys[:position], values[:position])}
+        lookup = 'lt' if desc != backwards else 'gt'
+        condition |= Q(**equal, **{f"{field}__{lookup}": values[position]})
+    return condition
+
+
+class KeysetPage:
+    """Страница по курсору: стоимость не зависит от глубины"""
+
+    def __init__(self, object_list, sort, keys, has_next, has_previous):
+        self.object_list = object_list
+        self.sort = sort
+        self.keys = keys
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    @property
+    def next_cursor(self):
+        if self.has_next_page and self.object_list:
+            return encode_cursor(self.sort, self.keys, self.object_list[-1], 'next')
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous_page and self.object_list:
+            return encode_cursor(self.sort, self.keys, self.object_list[0], 'prev')
+        return None
+
+
+def paginate_keyset(queryset, sort, page_size, cursor=None, sort_keys=SORT_KEYS):
+    """Страница queryset после/до курсора; читается page_size + 1 строк"""
+    keys = sort_keys[sort]
+    decoded = decode_cursor(cursor, sort, keys, queryset.model) if cursor else None
+    if decoded is None:
+        rows = list(order_by_keys(queryset, sort, sort_keys)[:page_size + 1])
+        return KeysetPage(rows[:page_size], sort, keys, len(rows) > page_size, False)
+
+    direction, values = decoded
+    backwards = direction == 'prev'
+    ordering = [f"-{field}" if desc != backwards else field for field, desc in keys]
+    rows = list(queryset.filter(_seek(keys, values, backwards)).order_by(*ordering)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+        return KeysetPage(rows, sort, keys, True, has_more)
+    return KeysetPage(rows, sort, keys, has_more, True)
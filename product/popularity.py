@@ -0,0 +1,48 @@
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from . import pagecache
+from .models import Product
+from .suggestions import index as suggestions_index
+
+
+def adjust_popularity(product_id, delta):
+    """
+    Атомарно сдвигает счётчик популярности товара на delta. UPDATE идёт без сигналов
+    товара, поэтому страницы с сортировкой по популярности сбрасываются здесь (тег popular).
+    """
+    if not product_id or not delta:
+        return
+    Product.objects.filter(pk=product_id).update(popularity=Greatest(F('popularity') + delta, 0))
+    suggestions_index.adjust_popularity(product_id, delta)
+    pagecache.purge('popular')
+
+
+def adjust_popularity_many(deltas):
+    """То же для нескольких товаров {id: delta} одним UPDATE"""
+    deltas = {product_id: delta for product_id, delta in deltas.items() if product_id and delta}
+    if not deltas:
+        return
+    shift = Case(*(When(pk=product_id, then=Value(delta)) for product_id, delta in deltas.items()), default=Value(0))
+    Product.objects.filter(pk__in=deltas).update(popularity=Greatest(F('popularity') + shift, 0))
+    for product_id, delta in deltas.items():
+        suggestions_index.adjust_popularity(product_id, delta)
+    pagecache.purge('popular')
+
+
+def _quantity_subquery(model):
+    total = model.objects.filter(product_id=OuterRef('pk')).order_by().values('product_id').annotate(
+        total=Sum('quantity')
+    ).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def recompute_popularity():
+    """Пересчитывает популярность всех товаров одним UPDATE; возвращает число товаров"""
+    from accounts.models import CartItem, OrderItem
+
+    updated = Product.objects.update(
+        popularity=_quantity_subquery(CartItem) + _quantity_subquery(OrderItem)
+    )
+    pagecache.purge('popular')
+    return updated
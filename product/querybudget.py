@@ -0,0 +1,75 @@
+import re
+from collections import Counter
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+# запрос одной формы дважды за ответ — N+1 или повторное чтение тех же данных
+N_PLUS_ONE_THRESHOLD = 2
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"IN \((?:\?, )*\?\)")
+_SAVEPOINT = re.compile(r'^(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT) ')
+
+
+def shape(sql):
+    """SQL без значений: запросы, отличающиеся только параметрами, получают одну форму"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class QueryLog(CaptureQueriesContext):
+    """
+    Все SQL-запросы внутри блока, как CaptureQueriesContext, плюс группировка
+    по форме запроса. Точки сохранения транзакций не считаются.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        super().__init__(connections[using])
+
+    @property
+    def statements(self):
+        return [query['sql'] for query in self.captured_queries if not _SAVEPOINT.match(query['sql'])]
+
+    def __len__(self):
+        return len(self.statements)
+
+    def shapes(self):
+        return Counter(shape(sql) for sql in self.statements)
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """{форма: сколько раз} для форм, выполненных threshold раз и больше"""
+        return {sql: count for sql, count in self.shapes().items() if count >= threshold}
+
+    def report(self):
+        return '\n'.join(f"{number}. {sql}" for number, sql in enumerate(self.statements, start=1))
+
+
+class QueryBudgetMixin:
+    """
+    Для TestCase: запрос к представлению по имени URL с проверкой бюджета
+    запросов и отсутствия N+1. Бюджеты — в QUERY_BUDGETS {имя URL: максимум}.
+    """
+    QUERY_BUDGETS = {}
+    n_plus_one_threshold = N_PLUS_ONE_THRESHOLD
+
+    def request_within_budget(self, method, name, args=(), data=None, budget=None, **extra):
+        if budget is None:
+            budget = self.QUERY_BUDGETS[name]
+        with QueryLog() as log:
+            response = getattr(self.client, method)(reverse(name, args=args), data, **extra)
+            if response.streaming:
+                # потоковый ответ читает базу по мере выдачи — дочитываем внутри замера
+                response.streaming_content = [b''.join(response.streaming_content)]
+
+        # страница ошибки укладывается в любой бюджет — такой замер ничего не проверяет
+        self.assertLess(response.status_code, 400, f"{name}: ответ {response.status_code}")
+        repeated = log.repeated(self.n_plus_one_threshold)
+        self.assertFalse(repeated, "N+1 в {}:\n{}\n\nВсе запросы:\n{}".format(
+            name, '\n'.join(f"{count} × {sql}" for sql, count in repeated.items()), log.report(),
+        ))
+        self.assertLessEqual(len(log), budget, f"{name}: {len(log)} запросов при бюджете {budget}:\n{log.report()}")
+        return response
@@ -0,0 +1,183 @@
+import heapq
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import pagecache
+from .importer import batched
+from .models import CoPurchase, Product, ProductNeighbor, RecommendationState
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:  # без numpy/scipy пары считаются на чистом Python — медленнее, результат тот же
+    numpy = sparse = None
+
+TOP_K = 8
+# оптовые заказы и корзины-склады дают квадратичное число пар и мало говорят о связи товаров
+MAX_BASKET = 50
+ORDER_CHUNK = 5000
+PRODUCT_CHUNK = 500
+# корзина — намерение, а не покупка
+CART_WEIGHT = 0.5
+
+
+# ----------------------
+# Совместные покупки
+# ----------------------
+def count_pairs(baskets):
+    """{(a, b): в скольких корзинах оба товара} для a != b; baskets — наборы id товаров"""
+    baskets = [sorted(basket) for basket in baskets if 1 < len(basket) <= MAX_BASKET]
+    if not baskets:
+        return {}
+    if sparse is None:
+        pairs = Counter()
+        for basket in baskets:
+            for a, b in combinations(basket, 2):
+                pairs[a, b] += 1
+                pairs[b, a] += 1
+        return pairs
+
+    # X — корзины × товары (0/1), XᵀX — число общих корзин для каждой пары товаров
+    products = numpy.unique(numpy.fromiter((pk for basket in baskets for pk in basket), dtype=numpy.int64))
+    rows = numpy.repeat(numpy.arange(len(baskets)), [len(basket) for basket in baskets])
+    cols = numpy.searchsorted(products, numpy.fromiter(
+        (pk for basket in baskets for pk in basket), dtype=numpy.int64,
+    ))
+    matrix = sparse.csr_matrix((numpy.ones(len(rows), dtype=numpy.int32), (rows, cols)),
+                               shape=(len(baskets), len(products)))
+    counts = (matrix.T @ matrix).tocoo()
+    keep = counts.row != counts.col
+    return {
+        (int(products[a]), int(products[b])): int(count)
+        for a, b, count in zip(counts.row[keep], counts.col[keep], counts.data[keep])
+    }
+
+
+def _baskets(rows):
+    baskets = defaultdict(set)
+    for basket_id, product_id in rows:
+        baskets[basket_id].add(product_id)
+    return baskets
+
+
+_ADD_PAIRS = (
+    'INSERT INTO {table} ({product}, {other}, {orders}) VALUES (%s, %s, %s) '
+    'ON CONFLICT ({product}, {other}) DO UPDATE SET {orders} = {table}.{orders} + excluded.{orders}'
+)
+
+
+def _add_pairs(pairs):
+    meta = CoPurchase._meta
+    sql = _ADD_PAIRS.format(
+        table=connection.ops.quote_name(meta.db_table),
+        **{name: connection.ops.quote_name(meta.get_field(name).column) for name in ('product', 'other', 'orders')},
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(a, b, count) for (a, b), count in pairs.items()])
+
+
+def count_new_orders(after_id):
+    """
+    Добавляет в CoPurchase пары из заказов с id > after_id (кроме отменённых).
+    Возвращает (последний учтённый id заказа, id товаров, у которых изменились пары).
+    """
+    from accounts.models import OrderItem
+
+    items = OrderItem.objects.filter(order_id__gt=after_id, product__isnull=False).exclude(order__status='canceled')
+    order_ids = list(items.order_by('order_id').values_list('order_id', flat=True).distinct())
+    last_id, touched = after_id, set()
+    for chunk in batched(order_ids, ORDER_CHUNK):
+        baskets = _baskets(items.filter(order_id__in=chunk).values_list('order_id', 'product_id'))
+        pairs = count_pairs(baskets.values())
+        with transaction.atomic():
+            _add_pairs(pairs)
+        touched.update(a for a, _ in pairs)
+        last_id = chunk[-1]
+    return last_id, touched
+
+
+def _cart_pairs(product_ids):
+    """Пары из текущих корзин, в которых есть хотя бы один из product_ids"""
+    from accounts.models import CartItem
+
+    carts = CartItem.objects.filter(product_id__in=product_ids).values('profile_id')
+    baskets = _baskets(CartItem.objects.filter(profile_id__in=carts).values_list('profile_id', 'product_id'))
+    return count_pairs(baskets.values())
+
+
+# ----------------------
+# Первые K соседей
+# ----------------------
+def rank_neighbors(product_ids, top_k=TOP_K):
+    """Пересчитывает ProductNeighbor для product_ids: заказы из CoPurchase плюс текущие корзины"""
+    for chunk in batched(sorted(product_ids), PRODUCT_CHUNK):
+        scores = defaultdict(Counter)
+        for product_id, other_id, orders in CoPurchase.objects.filter(product_id__in=chunk).values_list(
+            'product_id', 'other_id', 'orders',
+        ):
+            scores[product_id][other_id] += orders
+        chunk_ids = set(chunk)
+        for (a, b), count in _cart_pairs(chunk).items():
+            if a in chunk_ids:
+                scores[a][b] += count * CART_WEIGHT
+
+        neighbors = []
+        for product_id, candidates in scores.items():
+            best = heapq.nlargest(top_k, candidates.items(), key=lambda item: (item[1], -item[0]))
+            neighbors.extend(
+                ProductNeighbor(product_id=product_id, neighbor_id=other_id, rank=rank, score=score)
+                for rank, (other_id, score) in enumerate(best)
+            )
+        with transaction.atomic():
+            ProductNeighbor.objects.filter(product_id__in=chunk).delete()
+            ProductNeighbor.objects.bulk_create(neighbors)
+        # выдача на странице товара закеширована вместе с рекомендациями
+        pagecache.purge(*(f'product:{pk}' for pk in chunk))
+
+
+def refresh(full=False, top_k=TOP_K):
+    """
+    Инкрементальное обновление для запуска по расписанию: учитываются только
+    новые заказы и корзины, в которые с прошлого запуска добавляли товары,
+    и пересчитываются соседи затронутых товаров. Удаления из корзин и отмены
+    уже учтённых заказов исправляет полный пересчёт (full=True).
+    Возвращает (id последнего учтённого заказа, число пересчитанных товаров).
+    """
+    from accounts.models import CartItem
+
+    state, _ = RecommendationState.objects.get_or_create(pk=1)
+    started = timezone.now()
+    if full:
+        CoPurchase.objects.all().delete()
+        ProductNeighbor.objects.all().delete()
+        state.last_order_id, state.refreshed_at = 0, None
+
+    last_id, touched = count_new_orders(state.last_order_id)
+    carts = CartItem.objects.all()
+    if state.refreshed_at is not None:
+        carts = carts.filter(profile_id__in=CartItem.objects.filter(
+            added_at__gte=state.refreshed_at,
+        ).values('profile_id'))
+    touched.update(carts.values_list('product_id', flat=True).distinct())
+    rank_neighbors(touched, top_k)
+
+    state.last_order_id, state.refreshed_at = last_id, started
+    state.save()
+    return last_id, len(touched)
+
+
+# ----------------------
+# Выдача
+# ----------------------
+def related_products(product, limit=4):
+    """Рекомендации товара по индексу (product, rank); не хватает — товары той же категории"""
+    products = Product.objects.select_related('category')
+    related = list(products.filter(recommended_with__product=product).order_by('recommended_with__rank')[:limit])
+    if len(related) < limit and product.category_id:
+        related += products.filter(category_id=product.category_id).exclude(
+            pk__in=[product.pk, *(p.pk for p in related)],
+        )[:limit - len(related)]
+    return related
@@ -0,0 +1,164 @@
+import logging
+import os
+import posixpath
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from . import fragments, pagecache
+
+logger = logging.getLogger(__name__)
+
+# Ширины вариантов (px) и форматы: WebP для современных браузеров, JPEG — запасной
+WIDTHS = (160, 320, 640, 1024)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+RENDITIONS_DIR = 'renditions'
+
+_READY_KEY = 'renditions:ready:{}'
+# отрицательный ответ живёт недолго: варианты могут дособираться в пуле процессов
+# или командой build_renditions, а до тех пор не спрашиваем хранилище на каждом показе
+NOT_READY_TIMEOUT = 5 * 60
+
+
+# ----------------------
+# Имена вариантов
+# ----------------------
+def rendition_name(name, width, fmt):
+    """products/phone.png -> renditions/products/phone_320.webp"""
+    stem = os.path.splitext(name)[0]
+    return posixpath.join(RENDITIONS_DIR, f"{stem}_{width}.{'jpg' if fmt == 'jpeg' else fmt}")
+
+
+def rendition_names(name):
+    return [rendition_name(name, width, fmt) for fmt in FORMATS for width in WIDTHS]
+
+
+def rendition_url(name, width, fmt='jpeg', storage=default_storage):
+    return storage.url(rendition_name(name, width, fmt))
+
+
+def renditions_ready(name, storage=default_storage):
+    """Есть ли варианты для файла; ответ запоминается в кеше, отрицательный — на NOT_READY_TIMEOUT"""
+    key = _READY_KEY.format(name)
+    ready = cache.get(key)
+    if ready is not None:
+        return ready
+    ready = all(storage.exists(rendition_name(name, width, 'webp')) for width in (WIDTHS[0], WIDTHS[-1]))
+    cache.set(key, ready, None if ready else NOT_READY_TIMEOUT)
+    return ready
+
+
+# ----------------------
+# Генерация
+# ----------------------
+def _prepare(image, fmt):
+    image = ImageOps.exif_transpose(image)
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        # JPEG без прозрачности: кладём картинку на белый фон
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    if fmt == 'webp' and image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def _save(storage, name, content):
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(content))
+
+
+def generate_renditions(name, storage=default_storage):
+    """Создаёт все варианты файла; картинки меньше нужной ширины не увеличиваются"""
+    with storage.open(name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+
+    created = []
+    for fmt, (pil_format, options) in FORMATS.items():
+        prepared = _prepare(original, fmt)
+        for width in WIDTHS:
+            variant = prepared.copy()
+            if variant.width > width:
+                variant.thumbnail((width, width * variant.height // variant.width), Image.LANCZOS)
+            buffer = BytesIO()
+            variant.save(buffer, pil_format, **options)
+            target = rendition_name(name, width, fmt)
+            _save(storage, target, buffer.getvalue())
+            created.append(target)
+    # сбрасывает и запомненное «вариантов нет»
+    cache.set(_READY_KEY.format(name), True, None)
+    return created
+
+
+def _generate_safely(name):
+    try:
+        generate_renditions(name)
+        return name, None
+    except Exception as exc:
+        logger.warning("Не удалось создать варианты %s: %s", name, exc)
+        return name, str(exc)
+
+
+# ----------------------
+# Пул процессов
+# ----------------------
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'RENDITION_WORKERS', 2))
+    return _executor
+
+
+def _finished(name, error, tags):
+    """
+    Варианты готовы: отмечаем это в кеше веб-процесса (дочерний процесс пишет
+    в свой LocMem) и сбрасываем карточки и страницы tags, собранные с обычным <img>.
+    """
+    if error is not None:
+        return
+    cache.set(_READY_KEY.format(name), True, None)
+    fragments.invalidate_cards()
+    pagecache.purge(*tags)
+
+
+def _on_done(tags, future):
+    if future.exception() is None:
+        _finished(*future.result(), tags)
+
+
+def schedule(name, tags=()):
+    """
+    Генерация вариантов после загрузки файла. Ресайз нагружает CPU,
+    поэтому он идёт в пуле процессов и не держит поток запроса.
+    RENDITION_WORKERS = 0 — генерировать сразу в текущем процессе.
+    tags — теги кеша страниц, где показана картинка.
+    """
+    if not getattr(settings, 'RENDITION_WORKERS', 2):
+        _finished(*_generate_safely(name), tags)
+        return
+    _get_executor().submit(_generate_safely, name).add_done_callback(partial(_on_done, tags))
+
+
+def generate_many(names, workers=None):
+    """Генерирует варианты для списка файлов; возвращает список (имя, ошибка)"""
+    names = list(names)
+    if workers == 0 or len(names) < 2:
+        return [_generate_safely(name) for name in names]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_generate_safely, name) for name in names]
+        return [future.result() for future in as_completed(futures)]
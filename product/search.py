@@ -0,0 +1,134 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'product_search'
+
+# Содержимое индекса: id товара -> название, описание, бренд, категория
+_SOURCE_SQL = """
+    SELECT p.id, p.name, p.description, COALESCE(b.name, ''), COALESCE(c.name, '')
+    FROM product_product p
+    LEFT JOIN product_brand b ON b.id = p.brand_id
+    LEFT JOIN product_category c ON c.id = p.category_id
+"""
+
+
+def is_enabled():
+    """Полнотекстовый индекс есть только в SQLite (FTS5)"""
+    return connection.vendor == 'sqlite'
+
+
+def create_index(cursor):
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        f"name, description, brand, category, tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def drop_index(cursor):
+    cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+# ----------------------
+# Обновление индекса
+# ----------------------
+def _reindex(where, params):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN (SELECT p.id FROM product_product p WHERE {where})",
+            params,
+        )
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE}(rowid, name, description, brand, category) {_SOURCE_SQL} WHERE {where}",
+            params,
+        )
+
+
+def index_product(product_id):
+    if is_enabled():
+        _reindex('p.id = %s', [product_id])
+
+
+def index_category(category_id):
+    if is_enabled():
+        _reindex('p.category_id = %s', [category_id])
+
+
+def index_brand(brand_id):
+    if is_enabled():
+        _reindex('p.brand_id = %s', [brand_id])
+
+
+def index_products(product_ids, batch_size=500):
+    if not is_enabled():
+        return
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        _reindex(f"p.id IN ({', '.join(['%s'] * len(batch))})", batch)
+
+
+def remove_product(product_id):
+    if is_enabled():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [product_id])
+
+
+def rebuild_index():
+    """Полностью пересобирает индекс; возвращает число проиндексированных товаров"""
+    if not is_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        drop_index(cursor)
+        create_index(cursor)
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}(rowid, name, description, brand, category) {_SOURCE_SQL}")
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+        cursor.execute("SELECT COUNT(*) FROM product_product")
+        return cursor.fetchone()[0]
+
+
+# ----------------------
+# Поиск
+# ----------------------
+def build_match_expression(query):
+    """Строка запроса -> выражение MATCH: все слова, каждое как префикс"""
+    terms = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _fallback_q(query):
+    return Q(name__icontains=query) | Q(category__name__icontains=query)
+
+
+def filter_by_query(queryset, query):
+    """Оставляет в queryset товары, найденные по запросу"""
+    expression = build_match_expression(query)
+    if not is_enabled() or not expression:
+        return queryset.filter(_fallback_q(query))
+    return queryset.filter(id__in=RawSQL(
+        f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [expression]
+    ))
+
+
+def order_by_relevance(queryset, query):
+    """
+    Сортирует queryset по релевантности bm25 (меньше — лучше), при равенстве — новые выше.
+    Название весит больше бренда и категории, описание — меньше всего.
+    """
+    expression = build_match_expression(query)
+    if not is_enabled() or not expression:
+        return queryset.order_by('-id')
+    table = queryset.model._meta.db_table
+    return queryset.annotate(search_rank=RawSQL(
+        f"SELECT bm25({SEARCH_TABLE}, 10.0, 1.0, 4.0, 4.0) FROM {SEARCH_TABLE} "
+        f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = \"{table}\".\"id\"",
+        [expression],
+        output_field=FloatField(),
+    )).order_by('search_rank', '-id')
+
+
+def search_products(queryset, query):
+    """Найденные по запросу товары, отсортированные по релевантности"""
+    return order_by_relevance(filter_by_query(queryset, query), query)
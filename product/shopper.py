@@ -0,0 +1,111 @@
+from functools import cached_property
+
+from django.db.models import Count
+
+from accounts.models import CartSummary, GuestCart, Profile
+
+from . import wishlist
+from .models import Category, Product
+
+
+class ShopperState:
+    """
+    Состояние покупателя на время одного запроса: профиль, корзина, избранное
+    и категории. Каждая часть загружается не больше одного раза и только
+    при первом обращении — страницы без навбара не делают лишних запросов.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def profile(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return None
+        try:
+            return user.profile
+        except Profile.DoesNotExist:
+            return None
+
+    # ----------------------
+    # Корзина
+    # ----------------------
+    @cached_property
+    def cart_summary(self):
+        """Итоги корзины (CartSummary) авторизованного покупателя или None"""
+        if self.profile is None:
+            return None
+        return CartSummary.for_profile(self.profile.pk)
+
+    @cached_property
+    def _cart(self):
+        if self.profile is not None:
+            summary = self.cart_summary
+            return list(self.profile.cartitem_set.select_related('product')), summary.item_count, summary.total
+
+        # корзина гостя хранит только количества — товары и цены читаются одним запросом
+        quantities = GuestCart.items_for(GuestCart.token_from(self.request))
+        items, qty, total = [], 0, 0
+        if quantities:
+            products = Product.objects.filter(pk__in=quantities).only('id', 'name', 'slug', 'price', 'image')
+            for product in products.order_by('id'):
+                quantity = quantities[product.pk]
+                items.append({'product': product, 'quantity': quantity, 'total_price': quantity * product.price})
+                qty += quantity
+                total += quantity * product.price
+        return items, qty, total
+
+    @property
+    def cart_items(self):
+        return self._cart[0]
+
+    @property
+    def cart_qty(self):
+        if self.cart_summary is not None:
+            return self.cart_summary.item_count
+        return self._cart[1]
+
+    @property
+    def cart_total(self):
+        if self.cart_summary is not None:
+            return self.cart_summary.total
+        return self._cart[2]
+
+    # ----------------------
+    # Избранное
+    # ----------------------
+    @cached_property
+    def wishlist_ids(self):
+        """WishlistIds из кеша (см. product/wishlist.py); у гостя — пустое множество"""
+        if self.profile is None:
+            return frozenset()
+        return wishlist.get_ids(self.profile.pk)
+
+    @property
+    def wishlist_qty(self):
+        return len(self.wishlist_ids)
+
+    @property
+    def wishlist_inline(self):
+        # большое избранное не встраивается в каждую страницу — сердечки спрашиваются пачкой
+        return self.wishlist_ids if len(self.wishlist_ids) <= wishlist.MAX_INLINE else None
+
+    # ----------------------
+    # Категории
+    # ----------------------
+    @cached_property
+    def categories(self):
+        return list(Category.objects.order_by('path'))
+
+    @cached_property
+    def top_categories(self):
+        return list(Category.objects.annotate(product_count=Count('products')).order_by('-product_count')[:5])
+
+
+def get_shopper(request):
+    """ShopperState текущего запроса (создаётся один раз на запрос)"""
+    state = getattr(request, '_shopper', None)
+    if state is None:
+        state = request._shopper = ShopperState(request)
+    return state
@@ -0,0 +1,282 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from accounts.models import CartItem, OrderItem, Profile
+
+from . import fragments, histograms, pagecache, renditions, search, suggestions, wishlist
+from .popularity import adjust_popularity
+from .facets import invalidate_facets
+from .models import Brand, Category, Product, ProductImage, ProductTombstone
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def catalog_changed(sender, instance, **kwargs):
+    # удаление бренда обнуляет brand_id через UPDATE без сигналов Product,
+    # а поиск идёт и по названию категории — поэтому слушаем все три модели
+    invalidate_facets()
+    if sender is not Product:
+        # карточки показывают название категории; изменения товара меняют его updated_at
+        fragments.invalidate_cards()
+
+
+# ----------------------
+# Полнотекстовый индекс
+# ----------------------
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_product(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created=False, **kwargs):
+    if not created:
+        search.index_category(instance.pk)
+
+
+@receiver(post_save, sender=Brand)
+def index_brand_products(sender, instance, created=False, **kwargs):
+    if not created:
+        search.index_brand(instance.pk)
+
+
+@receiver(pre_delete, sender=Brand)
+def remember_brand_products(sender, instance, **kwargs):
+    # после удаления бренда товары уже не найти по brand_id
+    instance._product_ids = list(instance.products.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Brand)
+def reindex_brand_products(sender, instance, **kwargs):
+    search.index_products(getattr(instance, '_product_ids', []))
+
+
+# ----------------------
+# Инкрементальная выгрузка
+# ----------------------
+# в выгрузке есть названия категории и бренда, а ?since= смотрит на updated_at товаров
+@receiver(post_init, sender=Category)
+@receiver(post_init, sender=Brand)
+def remember_export_names(sender, instance, **kwargs):
+    instance._export_names = (instance.__dict__.get('name'), instance.__dict__.get('slug')) if instance.pk else None
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Brand)
+def touch_renamed_products(sender, instance, created, **kwargs):
+    names = (instance.name, instance.slug)
+    if not created and names != getattr(instance, '_export_names', None):
+        instance.products.update(updated_at=timezone.now())
+    instance._export_names = names
+
+
+@receiver(post_delete, sender=Brand)
+def touch_unbranded_products(sender, instance, **kwargs):
+    Product.objects.filter(pk__in=getattr(instance, '_product_ids', [])).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Product)
+def record_tombstone(sender, instance, **kwargs):
+    ProductTombstone.objects.create(product_id=instance.pk, slug=instance.slug)
+
+
+# ----------------------
+# Индекс подсказок поиска
+# ----------------------
+def _suggestion_state(instance):
+    return instance.__dict__.get('name'), instance.__dict__.get('category_id')
+
+
+@receiver(post_init, sender=Product)
+def remember_suggestion(sender, instance, **kwargs):
+    instance._suggestion_state = _suggestion_state(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Product)
+def update_suggestions(sender, instance, created, **kwargs):
+    # подсказки зависят только от названия и категории: смена цены или наличия
+    # не заставляет остальные процессы пересобирать индекс
+    state = _suggestion_state(instance)
+    if not created and state == getattr(instance, '_suggestion_state', None):
+        return
+    instance._suggestion_state = state
+    suggestions.index.update(instance.pk, instance.name, instance.category_id)
+    suggestions.bump_generation()
+
+
+@receiver(post_delete, sender=Product)
+def remove_suggestion(sender, instance, **kwargs):
+    suggestions.index.remove(instance.pk)
+    suggestions.bump_generation()
+
+
+# ----------------------
+# Популярность: количество в корзинах и заказах
+# ----------------------
+@receiver(post_init, sender=CartItem)
+@receiver(post_init, sender=OrderItem)
+def remember_quantity(sender, instance, **kwargs):
+    instance._counted = (instance.product_id, instance.quantity) if instance.pk else (None, 0)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_save, sender=OrderItem)
+def count_quantity(sender, instance, **kwargs):
+    old_product_id, old_quantity = getattr(instance, '_counted', (None, 0))
+    if old_product_id != instance.product_id:
+        adjust_popularity(old_product_id, -old_quantity)
+        old_quantity = 0
+    adjust_popularity(instance.product_id, instance.quantity - old_quantity)
+    instance._counted = (instance.product_id, instance.quantity)
+
+
+@receiver(post_delete, sender=CartItem)
+@receiver(post_delete, sender=OrderItem)
+def uncount_quantity(sender, instance, **kwargs):
+    old_product_id, old_quantity = getattr(instance, '_counted', (None, 0))
+    adjust_popularity(old_product_id, -old_quantity)
+
+
+# ----------------------
+# Варианты картинок
+# ----------------------
+def _image_name(instance):
+    # сырое значение поля: без создания FieldFile и без загрузки отложенного поля
+    value = instance.__dict__.get('image')
+    return getattr(value, 'name', value) or None
+
+
+@receiver(post_init, sender=Product)
+@receiver(post_init, sender=Category)
+@receiver(post_init, sender=ProductImage)
+def remember_image(sender, instance, **kwargs):
+    instance._image_name = _image_name(instance) if instance.pk else None
+
+
+def _image_tags(instance):
+    # страницы, которые надо пересобрать, когда варианты картинки будут готовы
+    if isinstance(instance, ProductImage):
+        return (f'product:{instance.product_id}',)
+    if isinstance(instance, Category):
+        return ('catalog', 'taxonomy', f'category:{instance.pk}')
+    return ('catalog', f'product:{instance.pk}', *_category_tags({instance.category_id}))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=ProductImage)
+def render_uploaded_image(sender, instance, **kwargs):
+    name = _image_name(instance)
+    if name and name != getattr(instance, '_image_name', None):
+        tags = _image_tags(instance)
+        transaction.on_commit(lambda: renditions.schedule(name, tags))
+    instance._image_name = name
+
+
+# ----------------------
+# Кеш страниц
+# ----------------------
+@receiver(post_init, sender=Product)
+def remember_category(sender, instance, **kwargs):
+    instance._page_category_id = instance.__dict__.get('category_id')
+
+
+def _category_tags(category_ids):
+    # товар виден и на страницах всех родительских категорий
+    tags = set()
+    for category in Category.objects.filter(pk__in=[pk for pk in category_ids if pk]).only('path'):
+        tags.update(f'category:{pk}' for pk in [category.pk, *category.ancestor_ids()])
+    return tags
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def purge_product_pages(sender, instance, **kwargs):
+    category_ids = {instance.category_id, getattr(instance, '_page_category_id', None)}
+    pagecache.purge('catalog', f'product:{instance.pk}', *_category_tags(category_ids))
+    instance._page_category_id = instance.category_id
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def purge_catalog_pages(sender, instance, **kwargs):
+    # названия категорий и брендов есть в навбаре, хлебных крошках и карточках
+    pagecache.purge('catalog', 'taxonomy')
+
+
+# ----------------------
+# Избранное
+# ----------------------
+# toggle/remove из product/wishlist.py сами обновляют кеш; здесь — остальные
+# изменения таблицы связей: admin, profile.favorites.add, product.favorited_by.clear
+@receiver(m2m_changed, sender=Profile.favorites.through)
+def wishlist_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            wishlist.invalidate(instance.pk)
+    elif action == 'pre_clear':
+        instance._wishlist_profile_ids = list(instance.favorited_by.values_list('id', flat=True))
+    elif action == 'post_clear':
+        wishlist.invalidate(*getattr(instance, '_wishlist_profile_ids', []))
+    elif action.startswith('post_'):
+        wishlist.invalidate(*pk_set)
+
+
+@receiver(pre_delete, sender=Product)
+def remember_wishlist_profiles(sender, instance, **kwargs):
+    # строки связей удаляются каскадом без m2m_changed
+    instance._wishlist_profile_ids = list(instance.favorited_by.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def forget_wishlist_product(sender, instance, **kwargs):
+    wishlist.invalidate(*getattr(instance, '_wishlist_profile_ids', []))
+
+
+# ----------------------
+# Гистограмма цен
+# ----------------------
+def _price_state(instance):
+    values = instance.__dict__
+    if 'category_id' not in values or 'price' not in values:
+        return None
+    return values['category_id'], values['price']
+
+
+@receiver(post_init, sender=Product)
+def remember_price(sender, instance, **kwargs):
+    instance._histogram_state = _price_state(instance)
+
+
+@receiver(pre_save, sender=Product)
+def load_price(sender, instance, **kwargs):
+    # товар загружен через only()/defer() — прежние цену и категорию читаем из базы
+    if not instance._state.adding and getattr(instance, '_histogram_state', None) is None:
+        instance._histogram_state = Product.objects.filter(pk=instance.pk).values_list('category_id', 'price').first()
+
+
+@receiver(post_save, sender=Product)
+def count_price(sender, instance, created, **kwargs):
+    old = None if created else instance._histogram_state
+    new = (instance.category_id, instance.price)
+    if old is None or old[0] != new[0] or histograms.bucket_of(old[1]) != histograms.bucket_of(new[1]):
+        histograms.product_moved(old, new)
+    instance._histogram_state = new
+
+
+@receiver(post_delete, sender=Product)
+def uncount_price(sender, instance, **kwargs):
+    histograms.product_moved(getattr(instance, '_histogram_state', None) or _price_state(instance), None)
@@ -0,0 +1,233 @@
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+
+from .models import Product
+
+GENERATION_KEY = 'catalog:suggestions:generation'
+ALL_CATEGORIES = 0
+# префиксы до этой длины совпадают с большой частью каталога — их выдача хранится готовой
+SHORT_PREFIX = 2
+TOP_SIZE = 50
+
+
+def normalize(text):
+    """Нижний регистр, ё -> е, всё кроме букв и цифр — один пробел"""
+    text = (text or '').lower().replace('ё', 'е')
+    return ' '.join(re.findall(r'\w+', text))
+
+
+def _keys(name):
+    """Ключи для поиска по началу любого слова: "чехол для ноутбука" -> три суффикса"""
+    words = normalize(name).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class PrefixIndex:
+    """
+    Локальный для процесса индекс подсказок: отсортированные массивы ключей,
+    разбитые по category_id (0 — все категории). Поиск по префиксу — bisect
+    по массиву и выбор самых популярных товаров из найденного диапазона.
+    Для коротких префиксов диапазон — почти весь каталог, поэтому их выдача
+    хранится готовой (_top) и поправляется на месте при изменении товаров.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._partitions = {}
+        self._products = {}
+        self._top = {}
+        self._generation = None
+        self._built = False
+
+    # ----------------------
+    # Построение и обновление
+    # ----------------------
+    def build(self, rows=None):
+        if rows is None:
+            rows = Product.objects.values('id', 'name', 'category_id', 'popularity').order_by()
+        generation = cache.get(GENERATION_KEY)
+        with self._lock:
+            self._partitions = {}
+            self._products = {}
+            self._top = {}
+            for row in rows:
+                self._add(row['id'], row['name'], row['category_id'], row['popularity'], sort=False)
+            for entries in self._partitions.values():
+                entries.sort()
+            self._generation = generation
+            self._built = True
+
+    def _entries(self, product_id, name, category_id, popularity):
+        # (ключ, -популярность, id): внутри одного ключа популярные идут первыми
+        partitions = {ALL_CATEGORIES}
+        if category_id:
+            partitions.add(category_id)
+        return [
+            (partition, (key, -popularity, product_id))
+            for partition in partitions
+            for key in _keys(name)
+        ]
+
+    def _add(self, product_id, name, category_id, popularity, sort=True):
+        entries = self._entries(product_id, name, category_id, popularity)
+        for partition, entry in entries:
+            bucket = self._partitions.setdefault(partition, [])
+            if sort:
+                insort(bucket, entry)
+            else:
+                bucket.append(entry)
+        self._products[product_id] = (name, category_id, popularity, entries)
+        if not sort:
+            # полная сборка: готовых выдач ещё нет
+            return
+        for partition, prefixes in _short_prefixes(entries).items():
+            for prefix in prefixes:
+                self._top_insert(partition, prefix, (-popularity, product_id))
+
+    def _remove(self, product_id):
+        stored = self._products.pop(product_id, None)
+        if stored is None:
+            return None
+        for partition, entry in stored[3]:
+            bucket = self._partitions.get(partition, [])
+            position = bisect_left(bucket, entry)
+            if position < len(bucket) and bucket[position] == entry:
+                del bucket[position]
+        for partition, prefixes in _short_prefixes(stored[3]).items():
+            for prefix in prefixes:
+                self._top_discard(partition, prefix, (-stored[2], product_id))
+        return stored
+
+    # ----------------------
+    # Готовая выдача коротких префиксов
+    # ----------------------
+    # _top[раздел][префикс] = [ранги (-популярность, id) по возрастанию, полный ли список,
+    # сколько рангов держать].
+    # Неполный список — верное начало выдачи: всё, чего в нём нет, ранжируется ниже
+    # последнего элемента. Изменения правят список на месте за O(TOP_SIZE); полный
+    # перебор диапазона нужен, только когда неполный список стал короче запроса.
+    def _top_insert(self, partition, prefix, rank):
+        top = self._top.get(partition, {}).get(prefix)
+        if top is None:
+            return
+        ranks, complete, size = top
+        if not complete and (not ranks or rank > ranks[-1]):
+            # ниже известной части выдачи — место товара неизвестно, в список он не входит
+            return
+        insort(ranks, rank)
+        if len(ranks) > size:
+            del ranks[size:]
+            top[1] = False
+
+    def _top_discard(self, partition, prefix, rank):
+        top = self._top.get(partition, {}).get(prefix)
+        if top is None:
+            return
+        ranks = top[0]
+        position = bisect_left(ranks, rank)
+        if position < len(ranks) and ranks[position] == rank:
+            del ranks[position]
+
+    def _top_ranks(self, partition, bucket, prefix, depth):
+        top = self._top.get(partition, {}).get(prefix)
+        if top is None or (not top[1] and len(top[0]) < depth):
+            size = max(depth, TOP_SIZE)
+            ranks, complete = self._ranked(bucket, prefix, size)
+            top = [ranks, complete, size]
+            # пустые выдачи не храним: иначе кеш разрастается от произвольных запросов
+            if ranks:
+                self._top.setdefault(partition, {})[prefix] = top
+        return top[0]
+
+    def update(self, product_id, name, category_id, popularity=None):
+        with self._lock:
+            if not self._built:
+                return
+            stored = self._remove(product_id)
+            if popularity is None:
+                popularity = stored[2] if stored else 0
+            self._add(product_id, name, category_id, popularity)
+
+    def adjust_popularity(self, product_id, delta):
+        with self._lock:
+            stored = self._products.get(product_id)
+            if stored is not None:
+                self.update(product_id, stored[0], stored[1], max(stored[2] + delta, 0))
+
+    def remove(self, product_id):
+        with self._lock:
+            if self._built:
+                self._remove(product_id)
+
+    # ----------------------
+    # Поиск
+    # ----------------------
+    def _ensure_fresh(self):
+        generation = cache.get(GENERATION_KEY)
+        if not self._built or generation != self._generation:
+            self.build()
+
+    def lookup(self, query, category_id=ALL_CATEGORIES, limit=5):
+        """Названия самых популярных товаров, одно из слов которых начинается с query"""
+        self._ensure_fresh()
+        prefix = normalize(query)
+        partition = category_id or ALL_CATEGORIES
+        # с запасом: у разных товаров бывают одинаковые названия
+        depth = limit * 4
+        with self._lock:
+            bucket = self._partitions.get(partition, [])
+            if len(prefix) > SHORT_PREFIX:
+                ranks = self._ranked(bucket, prefix, depth)[0]
+            else:
+                ranks = self._top_ranks(partition, bucket, prefix, depth)
+            return self._names(ranks, limit)
+
+    def _ranked(self, bucket, prefix, depth):
+        """(первые depth рангов товаров с ключом на prefix, все ли это товары)"""
+        # диапазон ключей с префиксом читается по индексам, без копии среза
+        start = bisect_left(bucket, (prefix,))
+        end = bisect_left(bucket, (prefix + '\uffff',))
+        ranks = {(bucket[position][1], bucket[position][2]) for position in range(start, end)}
+        return heapq.nsmallest(depth, ranks), len(ranks) <= depth
+
+    def _names(self, ranks, limit):
+        names = []
+        for _, product_id in ranks:
+            name = self._products[product_id][0]
+            if name in names:
+                continue
+            names.append(name)
+            if len(names) == limit:
+                break
+        return names
+
+
+def _short_prefixes(entries):
+    """{раздел: короткие префиксы ключей} — выдачи, в которые входит товар"""
+    prefixes = {}
+    for partition, entry in entries:
+        prefixes.setdefault(partition, set()).update(entry[0][:length] for length in range(SHORT_PREFIX + 1))
+    return prefixes
+
+
+index = PrefixIndex()
+
+
+def bump_generation():
+    """Сообщает другим процессам, что их индекс устарел"""
+    try:
+        generation = cache.incr(GENERATION_KEY)
+    except ValueError:
+        # поколение из времени: после вытеснения ключа не совпадёт с поколением чужого индекса
+        generation = time.time_ns()
+        cache.set(GENERATION_KEY, generation, None)
+    with index._lock:
+        # свой индекс уже обновлён инкрементально — догоняем поколение,
+        # только если до этого он был актуален
+        if index._built and index._generation in (None, generation - 1):
+            index._generation = generation
@@ -1,4 +1,9 @@
 from django import template
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from product import fragments, pagecache, renditions
+from product.shopper import get_shopper
 
 register = template.Library()
 
@@ -16,3 +21,82 @@ def dict_get(d, key):
     if not d:
         return 0
     return d.get(key, 0)
+
+
+@register.simple_tag
+def query_replace(request, **params):
+    """Текущая строка запроса с заменёнными параметрами; None или "" — удалить параметр"""
+    query = request.GET.copy()
+    for key, value in params.items():
+        if value in (None, ''):
+            query.pop(key, None)
+        else:
+            query[key] = value
+    return query.urlencode()
+
+
+@register.filter
+def indent_by_depth(category):
+    """Название категории с отступом по уровню вложенности"""
+    return "— " * getattr(category, 'depth', 0) + category.name
+
+
+def _srcset(name, fmt):
+    return ", ".join(f"{renditions.rendition_url(name, width, fmt)} {width}w" for width in renditions.WIDTHS)
+
+
+@register.simple_tag
+def responsive_image(image, alt="", sizes="100vw", css_class="", fallback=""):
+    """
+    <picture> с WebP/JPEG вариантами и ленивой загрузкой.
+    Пока вариантов нет — обычный <img> с оригиналом; пустая картинка — fallback.
+    """
+    name = getattr(image, "name", None)
+    if not name:
+        src = image if isinstance(image, str) and image else fallback
+        if not src:
+            return ""
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy" decoding="async">', src, alt, css_class)
+    if not renditions.renditions_ready(name):
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="lazy" decoding="async">', image.url, alt, css_class
+        )
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" decoding="async"></picture>',
+        _srcset(name, "webp"), sizes,
+        renditions.rendition_url(name, renditions.WIDTHS[1]), _srcset(name, "jpeg"), sizes, alt, css_class,
+    )
+
+
+@register.simple_tag
+def rendition(image, width, fmt="jpeg"):
+    """URL одного варианта картинки (или оригинала, если вариантов ещё нет)"""
+    name = getattr(image, "name", None)
+    if not name:
+        return ""
+    if not renditions.renditions_ready(name):
+        return image.url
+    return renditions.rendition_url(name, int(width), fmt)
+
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products):
+    """Карточки товаров из кеша фрагментов (один get_many на весь список)"""
+    request = context.get("request")
+    if request is None or not request.user.is_authenticated:
+        return fragments.render_cards(products)
+    if getattr(request, "_page_shell", False):
+        # страница пойдёт в общий кеш: сердечки расставит вставка wishlist_state
+        return fragments.render_cards(products, True)
+    return fragments.render_cards(products, True, get_shopper(request).wishlist_ids)
+
+
+@register.simple_tag(takes_context=True)
+def personal(context, template_name):
+    """
+    Персональная часть страницы (вход, корзина, избранное). В кеш страниц
+    попадает только метка — содержимое рендерится заново для каждого запроса.
+    """
+    html = context.template.engine.get_template(template_name).render(context)
+    return mark_safe(pagecache.mark_hole(template_name, html))
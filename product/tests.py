@@ -1,3 +1,1511 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import random
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.models import CartItem, CartSummary, GuestCart, Order, OrderItem
+from PIL import Image
+
+from . import (
+    async_views, cart, fragments, histograms, pagecache, recommendations, renditions, search, wishlist,
+)
+from . import urls as product_urls
+from .context_processors import shopper
+from .facets import compute_facets, parse_catalog_filters
+from .pagination import SORT_KEYS, order_by_keys, paginate_keyset
+from .popularity import adjust_popularity, adjust_popularity_many
+from .models import Brand, Category, PriceBucket, Product, ProductImage, ProductNeighbor
+from .querybudget import QueryBudgetMixin, QueryLog, shape
+from . import suggestions
+from .suggestions import PrefixIndex
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name="Phones", slug="phones")
+        cls.laptops = Category.objects.create(name="Laptops", slug="laptops")
+        cls.apple = Brand.objects.create(name="Apple", slug="apple")
+        cls.acme = Brand.objects.create(name="Acme", slug="acme")
+        for category, brand, status, price in (
+            (cls.phones, cls.apple, "new", 100),
+            (cls.phones, cls.apple, "defect", 50),
+            (cls.phones, cls.acme, "new", 30),
+            (cls.laptops, cls.apple, "new", 900),
+            (cls.laptops, cls.acme, "excellent", 400),
+        ):
+            Product.objects.create(
+                name=f"{brand.name} {category.name} {price}", slug=f"{brand.slug}-{category.slug}-{price}",
+                description="", price=price, category=category, brand=brand, status=status,
+            )
+
+    def facets(self, query):
+        return compute_facets(parse_catalog_filters(QueryDict(query)))
+
+    def test_each_facet_ignores_its_own_filter(self):
+        facets = self.facets(f"brand={self.apple.pk}&status=new")
+        # категории: бренд Apple и состояние "new"
+        self.assertEqual(facets["categories"], {self.phones.pk: 1, self.laptops.pk: 1})
+        # бренды: без фильтра по бренду, но с состоянием
+        self.assertEqual(facets["brands"], {self.apple.pk: 2, self.acme.pk: 1})
+        # состояния: без фильтра по состоянию, но с брендом
+        self.assertEqual(facets["statuses"], {"new": 2, "defect": 1})
+        self.assertEqual(facets["total"], 2)
+
+    def test_price_filters_counts_but_not_range(self):
+        facets = self.facets(f"category={self.phones.pk}&price_min=40")
+        self.assertEqual(facets["brands"], {self.apple.pk: 2})
+        self.assertEqual(facets["categories"], {self.phones.pk: 2, self.laptops.pk: 2})
+        self.assertEqual(facets["total"], 2)
+        # диапазон слайдера — по всем товарам выбранной категории
+        self.assertEqual((facets["min_price"], facets["max_price"]), (30, 100))
+
+    def test_invalid_values_are_dropped(self):
+        filters = parse_catalog_filters(QueryDict("category=x&category=0&brand=7&brand=7&status=bad&price_min=abc"))
+        self.assertEqual((filters["category"], filters["brand"], filters["status"]), ([], [7], []))
+        self.assertIsNone(filters["price_min"])
+
+
+@skipUnless(connection.vendor == "sqlite", "FTS5 есть только в SQLite")
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cases = Category.objects.create(name="Чехлы", slug="cases")
+        cls.apple = Brand.objects.create(name="Apple", slug="apple")
+
+        def create(name, description="", **fields):
+            return Product.objects.create(
+                name=name, slug=f"item-{Product.objects.count()}", description=description, price=10, **fields
+            )
+
+        cls.in_name = create("Чехол для ноутбука")
+        cls.in_description = create("Сумка", "Подходит как чехол для планшета")
+        cls.by_brand = create("Кабель", brand=cls.apple)
+        cls.by_category = create("Накладка", category=cls.cases)
+
+    def found(self, query):
+        return list(search.search_products(Product.objects.all(), query).values_list("name", flat=True))
+
+    def test_finds_words_by_prefix_in_all_fields(self):
+        self.assertEqual(self.found("ноут"), ["Чехол для ноутбука"])
+        self.assertEqual(self.found("appl"), ["Кабель"])
+        self.assertEqual(self.found("чехл"), ["Накладка"])
+        # все слова запроса обязательны, порядок не важен
+        self.assertEqual(self.found("планшета чехол"), ["Сумка"])
+        self.assertEqual(self.found("чехол телефона"), [])
+
+    def test_name_matches_rank_above_description(self):
+        self.assertEqual(self.found("чехол"), ["Чехол для ноутбука", "Сумка"])
+
+    def test_index_follows_changes(self):
+        self.in_description.description = "Большая"
+        self.in_description.save()
+        self.cases.name = "Бамперы"
+        self.cases.save()
+        self.by_brand.delete()
+
+        self.assertEqual(self.found("чехол"), ["Чехол для ноутбука"])
+        self.assertEqual(self.found("бампер"), ["Накладка"])
+        self.assertEqual(self.found("apple"), [])
+
+    def test_punctuation_only_query_falls_back(self):
+        self.assertEqual(search.build_match_expression('"*)'), "")
+        self.assertEqual(len(self.found("")), 4)
+
+
+class SuggestionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cases = Category.objects.create(name="Cases", slug="cases")
+        self.laptops = Category.objects.create(name="Laptops", slug="laptops")
+        for name, category, popularity in (
+            ("Laptop case", self.cases, 5),
+            ("Leather case", self.cases, 9),
+            ("Laptop stand", self.laptops, 7),
+            ("Lamp", None, 1),
+        ):
+            Product.objects.create(
+                name=name, slug=name.lower().replace(" ", "-"), description="", price=10, category=category,
+            )
+            Product.objects.filter(name=name).update(popularity=popularity)
+        self.index = PrefixIndex()
+        self.index.build()
+
+    def test_prefix_of_any_word_by_popularity(self):
+        self.assertEqual(self.index.lookup("la"), ["Laptop stand", "Laptop case", "Lamp"])
+        self.assertEqual(self.index.lookup("CASE"), ["Leather case", "Laptop case"])
+        self.assertEqual(self.index.lookup("la", limit=1), ["Laptop stand"])
+        self.assertEqual(self.index.lookup("xyz"), [])
+        self.assertEqual(self.index.lookup(""), ["Leather case", "Laptop stand", "Laptop case", "Lamp"])
+
+    def test_lookup_per_category(self):
+        self.assertEqual(self.index.lookup("la", self.cases.pk), ["Laptop case"])
+        self.assertEqual(self.index.lookup("la", self.laptops.pk), ["Laptop stand"])
+        self.assertEqual(self.index.lookup("", self.laptops.pk), ["Laptop stand"])
+        response = self.client.get(reverse("search_suggestions"), {"q": "l", "category": self.cases.pk})
+        self.assertEqual(response.json()["suggestions"], ["Leather case", "Laptop case"])
+
+    def test_incremental_updates(self):
+        self.assertEqual(self.index.lookup("la"), ["Laptop stand", "Laptop case", "Lamp"])
+        self.index.adjust_popularity(Product.objects.get(name="Laptop case").pk, 10)
+        self.assertEqual(self.index.lookup("la"), ["Laptop case", "Laptop stand", "Lamp"])
+        stand = Product.objects.get(name="Laptop stand")
+        self.index.update(stand.pk, "Laptop sleeve", self.cases.pk)
+        self.assertEqual(self.index.lookup("sle", self.cases.pk), ["Laptop sleeve"])
+        self.assertEqual(self.index.lookup("", self.laptops.pk), [])
+        self.index.remove(stand.pk)
+        self.assertEqual(self.index.lookup("sle"), [])
+        self.assertEqual(self.index.lookup("la"), ["Laptop case", "Lamp"])
+
+    def test_short_prefixes_are_not_rescanned(self):
+        self.index.lookup("la")
+        with mock.patch.object(self.index, "_ranked", side_effect=AssertionError):
+            self.assertEqual(self.index.lookup("LA", limit=2), ["Laptop stand", "Laptop case"])
+
+    def test_popularity_changes_keep_short_prefixes_ready(self):
+        self.index.lookup("la")
+        case = Product.objects.get(name="Laptop case")
+        with mock.patch.object(self.index, "_ranked", side_effect=AssertionError):
+            self.index.adjust_popularity(case.pk, 10)
+            self.assertEqual(self.index.lookup("la"), ["Laptop case", "Laptop stand", "Lamp"])
+            self.index.adjust_popularity(case.pk, -10)
+            self.assertEqual(self.index.lookup("la"), ["Laptop stand", "Laptop case", "Lamp"])
+
+    @mock.patch.object(suggestions, "TOP_SIZE", 3)
+    def test_short_prefixes_match_full_scan(self):
+        rows = [
+            {"id": pk, "name": f"{word} {pk}", "category_id": pk % 3 or None, "popularity": pk % 7}
+            for pk, word in enumerate(["alpha", "alto", "beta", "amber", "also", "ant", "axe", "bat"] * 4, start=1)
+        ]
+        index = PrefixIndex()
+        index.build(rows)
+        names = {row["id"]: row["name"] for row in rows}
+        generator = random.Random(7)
+        for step in range(300):
+            pk = generator.choice(rows)["id"]
+            if step % 10 == 0:
+                index.update(pk, names[pk], generator.choice([None, 1, 2]))
+            else:
+                index.adjust_popularity(pk, generator.randint(-4, 4))
+            prefix, category = generator.choice(["", "a", "al", "b", "an"]), generator.choice([0, 1, 2])
+            with index._lock:
+                bucket = index._partitions.get(category or 0, [])
+                expected = index._names(index._ranked(bucket, prefix, 4)[0], 1)
+            self.assertEqual(index.lookup(prefix, category, limit=1), expected, (step, prefix, category))
+
+    def test_generation_changes_only_with_name_or_category(self):
+        product = Product.objects.get(name="Lamp")
+        generation = cache.get(suggestions.GENERATION_KEY)
+        product.price = 20
+        product.save()
+        self.assertEqual(cache.get(suggestions.GENERATION_KEY), generation)
+        product.category = self.cases
+        product.save()
+        self.assertNotEqual(cache.get(suggestions.GENERATION_KEY), generation)
+
+    def test_lost_generation_is_not_reused(self):
+        cache.delete(suggestions.GENERATION_KEY)
+        suggestions.bump_generation()
+        self.assertGreater(cache.get(suggestions.GENERATION_KEY), 1)
+
+
+class ProductSaveTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Phone", slug="phone", description="Old", price=100)
+
+    def test_save_keeps_counters_and_unloaded_fields(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        partial = Product.objects.only("name").get(pk=self.product.pk)
+        Product.objects.filter(pk=self.product.pk).update(popularity=5)
+        stale.price = 90
+        stale.save()
+
+        Product.objects.filter(pk=self.product.pk).update(description="New")
+        partial.name = "Phone X"
+        with CaptureQueriesContext(connection) as queries:
+            partial.save()
+
+        update = next(q["sql"] for q in queries.captured_queries if q["sql"].startswith('UPDATE "product_product"'))
+        self.assertNotIn('"description"', update)
+        self.assertNotIn('"popularity"', update)
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.name, product.description, product.price, product.popularity), ("Phone X", "New", 90, 5))
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # много одинаковых цен и популярностей: порядок внутри них держит только id
+        for i, price in enumerate([10, 10, 10, 20, 20, 30, 30, 30, 30, 40, 50]):
+            Product.objects.create(name=f"Item {i}", slug=f"item-{i}", description="", price=price)
+        Product.objects.filter(pk__in=Product.objects.order_by("id").values("pk")[:6]).update(popularity=3)
+
+    def walk(self, sort, page_size=3):
+        """Страницы вперёд до конца и назад до начала"""
+        queryset = Product.objects.all()
+        pages = [paginate_keyset(queryset, sort, page_size)]
+        while pages[-1].has_next():
+            pages.append(paginate_keyset(queryset, sort, page_size, pages[-1].next_cursor))
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous():
+            backwards.append(paginate_keyset(queryset, sort, page_size, backwards[-1].previous_cursor))
+        return [[p.pk for p in page] for page in pages], [[p.pk for p in page] for page in reversed(backwards)]
+
+    def test_walks_every_sort_without_gaps_or_duplicates(self):
+        for sort in SORT_KEYS:
+            with self.subTest(sort=sort):
+                expected = list(order_by_keys(Product.objects.all(), sort).values_list("pk", flat=True))
+                forward, backward = self.walk(sort)
+                self.assertEqual(sum(forward, []), expected)
+                self.assertEqual(backward, forward)
+                self.assertEqual([len(page) for page in forward], [3, 3, 3, 2])
+
+    def test_bad_cursor_starts_over(self):
+        first = paginate_keyset(Product.objects.all(), "price_asc", 3)
+        for cursor in ("garbage", paginate_keyset(Product.objects.all(), "newest", 3).next_cursor):
+            page = paginate_keyset(Product.objects.all(), "price_asc", 3, cursor)
+            self.assertEqual(list(page), list(first))
+            self.assertFalse(page.has_previous())
+
+    def test_catalog_follows_cursors(self):
+        for i in range(10):
+            Product.objects.create(name=f"Extra {i}", slug=f"extra-{i}", description="", price=10)
+        first = self.client.get(reverse("home"), {"sort": "price_asc"})
+        self.assertTrue(first.context["cursor_mode"])
+        cursor = first.context["page_obj"].next_cursor
+        second = self.client.get(reverse("home"), {"sort": "price_asc", "cursor": cursor})
+        seen = [p.pk for p in first.context["page_obj"]] + [p.pk for p in second.context["page_obj"]]
+        self.assertEqual(sorted(seen), sorted(Product.objects.values_list("pk", flat=True)))
+        self.assertEqual(Product.objects.get(pk=seen[-1]).price, 50)
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        self.electronics = Category.objects.create(name="Electronics", slug="electronics")
+        self.phones = Category.objects.create(name="Phones", slug="phones", parent=self.electronics)
+        self.cases = Category.objects.create(name="Cases", slug="cases", parent=self.phones)
+        self.leather = Category.objects.create(name="Leather", slug="leather", parent=self.cases)
+        self.accessories = Category.objects.create(name="Accessories", slug="accessories")
+
+    def tree(self):
+        return {c.slug: (c.path, c.depth) for c in Category.objects.all()}
+
+    def assertPathsMatchParents(self):
+        for category in Category.objects.all():
+            parent_path = category.parent.path if category.parent_id else ""
+            self.assertEqual(category.path, f"{parent_path}{category.pk:08d}/")
+            self.assertEqual(category.depth, category.path.count("/") - 1)
+
+    def test_moving_subtree_rewrites_descendants(self):
+        self.cases.parent = self.accessories
+        self.cases.save()
+        self.assertPathsMatchParents()
+        leather = Category.objects.get(slug="leather")
+        self.assertEqual(leather.depth, 2)
+        self.assertEqual([c.slug for c in leather.get_ancestors()], ["accessories", "cases"])
+        self.assertEqual([c.slug for c in self.electronics.get_descendants()], ["phones"])
+
+        self.cases.parent = None
+        self.cases.save()
+        self.assertPathsMatchParents()
+        self.assertEqual(Category.objects.get(slug="leather").depth, 1)
+
+    def test_cannot_move_into_own_subtree(self):
+        self.phones.parent = self.leather
+        before = self.tree()
+        with self.assertRaises(ValidationError):
+            self.phones.save()
+        self.assertEqual(self.tree(), before)
+
+    def test_subtree_products(self):
+        for slug, category in (("a", self.phones), ("b", self.leather), ("c", self.accessories)):
+            Product.objects.create(name=slug, slug=slug, description="", price=1, category=category)
+        self.assertEqual(sorted(self.electronics.get_products().values_list("slug", flat=True)), ["a", "b"])
+        roots = {root.slug: root for root in Category.tree()}
+        self.assertEqual(roots["electronics"].subtree_product_count, 2)
+        self.assertEqual(roots["electronics"].children[0].children[0].subtree_product_count, 1)
+
+
+class ShopperStateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Phones", slug="phones")
+        cls.product = Product.objects.create(
+            name="Phone", slug="phone", description="", price=100, category=cls.category, image="products/phone.png"
+        )
+        cls.user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+        CartItem.objects.create(profile=cls.user.profile, product=cls.product, quantity=2)
+        cls.user.profile.favorites.add(cls.product)
+
+    def setUp(self):
+        cache.clear()
+
+    def make_request(self, user):
+        request = RequestFactory().get("/")
+        request.user = User.objects.get(pk=user.pk) if user else AnonymousUser()
+        request.session = SessionStore()
+        return request
+
+    def test_context_is_lazy(self):
+        request = self.make_request(self.user)
+        with self.assertNumQueries(0):
+            shopper(request)
+
+    def test_each_part_is_loaded_once(self):
+        context = shopper(self.make_request(self.user))
+        # профиль, итоги корзины, строки корзины, избранное, категории, топ категорий
+        with self.assertNumQueries(6):
+            for _ in range(2):
+                context["cart_items"]()
+                context["cart_qty"]()
+                context["cart_total"]()
+                context["wishlist_ids"]()
+                context["wishlist_qty"]()
+                context["categories"]()
+                context["top_categories"]()
+        self.assertEqual(context["cart_qty"](), 2)
+        self.assertEqual(context["cart_total"](), 200)
+        self.assertEqual(list(context["wishlist_ids"]()), [self.product.id])
+
+    def test_anonymous_login_page_queries(self):
+        # навбар: список категорий; футер: топ категорий
+        with self.assertNumQueries(2):
+            self.client.get(reverse("login"))
+
+    def test_authenticated_login_page_queries(self):
+        self.client.force_login(self.user)
+        # сессия, пользователь, профиль, итоги и строки корзины, избранное, категории, топ категорий
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse("login"))
+        self.assertContains(response, '<div class="qty" id="cart-qty">2</div>', html=True)
+
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+        self.profile = self.user.profile
+        self.products = [
+            Product.objects.create(
+                name=f"Item {i}", slug=f"item-{i}", description="", price=10 * (i + 1), image="products/x.png"
+            )
+            for i in range(3)
+        ]
+        for product in self.products:
+            CartItem.objects.create(profile=self.profile, product=product, quantity=2)
+        self.client.force_login(self.user)
+
+    def checkout(self, token):
+        return self.client.post(reverse("create_order"), {
+            "full_name": "Buyer", "phone": "123", "payment_method": "bank", "checkout_token": token,
+        })
+
+    def test_order_is_created_from_cart(self):
+        self.checkout(uuid.uuid4())
+
+        order = Order.objects.get()
+        self.assertEqual((order.total, order.item_count), (120, 6))
+        self.assertEqual(order.items.count(), 3)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(CartSummary.for_profile(self.profile.pk).item_count, 0)
+        # количество перешло из корзины в заказ — популярность прежняя
+        self.assertEqual(list(Product.objects.values_list("popularity", flat=True)), [2, 2, 2])
+
+    def test_double_submit_creates_one_order(self):
+        token = uuid.uuid4()
+        self.checkout(token)
+        CartItem.objects.create(profile=self.profile, product=self.products[0], quantity=1)
+        self.checkout(token)
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertTrue(CartItem.objects.exists())
+
+    def test_failure_keeps_cart(self):
+        with mock.patch.object(OrderItem.objects, "bulk_create", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout(uuid.uuid4())
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.count(), 3)
+
+    def test_order_listing_queries_do_not_grow(self):
+        for _ in range(4):
+            self.checkout(uuid.uuid4())
+            for product in self.products:
+                CartItem.objects.create(profile=self.profile, product=product, quantity=1)
+        self.user.is_staff = True
+        self.user.save()
+
+        # сессия, пользователь, страница заказов, их товары + шапка и подвал
+        with self.assertNumQueries(10):
+            response = self.client.get(reverse("admin_orders"))
+        self.assertEqual(len(response.context["orders"]), 4)
+
+
+class RenditionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, RENDITION_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, size=(2000, 1000), mode="RGBA"):
+        buffer = io.BytesIO()
+        Image.new(mode, size, (200, 30, 30, 128)).save(buffer, "PNG")
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(
+                name="Phone", slug="phone", description="", price=100,
+                image=SimpleUploadedFile("phone.png", buffer.getvalue(), content_type="image/png"),
+            )
+
+    def test_renditions_are_generated_on_upload(self):
+        product = self.upload()
+        name = product.image.name
+        self.assertTrue(renditions.renditions_ready(name))
+        with default_storage.open(renditions.rendition_name(name, 320, "jpeg")) as file:
+            self.assertEqual(Image.open(file).size, (320, 160))
+        with default_storage.open(renditions.rendition_name(name, 1024, "webp")) as file:
+            self.assertEqual(Image.open(file).format, "WEBP")
+
+    def test_small_images_are_not_upscaled(self):
+        product = self.upload(size=(200, 100), mode="RGB")
+        with default_storage.open(renditions.rendition_name(product.image.name, 1024, "jpeg")) as file:
+            self.assertEqual(Image.open(file).size, (200, 100))
+
+    def test_responsive_image_tag(self):
+        product = self.upload()
+        html = Template("{% load filters %}{% responsive_image product.image alt=product.name sizes='50vw' %}").render(
+            Context({"product": product})
+        )
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn("phone_160.webp 160w", html)
+        self.assertIn('loading="lazy"', html)
+
+        # без вариантов — оригинал, без картинки — запасной вариант
+        Product.objects.filter(pk=product.pk).update(image="products/missing.png")
+        product.refresh_from_db()
+        html = Template("{% load filters %}{% responsive_image product.image %}").render(Context({"product": product}))
+        self.assertIn('src="/media/products/missing.png"', html)
+        html = Template("{% load filters %}{% responsive_image '' fallback='/static/x.png' %}").render(Context())
+        self.assertIn('src="/static/x.png"', html)
+
+    def test_missing_renditions_are_remembered_until_built(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (400, 200)).save(buffer, "PNG")
+        name = default_storage.save("products/later.png", io.BytesIO(buffer.getvalue()))
+        self.assertFalse(renditions.renditions_ready(name))
+        with mock.patch.object(default_storage, "exists", side_effect=AssertionError):
+            self.assertFalse(renditions.renditions_ready(name))
+
+        renditions.generate_renditions(name)
+        self.assertTrue(renditions.renditions_ready(name))
+
+    def test_finished_renditions_reset_cards_and_pages(self):
+        name = "products/pooled.png"
+        self.assertFalse(renditions.renditions_ready(name))
+        cards, pages = fragments.cards_version(), pagecache.tag_versions(["product:1"])
+
+        # дочерний процесс пишет «готово» в свой кеш — здесь его не видно
+        with ThreadPoolExecutor(1) as executor, \
+                mock.patch.object(renditions, "_get_executor", return_value=executor), \
+                mock.patch.object(renditions, "_generate_safely", return_value=(name, None)), \
+                override_settings(RENDITION_WORKERS=1):
+            renditions.schedule(name, ("product:1",))
+
+        self.assertTrue(renditions.renditions_ready(name))
+        self.assertNotEqual(fragments.cards_version(), cards)
+        self.assertNotEqual(pagecache.tag_versions(["product:1"]), pages)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Phones", slug="phones")
+        self.products = [
+            Product.objects.create(
+                name=f"Phone {i}", slug=f"phone-{i}", description="", price=100, category=self.category,
+                image="products/phone.png",
+            )
+            for i in range(3)
+        ]
+
+    def test_cards_are_rendered_once(self):
+        self.client.get(reverse("home"))
+        with mock.patch.object(fragments, "render_to_string", wraps=fragments.render_to_string) as render:
+            response = self.client.get(reverse("home"))
+        render.assert_not_called()
+        self.assertContains(response, "Phone 2")
+
+    def test_cards_follow_catalog_changes(self):
+        self.client.get(reverse("home"))
+        self.category.name = "Smartphones"
+        self.category.save()
+        product = self.products[0]
+        product.name = "Renamed"
+        product.save()
+
+        cards = "".join(fragments.render_cards(Product.objects.select_related("category").order_by("id")))
+        self.assertIn("Smartphones", cards)
+        self.assertIn("Renamed", cards)
+        self.assertNotIn(" Phones\n", cards)
+
+    def test_wishlist_state_is_per_user(self):
+        cards = fragments.render_cards(self.products, True, frozenset({self.products[0].pk}))
+        self.assertIn("in-wishlist", cards[0])
+        self.assertNotIn("in-wishlist", cards[1])
+        self.assertIn("disabled-btn", fragments.render_cards(self.products)[0])
+
+    def test_sidebar_renders_only_normalized_filters(self):
+        # кривые значения дают ту же сигнатуру фильтра, что и пустой фильтр
+        self.client.get(reverse("home"), {"price_min": "abc", "price_max": "1e999x", "category": "x<b>"})
+        response = self.client.get(reverse("home"))
+        self.assertNotContains(response, "abc")
+        self.assertNotContains(response, "1e999x")
+        self.assertRegex(response.content.decode(), r'id="price-min"[^>]*value="100"')
+
+        response = self.client.get(reverse("home"), {"category": str(self.category.pk), "price_min": "50"})
+        self.assertRegex(response.content.decode(), rf'id="category-{self.category.pk}"[^>]*checked')
+        self.assertContains(response, 'data-start-min="50"')
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            name="Phone", slug="phone", description="", price=100, category=self.category, image="products/phone.png"
+        )
+        self.url = reverse("product_detail", args=[self.product.slug])
+
+    def test_anonymous_hit_runs_no_queries(self):
+        self.assertEqual(self.client.get(reverse("home"), {"utm_source": "x", "sort": ""})["X-Page-Cache"], "miss")
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("home"))
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertContains(response, "Phone")
+
+    def test_product_change_purges_its_pages(self):
+        self.client.get(self.url)
+        Product.objects.create(name="Other", slug="other", description="", price=1)
+        self.assertEqual(self.client.get(self.url)["X-Page-Cache"], "hit")
+
+        self.product.name = "Renamed phone"
+        self.product.save()
+        # пока страницу пересобирает другой запрос, отдаётся прежняя копия
+        lock_key = pagecache.page_key(RequestFactory().get(self.url), "guest") + ":lock"
+        cache.add(lock_key, 1)
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Page-Cache"], "stale")
+        self.assertNotContains(response, "Renamed phone")
+
+        cache.delete(lock_key)
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, "Renamed phone")
+
+    def test_popularity_purges_popular_listings(self):
+        other = Product.objects.create(name="Case", slug="case", description="", price=10, image="products/case.png")
+        popular, newest = {"sort": "popular"}, {"sort": "newest"}
+        for params in (popular, newest):
+            self.client.get(reverse("home"), params)
+
+        adjust_popularity(self.product.pk, 5)
+        self.assertEqual(self.client.get(reverse("home"), newest)["X-Page-Cache"], "hit")
+        self.assertEqual(self.client.get(reverse("home"), popular)["X-Page-Cache"], "miss")
+
+        adjust_popularity_many({other.pk: 10})
+        self.assertEqual(self.client.get(reverse("home"), popular)["X-Page-Cache"], "miss")
+
+    def test_members_share_shell_with_own_counters(self):
+        buyer = User.objects.create_user("buyer", "buyer@example.com", "secret")
+        CartItem.objects.create(profile=buyer.profile, product=self.product, quantity=3)
+        buyer.profile.favorites.add(self.product)
+        viewer = User.objects.create_user("viewer", "viewer@example.com", "secret")
+
+        self.client.force_login(buyer)
+        first = self.client.get(self.url)
+        self.assertContains(first, '<div class="qty" id="cart-qty">3</div>', html=True)
+
+        self.client.force_login(viewer)
+        second = self.client.get(self.url)
+        self.assertEqual(second["X-Page-Cache"], "hit")
+        self.assertContains(second, '<div class="qty" id="cart-qty">0</div>', html=True)
+        self.assertContains(second, "viewer")
+        self.assertNotContains(second, "buyer")
+        self.assertNotContains(second, "ids.has")
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(
+            name="Phone", slug="phone", description="", price=100, image="products/phone.png"
+        )
+
+    def assertRevalidates(self, url, queries):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("public", first["Cache-Control"])
+        with self.assertNumQueries(queries):
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 304)
+        return first["ETag"]
+
+    def test_product_pages_answer_not_modified(self):
+        # страница товара читает ещё и его соседей по рекомендациям
+        for url, queries in (
+            (reverse("product_detail", args=["phone"]), 2),
+            (reverse("quick_view", args=[self.product.pk]), 1),
+        ):
+            etag = self.assertRevalidates(url, queries)
+            self.product.price = 90
+            self.product.save()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_product_page_follows_recommended_products(self):
+        other = Product.objects.create(
+            name="Case", slug="case", description="", price=10, image="products/case.png",
+            category=Category.objects.create(name="Cases", slug="cases"),
+        )
+        ProductNeighbor.objects.create(product=self.product, neighbor=other, rank=0, score=1)
+        url = reverse("product_detail", args=["phone"])
+        etag = self.assertRevalidates(url, 2)
+        self.assertFalse(self.client.get(url).has_header("Last-Modified"))
+
+        other.name = "Leather case"
+        other.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertContains(response, "Leather case")
+
+    def test_suggestions_answer_not_modified(self):
+        self.assertRevalidates(reverse("search_suggestions") + "?q=ph", 0)
+
+    def test_member_pages_are_private(self):
+        user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+        self.client.force_login(user)
+        url = reverse("product_detail", args=["phone"])
+        response = self.client.get(url)
+        self.assertIn("private", response["Cache-Control"])
+        etag = response["ETag"]
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+        self.assertIn("private", second["Cache-Control"])
+
+        # корзина и избранное в навбаре — свои у каждого
+        for change in (
+            lambda: CartItem.objects.create(profile=user.profile, product=self.product, quantity=1),
+            lambda: user.profile.favorites.add(self.product),
+        ):
+            change()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+
+        self.client.force_login(User.objects.create_user("viewer", "viewer@example.com", "secret"))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CatalogExportTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.products = [
+            Product.objects.create(
+                name=f"Phone {i}", slug=f"phone-{i}", description="", price=100 + i, category=category,
+                image="products/phone.png",
+            )
+            for i in range(3)
+        ]
+        ProductImage.objects.create(product=self.products[0], image="product_images/back.png")
+        self.client.force_login(User.objects.create_user("admin", "admin@example.com", "secret", is_staff=True))
+
+    def export(self, **params):
+        response = self.client.get(reverse("catalog_export"), params)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_jsonl_export(self):
+        response, body = self.export()
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([record["slug"] for record in records], ["phone-0", "phone-1", "phone-2"])
+        self.assertEqual(records[0]["category"], "Phones")
+        self.assertEqual(records[0]["images"], ["http://testserver/media/product_images/back.png"])
+        self.assertEqual(records[1]["price"], "101.00")
+        self.assertTrue(response["X-Export-Watermark"])
+
+    def test_incremental_csv_export(self):
+        response, _ = self.export(format="csv")
+        product = self.products[1]
+        product.price = 5
+        product.save()
+
+        _, body = self.export(format="csv", since=response["X-Export-Watermark"])
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual([(row["slug"], row["price"]) for row in rows], [("phone-1", "5.00")])
+
+    def test_taxonomy_rename_reaches_incremental_export(self):
+        brand = Brand.objects.create(name="Acme")
+        Product.objects.filter(pk=self.products[2].pk).update(brand=brand)
+        response, _ = self.export()
+        category = Category.objects.get(slug="phones")
+        category.name = "Smartphones"
+        category.save()
+
+        response, body = self.export(since=response["X-Export-Watermark"])
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual({record["category"] for record in records}, {"Smartphones"})
+        self.assertEqual(len(records), 3)
+
+        brand.delete()
+        _, body = self.export(since=response["X-Export-Watermark"])
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([(record["slug"], record["brand"]) for record in records], [("phone-2", None)])
+
+    def test_deleted_products_are_exported_as_tombstones(self):
+        response, _ = self.export(format="csv")
+        pk = self.products[0].pk
+        self.products[0].delete()
+
+        response, body = self.export(format="csv", since=response["X-Export-Watermark"])
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual([(row["id"], row["slug"], row["deleted"]) for row in rows],
+                         [(str(pk), "phone-0", "True")])
+
+        _, body = self.export(since=response["X-Export-Watermark"])
+        self.assertEqual(body, "")
+        _, body = self.export()
+        self.assertNotIn("phone-0", body)
+
+    def test_export_is_staff_only(self):
+        self.client.force_login(User.objects.create_user("buyer", "buyer@example.com", "secret"))
+        self.assertEqual(self.client.get(reverse("catalog_export")).status_code, 302)
+
+
+class ImportCatalogTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.checkpoint = f"{self.tmp}/checkpoint.json"
+
+    def write(self, name, rows):
+        path = f"{self.tmp}/{name}"
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            if name.endswith(".jsonl"):
+                file.writelines(json.dumps(row) + "\n" for row in rows)
+            else:
+                writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+        return path
+
+    def run_import(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command("import_catalog", *args, "--checkpoint", self.checkpoint, stdout=out, stderr=err)
+        return err.getvalue()
+
+    def test_import_catalog(self):
+        Product.objects.create(name="Phone", slug="phone", description="", price=1, image="products/x.png")
+        categories = self.write("categories.csv", [
+            {"name": "Electronics", "slug": "electronics", "parent": ""},
+            {"name": "Phones", "slug": "phones", "parent": "electronics"},
+        ])
+        brands = self.write("brands.jsonl", [{"name": "Apple"}])
+        products = self.write("products.csv", [
+            {"name": "Phone", "slug": "", "price": "10", "category": "phones", "brand": "Apple"},
+            {"name": "Phone", "slug": "", "price": "11", "category": "phones", "brand": "apple"},
+            {"name": "Case", "slug": "case", "price": "oops", "category": "", "brand": ""},
+            {"name": "Charger", "slug": "charger", "price": "5", "category": "missing", "brand": ""},
+        ])
+        images = self.write("images.csv", [{"product": "phone-1", "image": "product_images/a.png"}])
+
+        errors = self.run_import(
+            "--categories", categories, "--brands", brands, "--products", products, "--images", images,
+            "--batch-size", "2",
+        )
+
+        phones = Category.objects.get(slug="phones")
+        self.assertEqual(phones.parent.slug, "electronics")
+        self.assertEqual(phones.depth, 1)
+        self.assertTrue(phones.path.startswith(phones.parent.path))
+        imported = Product.objects.filter(category=phones).order_by("slug")
+        # первая строка без слага обновила товар с тем же названием, вторая — новый товар
+        self.assertEqual([(p.slug, p.price, p.brand.slug) for p in imported], [("phone", 10, "apple"), ("phone-1", 11, "apple")])
+        self.assertFalse(Product.objects.filter(slug__in=["case", "charger"]).exists())
+        self.assertIn("price", errors)
+        self.assertIn("missing", errors)
+        self.assertEqual(ProductImage.objects.get().product.slug, "phone-1")
+
+    def test_invalid_numbers_are_row_errors(self):
+        bad = [
+            {"name": "NaN", "price": "NaN"},
+            {"name": "Infinity", "price": "Infinity"},
+            {"name": "Huge", "price": "1e999"},
+            {"name": "Rounded", "price": "99999999.999"},
+            {"name": "Negative", "price": "-1"},
+            {"name": "Old", "price": "1", "old_price": "-5"},
+            {"name": "Discount", "price": "1", "discount": "150"},
+            {"name": "Rebate", "price": "1", "discount": "-10"},
+        ]
+        products = self.write("products.jsonl", [*bad, {"name": "Phone", "price": "10.005", "discount": "100"}])
+        errors = self.run_import("--products", products)
+
+        product = Product.objects.get()
+        self.assertEqual((product.name, product.price, product.discount), ("Phone", Decimal("10.00"), 100))
+        self.assertEqual(len(errors.splitlines()), len(bad))
+
+    def test_upsert_by_slug(self):
+        products = self.write("products.jsonl", [{"name": "Phone", "slug": "phone", "price": "10"}])
+        self.run_import("--products", products)
+        first = Product.objects.get(slug="phone")
+
+        products = self.write("products.jsonl", [{"name": "Phone X", "slug": "phone", "price": "12"}])
+        self.run_import("--products", products)
+        product = Product.objects.get(slug="phone")
+        self.assertEqual((product.pk, product.name, product.price), (first.pk, "Phone X", 12))
+
+    def test_reimport_without_slugs_updates_in_place(self):
+        Category.objects.create(name="Phones", slug="phones", image="categories/phones.png")
+        categories = self.write("categories.csv", [{"name": "Phones", "slug": "", "parent": "", "image": ""}])
+        products = self.write("products.csv", [
+            {"name": "Phone", "slug": "", "price": "10"},
+            {"name": "Phone", "slug": "", "price": "11"},
+            {"name": "Case", "slug": "", "price": "5"},
+        ])
+        for _ in range(2):
+            self.run_import("--categories", categories, "--products", products, "--batch-size", "2")
+
+        self.assertEqual(Category.objects.get().image.name, "categories/phones.png")
+        prices = sorted(Product.objects.values_list("slug", "price"))
+        self.assertEqual(prices, [("case", 5), ("phone", 10), ("phone-1", 11)])
+
+    def test_price_changes_reach_cart_totals(self):
+        product = Product.objects.create(name="Phone", slug="phone", description="", price=10, image="products/x.png")
+        user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+        CartItem.objects.create(profile=user.profile, product=product, quantity=3)
+        self.assertEqual(CartSummary.for_profile(user.profile.pk).total, 30)
+
+        self.run_import("--products", self.write("products.jsonl", [{"name": "Phone", "slug": "phone", "price": "12"}]))
+        self.assertEqual(CartSummary.for_profile(user.profile.pk).total, 36)
+
+    def test_resume_skips_loaded_batches(self):
+        products = self.write("products.csv", [
+            {"name": f"Item {i}", "slug": f"item-{i}", "price": "1"} for i in range(5)
+        ])
+        with mock.patch("product.importer.search.index_products", side_effect=[None, RuntimeError]):
+            with self.assertRaises(RuntimeError):
+                self.run_import("--products", products, "--batch-size", "2")
+        self.assertEqual(Product.objects.count(), 2)
+
+        with mock.patch("product.importer.Product.objects.bulk_create", wraps=Product.objects.bulk_create) as bulk:
+            self.run_import("--products", products, "--batch-size", "2", "--resume")
+        self.assertEqual(Product.objects.count(), 5)
+        self.assertEqual([len(c.args[0]) for c in bulk.call_args_list], [2, 1])
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Phones", slug="phones")
+        cls.product = Product.objects.create(
+            name="Phone", slug="phone", description="", price=100, category=category, image="products/phone.png"
+        )
+        cls.user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+
+    def setUp(self):
+        cache.clear()
+
+    def make_request(self, method="post", data=None, user=None, **extra):
+        factory = AsyncRequestFactory()
+        request = getattr(factory, method)("/", data or {}, **extra)
+        request.user = user or AnonymousUser()
+        request.session = SessionStore()
+        return request
+
+    async def test_add_to_cart(self):
+        for expected in (2, 4):
+            request = self.make_request(data={"quantity": 2}, user=self.user)
+            response = await async_views.add_to_cart(request, self.product.pk)
+            self.assertEqual(json.loads(response.content)["cart_qty"], expected)
+        item = await CartItem.objects.aget(profile__user=self.user)
+        self.assertEqual(item.quantity, 4)
+
+    async def test_guest_add_to_cart_sets_cookie(self):
+        response = await async_views.add_to_cart(self.make_request(), self.product.pk)
+        self.assertEqual(json.loads(response.content)["cart_qty"], 1)
+        self.assertIn(GuestCart.COOKIE, response.cookies)
+
+    async def test_update_cart(self):
+        await CartItem.objects.acreate(profile_id=self.user.profile.pk, product=self.product, quantity=1)
+        response = await async_views.update_cart(
+            self.make_request(data={"action": "increase"}, user=self.user), self.product.pk
+        )
+        self.assertEqual(json.loads(response.content)["cart_total"], "200.00")
+        response = await async_views.update_cart(
+            self.make_request(data={"action": "decrease"}, user=self.user), self.product.pk
+        )
+        self.assertEqual(json.loads(response.content)["quantity"], 1)
+
+    async def test_wishlist_toggle(self):
+        view = async_views.WishlistAddView.as_view()
+        added = json.loads((await view(self.make_request(user=self.user), product_id=self.product.pk)).content)
+        removed = json.loads((await view(self.make_request(user=self.user), product_id=self.product.pk)).content)
+        self.assertEqual((added["action"], added["wishlist_qty"]), ("added", 1))
+        self.assertEqual((removed["action"], removed["wishlist_qty"]), ("removed", 0))
+        response = await view(self.make_request(), product_id=self.product.pk)
+        self.assertEqual(response.status_code, 302)
+
+    async def test_quick_view_is_cached_and_conditional(self):
+        first = await async_views.quick_view(self.make_request("get"), pk=self.product.pk)
+        self.assertEqual(json.loads(first.content)["name"], "Phone")
+        self.assertEqual(first["X-Page-Cache"], "miss")
+
+        second = await async_views.quick_view(self.make_request("get"), pk=self.product.pk)
+        self.assertEqual(second["X-Page-Cache"], "hit")
+
+        request = self.make_request("get", headers={"If-None-Match": first["ETag"]})
+        self.assertEqual((await async_views.quick_view(request, pk=self.product.pk)).status_code, 304)
+
+    async def test_requires_post(self):
+        response = await async_views.add_to_cart(self.make_request("get"), self.product.pk)
+        self.assertEqual(response.status_code, 405)
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+        self.profile = self.user.profile
+        self.phone, self.case, self.cable = [
+            Product.objects.create(name=name, slug=name.lower(), description="", price=price, image="products/x.png")
+            for name, price in (("Phone", 100), ("Case", 15), ("Cable", 5))
+        ]
+        CartItem.objects.create(profile=self.profile, product=self.phone, quantity=1)
+        CartItem.objects.create(profile=self.profile, product=self.case, quantity=2)
+        self.client.force_login(self.user)
+
+    def post(self, changes):
+        return self.client.post(
+            reverse("cart_update_batch"), json.dumps({"changes": changes}), content_type="application/json"
+        )
+
+    def test_applies_changes_in_one_request(self):
+        response = self.post([
+            {"product": self.phone.pk, "op": "increase"},
+            {"product": self.phone.pk, "op": "increase", "quantity": 2},
+            {"product": self.case.pk, "op": "remove"},
+            {"product": self.cable.pk, "op": "set", "quantity": 3},
+        ])
+        data = response.json()
+        lines = {line["product"]: line for line in data["lines"]}
+        self.assertEqual((lines[self.phone.pk]["quantity"], lines[self.phone.pk]["item_total"]), (4, "400.00"))
+        self.assertTrue(lines[self.case.pk]["removed"])
+        self.assertEqual(lines[self.cable.pk]["item_total"], "15.00")
+        self.assertEqual((data["cart_qty"], data["cart_total"]), (7, "415.00"))
+
+        cart = dict(CartItem.objects.filter(profile=self.profile).values_list("product__slug", "quantity"))
+        self.assertEqual(cart, {"phone": 4, "cable": 3})
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.popularity, 4)
+
+    def test_query_count_does_not_grow_with_changes(self):
+        changes = [{"product": product.pk, "op": "decrease"} for product in (self.phone, self.case, self.cable)]
+        # сессия, пользователь, профиль, savepoint-ы, строки корзины, цены, UPDATE, DELETE, итоги, популярность
+        with self.assertNumQueries(12):
+            response = self.post(changes)
+        self.assertEqual(response.json()["cart_qty"], 1)
+
+    def test_invalid_changes(self):
+        for changes in ([], [{"product": self.phone.pk, "op": "explode"}], [{"product": "x", "op": "remove"}]):
+            self.assertEqual(self.post(changes).status_code, 400)
+        response = self.client.post(reverse("cart_update_batch"), "{", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    ADDS = 300
+    THREADS = 16
+
+    def setUp(self):
+        cache.clear()
+        self.profile = User.objects.create_user("buyer", "buyer@example.com", "secret").profile
+        self.product = Product.objects.create(name="Phone", slug="phone", description="", price=10)
+
+    def run_parallel(self, change, times):
+        def worker(_):
+            try:
+                # SQLite в тестах — общая память с блокировкой таблиц: занятую таблицу ждём и повторяем.
+                # Каждая попытка — одна транзакция, поэтому повтор не задваивает изменение
+                while True:
+                    try:
+                        return change(self.profile.pk, self.product)
+                    except OperationalError:
+                        time.sleep(0.001)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.THREADS) as pool:
+            return list(pool.map(worker, range(times)))
+
+    def assertCart(self, quantity):
+        lines = CartItem.objects.filter(profile=self.profile)
+        self.assertEqual(sum(line.quantity for line in lines), quantity)
+        self.assertLessEqual(lines.count(), 1)
+        cache.clear()
+        summary = CartSummary.for_profile(self.profile.pk)
+        self.assertEqual((summary.item_count, summary.line_count, summary.total), (quantity, min(quantity, 1), quantity * 10))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.popularity, quantity)
+
+    def test_parallel_adds_are_not_lost(self):
+        results = self.run_parallel(cart.increment, self.ADDS)
+        self.assertEqual(sorted(results), list(range(1, self.ADDS + 1)))
+        self.assertCart(self.ADDS)
+
+    def test_parallel_decrements_stop_at_zero(self):
+        cart.increment(self.profile.pk, self.product, 100)
+        results = self.run_parallel(cart.decrement, 150)
+        self.assertEqual(results.count(0), 51)
+        self.assertCart(0)
+
+
+class WishlistTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("buyer", password="pass")
+        self.profile = self.user.profile
+        self.products = [
+            Product.objects.create(name=f"Phone {i}", slug=f"phone-{i}", description="", price=100, image="products/x.png")
+            for i in range(5)
+        ]
+        self.client.force_login(self.user)
+
+    def toggle(self, product):
+        response = self.client.post(reverse("wishlist_add", args=[product.pk]))
+        return json.loads(response.content)
+
+    def test_ids_are_compact_and_sorted(self):
+        ids = wishlist.WishlistIds([30, 10, 20])
+        self.assertEqual(list(ids), [10, 20, 30])
+        self.assertIn(20, ids)
+        self.assertNotIn(25, ids)
+        ids.add(25)
+        ids.discard(10)
+        self.assertEqual(list(wishlist.WishlistIds.unpack(ids.pack())), [20, 25, 30])
+
+    def test_toggle_is_one_write(self):
+        wishlist.get_ids(self.profile.pk)
+        product = self.products[0]
+        # сессия, пользователь, профиль, товар и одна запись в таблицу связей
+        with self.assertNumQueries(5):
+            added = self.toggle(product)
+        with self.assertNumQueries(5):
+            removed = self.toggle(product)
+        self.assertEqual((added["action"], added["wishlist_qty"]), ("added", 1))
+        self.assertEqual((removed["action"], removed["wishlist_qty"]), ("removed", 0))
+        self.assertFalse(self.profile.favorites.exists())
+
+    def test_cache_follows_other_changes(self):
+        first, second = self.products[:2]
+        self.assertEqual(len(wishlist.get_ids(self.profile.pk)), 0)
+        self.profile.favorites.add(first, second)
+        self.assertEqual(list(wishlist.get_ids(self.profile.pk)), [first.pk, second.pk])
+        first.favorited_by.clear()
+        self.assertEqual(list(wishlist.get_ids(self.profile.pk)), [second.pk])
+        second.delete()
+        self.assertEqual(len(wishlist.get_ids(self.profile.pk)), 0)
+
+    def test_batch_state(self):
+        for product in self.products[:2]:
+            self.toggle(product)
+        ids = ",".join(str(product.pk) for product in self.products) + ",x"
+        response = self.client.get(reverse("wishlist_state"), {"ids": ids})
+        self.assertEqual(response.json()["favorited"], [p.pk for p in self.products[:2]])
+        self.assertIn("private", response["Cache-Control"])
+
+        self.client.logout()
+        response = self.client.get(reverse("wishlist_state"), {"ids": ids})
+        self.assertEqual(response.json()["favorited"], [])
+
+    def test_large_wishlist_is_not_inlined(self):
+        self.toggle(self.products[0])
+        response = self.client.get(reverse("home"))
+        self.assertContains(response, f'"{self.products[0].pk}"')
+        with mock.patch.object(wishlist, "MAX_INLINE", 0):
+            response = self.client.get(reverse("home"))
+        self.assertContains(response, reverse("wishlist_state"))
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("buyer", password="pass")
+        self.profile = self.user.profile
+        self.category = Category.objects.create(name="Phones", slug="phones")
+        self.other_category = Category.objects.create(name="Cases", slug="cases")
+        self.a, self.b, self.c, self.d = [
+            Product.objects.create(
+                name=f"Phone {i}", slug=f"phone-{i}", description="", price=100, category=self.category,
+                image="products/x.png",
+            )
+            for i in range(4)
+        ]
+        self.case = Product.objects.create(
+            name="Case", slug="case", description="", price=10, category=self.other_category, image="products/x.png",
+        )
+
+    def order(self, *products, status="new"):
+        order = Order.objects.create(profile=self.profile, status=status)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, name=product.name, price=product.price)
+
+    def neighbors(self, product):
+        return list(ProductNeighbor.objects.filter(product=product).order_by("rank").values_list("neighbor", flat=True))
+
+    def test_count_pairs(self):
+        pairs = recommendations.count_pairs([{1, 2}, {1, 2, 3}, {4}])
+        self.assertEqual(pairs[1, 2], 2)
+        self.assertEqual(pairs[3, 1], 1)
+        self.assertNotIn((4, 4), pairs)
+
+    def test_build_and_serve(self):
+        self.order(self.a, self.b)
+        self.order(self.a, self.b, self.c)
+        self.order(self.a, self.case)
+        self.order(self.a, self.d, status="canceled")
+        call_command("build_recommendations", stdout=io.StringIO())
+        self.assertEqual(self.neighbors(self.a), [self.b.pk, self.c.pk, self.case.pk])
+
+        # рекомендации — один запрос по индексу, недостающее добирается из категории
+        with self.assertNumQueries(1):
+            related = recommendations.related_products(self.a, limit=3)
+        self.assertEqual(related, [self.b, self.c, self.case])
+        self.assertEqual(recommendations.related_products(self.case), [self.a])
+        self.assertEqual(recommendations.related_products(self.d), [self.a, self.b, self.c])
+
+        response = self.client.get(self.a.get_absolute_url())
+        self.assertEqual(list(response.context["related_products"]), [self.b, self.c, self.case, self.d])
+
+    def test_refresh_is_incremental(self):
+        self.order(self.a, self.b)
+        recommendations.refresh()
+        self.order(self.c, self.d)
+        CartItem.objects.create(profile=self.profile, product=self.b, quantity=1)
+        CartItem.objects.create(profile=self.profile, product=self.case, quantity=1)
+
+        _, count = recommendations.refresh()
+        # новый заказ и изменившаяся корзина; пары a–b второй раз не считаются
+        self.assertEqual(count, 4)
+        self.assertEqual(self.neighbors(self.b), [self.a.pk, self.case.pk])
+        self.assertEqual(self.neighbors(self.c), [self.d.pk])
+        self.assertEqual(ProductNeighbor.objects.get(product=self.a, neighbor=self.b).score, 1)
+
+        recommendations.refresh(full=True)
+        self.assertEqual(self.neighbors(self.b), [self.a.pk, self.case.pk])
+
+
+class PriceHistogramTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.phones = Category.objects.create(name="Phones", slug="phones")
+        self.cases = Category.objects.create(name="Cases", slug="cases")
+
+    def create(self, price, category=None, slug=None):
+        return Product.objects.create(
+            name="Item", slug=slug or f"item-{uuid.uuid4().hex[:8]}", description="", price=price,
+            category=category or self.phones, image="products/x.png",
+        )
+
+    def counts(self):
+        return set(PriceBucket.objects.filter(count__gt=0).values_list("category", "bucket", "count"))
+
+    def test_buckets(self):
+        self.assertEqual(histograms.bucket_of(0.5), 0)
+        self.assertEqual(histograms.bucket_of(100), 17)
+        self.assertEqual(histograms.bucket_of(Decimal("99.99")), 16)
+        low, high = histograms.bucket_bounds(17)
+        self.assertAlmostEqual(low, 100)
+        self.assertLess(high, 134)
+
+    def test_follows_product_changes(self):
+        phone = self.create(100)
+        case = self.create(15, self.cases)
+        self.create(110)
+        phone.price = 5000
+        phone.save()
+        case.category = self.phones
+        case.save()
+        # только часть полей загружена — прежние значения читаются из базы
+        deferred = Product.objects.only("id", "name", "slug").get(pk=phone.pk)
+        deferred.price = 20
+        deferred.save()
+        self.create(300).delete()
+
+        incremental = self.counts()
+        histograms.rebuild()
+        self.assertEqual(incremental, self.counts())
+        self.assertIn((self.phones.pk, histograms.bucket_of(20), 1), incremental)
+
+    def test_histogram_is_cached(self):
+        self.create(100)
+        self.create(105)
+        self.create(10, self.cases)
+        self.assertEqual([b["count"] for b in histograms.get_histogram()], [1, 2])
+        self.assertEqual(histograms.get_histogram([self.phones.pk])[0]["count"], 2)
+        with self.assertNumQueries(0):
+            histograms.get_histogram([self.phones.pk])
+        self.create(1000)
+        self.assertEqual(len(histograms.get_histogram([self.phones.pk])), 2)
+
+    def test_endpoint_and_context(self):
+        self.create(100)
+        response = self.client.get(reverse("price_histogram"), {"category": self.cases.pk})
+        self.assertEqual(response.json(), {"buckets": []})
+        response = self.client.get(reverse("price_histogram"))
+        self.assertEqual(response.json()["buckets"][0]["count"], 1)
+        again = self.client.get(reverse("price_histogram"), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["price_histogram"][0]["count"], 1)
+        self.assertContains(response, 'id="price-histogram-data"')
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN — синтаксис SQLite")
+class QueryPlanTests(TestCase):
+    """Запросы каталога и списков заказов не должны скатываться в полный просмотр таблицы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = Category.objects.create(name="Phones", slug="phones")
+        cls.child = Category.objects.create(name="Android", slug="android", parent=cls.parent)
+        cls.brand = Brand.objects.create(name="Acme", slug="acme")
+        for i in range(6):
+            Product.objects.create(
+                name=f"Phone {i}", slug=f"phone-{i}", description="", price=100 + i, image="products/x.png",
+                category=cls.child if i % 2 else cls.parent, brand=cls.brand,
+            )
+        cls.user = User.objects.create_user("buyer", password="pass")
+        cls.staff = User.objects.create_user("staff", password="pass", is_staff=True)
+        for status in ("new", "accepted", "canceled"):
+            Order.objects.create(profile=cls.user.profile, status=status)
+
+    def setUp(self):
+        cache.clear()
+
+    def plans(self, url, table, data=None, user=None):
+        """{SQL: строки плана} для запросов страницы к table (кроме агрегатов фасетов)"""
+        if user is not None:
+            self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, data).status_code, 200)
+        plans = {}
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                sql = query["sql"]
+                # фасеты и счётчики по всему каталогу — агрегаты, они кешируются
+                if not sql.startswith("SELECT") or f'FROM "{table}"' not in sql or "GROUP BY" in sql:
+                    continue
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                plans[sql] = [row[-1] for row in cursor.fetchall()]
+        self.assertTrue(plans, f"нет запросов к {table}")
+        return plans
+
+    def assertIndexed(self, plans):
+        for sql, plan in plans.items():
+            # обход таблицы в порядке первичного ключа с LIMIT останавливается на первой странице
+            by_rowid = re.search(r'ORDER BY "\w+"\."id" (ASC|DESC) LIMIT', sql)
+            for step in plan:
+                full_scan = step.startswith("SCAN ") and " USING " not in step and not by_rowid
+                with self.subTest(sql=sql):
+                    self.assertFalse(full_scan or "TEMP B-TREE FOR ORDER BY" in step, "\n".join(plan))
+
+    def test_catalog(self):
+        url = reverse("home")
+        category, brand = str(self.parent.pk), str(self.brand.pk)
+        for data in (
+            {}, {"sort": "price_asc"}, {"sort": "price_desc"}, {"sort": "popular"},
+            {"category": category}, {"category": category, "sort": "price_asc"},
+            {"category": category, "sort": "popular"}, {"brand": brand, "sort": "price_desc"},
+            {"price_min": "101", "price_max": "104", "sort": "price_asc"},
+        ):
+            self.assertIndexed(self.plans(url, "product_product", data))
+
+    def test_category_page(self):
+        plans = self.plans(self.parent.get_absolute_url(), "product_product")
+        self.assertIndexed(plans)
+        # поддерево — диапазон по индексу пути категории
+        self.assertTrue(all("INDEX product_category_path" in " ".join(plan) for plan in plans.values()))
+
+    def test_new_products_use_partial_index(self):
+        plans = self.plans(reverse("home"), "product_product")
+        new_products = [plan for sql, plan in plans.items() if '"status" = \'new\'' in sql]
+        self.assertTrue(new_products)
+        self.assertIn("product_new_arrivals_idx", " ".join(new_products[0]))
+
+    def test_order_lists(self):
+        self.assertIndexed(self.plans(reverse("my_orders"), "accounts_order", user=self.user))
+        for data in ({}, {"status": "new"}):
+            self.assertIndexed(self.plans(reverse("admin_orders"), "accounts_order", data, user=self.staff))
+
+
+class QueryLogTests(TestCase):
+    def test_groups_statement_shapes(self):
+        products = [
+            Product.objects.create(name=f"Phone {i}", slug=f"phone-{i}", description="", price=100) for i in range(3)
+        ]
+        with QueryLog() as log:
+            for product in products:
+                list(product.images.all())
+            list(Product.objects.filter(pk__in=[p.pk for p in products]))
+        self.assertEqual(len(log), 4)
+        self.assertEqual(list(log.repeated().values()), [3])
+        self.assertEqual(
+            shape("SELECT 1 FROM t WHERE a = 5 AND b = 'x''y' AND c IN (?, ?)"),
+            "SELECT ? FROM t WHERE a = ? AND b = ? AND c IN (...)",
+        )
+
+
+def seed_shop():
+    """Небольшой магазин, на котором N+1 виден как повтор запроса: у всего по 3+ дочерних строки"""
+    brands = [Brand.objects.create(name=f"Brand {i}", slug=f"brand-{i}") for i in range(3)]
+    categories = []
+    for i in range(2):
+        root = Category.objects.create(name=f"Root {i}", slug=f"root-{i}")
+        categories += [root] + [
+            Category.objects.create(name=f"Sub {i}.{j}", slug=f"sub-{i}-{j}", parent=root) for j in range(3)
+        ]
+    products = []
+    for i in range(16):
+        product = Product.objects.create(
+            name=f"Phone {i}", slug=f"phone-{i}", description="", price=100 + i * 10, old_price=200 + i * 10,
+            discount=10, category=categories[i % len(categories)], brand=brands[i % len(brands)],
+            image="products/x.png" if i % 4 else None, status="new",
+        )
+        ProductImage.objects.bulk_create([ProductImage(product=product, image=f"product_images/{i}-{j}.png") for j in range(3)])
+        products.append(product)
+
+    buyer = User.objects.create_user("buyer", password="pass")
+    staff = User.objects.create_user("staff", password="pass", is_staff=True)
+    for product in products[:4]:
+        CartItem.objects.create(profile=buyer.profile, product=product, quantity=2)
+    buyer.profile.favorites.add(*products[4:8])
+    for i in range(4):
+        order = Order.objects.create(profile=buyer.profile, full_name="Buyer", phone="123")
+        for product in products[i:i + 3]:
+            OrderItem.objects.create(order=order, product=product, name=product.name, price=product.price, quantity=1)
+    return products, buyer, staff
+
+
+class ViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Каждое представление product/urls.py: бюджет запросов на холодном кеше и без N+1"""
+    # холодный кеш, авторизованный покупатель: сессия, пользователь, профиль и навбар входят в бюджет
+    QUERY_BUDGETS = {
+        'home': 14,
+        'category_list': 1,
+        'category_detail': 9,
+        'product_detail': 13,  # с валидаторами ETag: строка товара и его соседи
+        'checkout': 0,
+        'create_order': 9,
+        'search_suggestions': 1,
+        'add_to_cart': 8,
+        'wishlist_add': 6,
+        'remove_from_wishlist': 5,
+        'remove_cart_item': 7,
+        'quick_view': 3,
+        'cart_update': 8,
+        'cart_update_batch': 10,
+        'cart_view': 9,
+        'my_orders': 10,
+        'admin_orders': 13,
+        'process_order': 4,
+        'catalog_export': 5,
+        'wishlist_state': 4,
+        'price_histogram': 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products, cls.buyer, cls.staff = seed_shop()
+        cls.product = cls.products[0]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_every_view_has_budget(self):
+        names = {pattern.name for pattern in product_urls.urlpatterns}
+        self.assertEqual(names - self.QUERY_BUDGETS.keys(), set())
+
+    def test_catalog_pages(self):
+        product, category = self.product, self.product.category
+        for user in (None, self.buyer):
+            if user:
+                self.client.force_login(user)
+            self.request_within_budget("get", "home")
+            self.request_within_budget("get", "home", data={"category": category.pk, "sort": "price_asc"})
+            self.request_within_budget("get", "category_list")
+            self.request_within_budget("get", "category_detail", args=[category.parent.slug if category.parent else category.slug])
+            self.request_within_budget("get", "product_detail", args=[product.slug])
+            cache.clear()
+        self.request_within_budget("get", "quick_view", args=[product.pk])
+        self.request_within_budget("get", "search_suggestions", data={"q": "pho"})
+        self.request_within_budget("get", "price_histogram")
+        self.request_within_budget("get", "wishlist_state", data={"ids": ",".join(str(p.pk) for p in self.products)})
+        self.request_within_budget("get", "product_detail", args=[self.products[4].slug])
+
+    def test_cart_and_checkout(self):
+        self.request_within_budget("post", "add_to_cart", args=[self.product.pk], data={"quantity": 1})
+        self.client.force_login(self.buyer)
+        self.request_within_budget("get", "cart_view")
+        self.request_within_budget("get", "checkout")
+        self.request_within_budget("post", "add_to_cart", args=[self.products[5].pk], data={"quantity": 2})
+        self.request_within_budget("post", "cart_update", args=[self.product.pk], data={"action": "increase"})
+        changes = {"changes": [{"product": p.pk, "op": "increase"} for p in self.products[:6]]}
+        self.request_within_budget(
+            "post", "cart_update_batch", data=json.dumps(changes), content_type="application/json",
+        )
+        self.request_within_budget("post", "remove_cart_item", args=[self.products[1].pk])
+        self.request_within_budget("post", "create_order", data={
+            "full_name": "Buyer", "phone": "123", "payment_method": "bank", "checkout_token": str(uuid.uuid4()),
+        })
+
+    def test_wishlist(self):
+        self.client.force_login(self.buyer)
+        self.request_within_budget("post", "wishlist_add", args=[self.product.pk])
+        self.request_within_budget("get", "remove_from_wishlist", args=[self.products[4].pk])
+        self.request_within_budget("get", "wishlist_state", data={"ids": ",".join(str(p.pk) for p in self.products)})
+
+    def test_orders(self):
+        self.client.force_login(self.buyer)
+        self.request_within_budget("get", "my_orders")
+        self.client.force_login(self.staff)
+        self.request_within_budget("get", "admin_orders")
+        self.request_within_budget("get", "admin_orders", data={"status": "new"})
+        order = Order.objects.first()
+        self.request_within_budget("get", "process_order", args=[order.pk, "accept"])
+        self.request_within_budget("get", "catalog_export", data={"format": "csv"})
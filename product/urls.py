@@ -1,27 +1,42 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from .views import *
 
+# Под ASGI AJAX-представления корзины и каталога — async (product/async_views.py)
+if settings.ASYNC_VIEWS:
+    from . import async_views as ajax_views
+    search_suggestions = ajax_views.search_suggestions
+else:
+    ajax_views = views
+    search_suggestions = views.SearchSuggestionsView.as_view()
+
 urlpatterns = [
     path('', views.HomePageView.as_view(), name='home'),
+    path('categories/', views.CategoryListView.as_view(), name='category_list'),
     path('category/<slug:slug>/', views.CategoryDetailView.as_view(), name='category_detail'),
     path('product/<slug:slug>/', views.ProductDetailView.as_view(), name='product_detail'),
 
     path("checkout/", CheckoutView.as_view(), name="checkout"),
     path("order/create/", create_order, name="create_order"),
-    path('search-suggestions/', SearchSuggestionsView.as_view(), name='search_suggestions'),
+    path('search-suggestions/', search_suggestions, name='search_suggestions'),
 
-    path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('wishlist/add/<int:product_id>/', views.WishlistAddView.as_view(), name='wishlist_add'),
+    path('cart/add/<int:product_id>/', ajax_views.add_to_cart, name='add_to_cart'),
+    path('wishlist/add/<int:product_id>/', ajax_views.WishlistAddView.as_view(), name='wishlist_add'),
     path('wishlist/remove/<int:product_id>/', views.remove_from_wishlist, name='remove_from_wishlist'),
     path('cart/remove/<int:product_id>/', views.remove_cart_item, name='remove_cart_item'),
-    path("product/quick-view/<int:pk>/", views.quick_view, name="quick_view"),
+    path("product/quick-view/<int:pk>/", ajax_views.quick_view, name="quick_view"),
 
-    path('cart/update/<int:product_id>/', views.update_cart, name='cart_update'),
+    path('cart/update/<int:product_id>/', ajax_views.update_cart, name='cart_update'),
+    path('cart/update/', ajax_views.update_cart_batch, name='cart_update_batch'),
 
     path('cart/', views.CartAndWishlistView.as_view(), name='cart_view'),
 
     path('my-orders/', views.my_orders, name='my_orders'),
     path('admin-orders/', views.admin_orders, name='admin_orders'),
     path('admin-orders/<int:order_id>/<str:action>/', views.process_order, name='process_order'),
+
+    path('api/catalog/export/', views.catalog_export, name='catalog_export'),
+    path('api/wishlist/state/', views.wishlist_state, name='wishlist_state'),
+    path('api/price-histogram/', views.price_histogram, name='price_histogram'),
 ]
@@ -2,19 +2,37 @@ from django.views.generic import ListView, DetailView, TemplateView
 from .models import *
 from accounts.models import *
 from django.db.models import Sum, Min, Max, Q, F
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views import View
 from django.shortcuts import get_object_or_404, render, redirect
 from django.utils.decorators import method_decorator
 from decimal import Decimal
 import json
-from django.views.decorators.http import require_POST
+import uuid
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET, require_POST
 from accounts.models import CartItem
 from django.db.models import Count
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
-
-
+from . import cart, export, histograms, pagecache, recommendations, search, wishlist
+from .pagecache import cached_page
+from .conditional import (
+    conditional_view, price_histogram_etag, product_detail_etag, quick_view_etag, quick_view_last_modified,
+    suggestions_etag,
+)
+from .suggestions import index as suggestions_index
+from .facets import apply_catalog_filters, catalog_version, filters_signature, get_facets, parse_catalog_filters
+from .cart import apply_changes, changes_response_data, parse_changes
+from .checkout import EmptyCartError, parse_checkout_token, place_order
+from .shopper import get_shopper
+from .pagination import (
+    ORDER_SORT_KEYS, ORDERS_PAGE_SIZE, PAGE_SIZES, SORT_KEYS, KeysetPage, clamp_page_size, order_by_keys,
+    paginate_keyset,
+)
+
+
+@method_decorator(cached_page, name='dispatch')
 class HomePageView(ListView):
     model = Product
     template_name = "product/home.html"
@@ -25,172 +43,128 @@ class HomePageView(ListView):
         queryset = Product.objects.select_related('category', 'brand').all()
 
         # --- Параметры фильтров ---
-        q = self.request.GET.get('q', '').strip()
-        category_ids = self.request.GET.getlist('category')
-        brand_ids = self.request.GET.getlist('brand')
-        status_list = self.request.GET.getlist('status')
+        self.filters = parse_catalog_filters(self.request.GET)
         sort = self.request.GET.get('sort')
         show = self.request.GET.get('show')
-        price_min = self.request.GET.get('price_min')
-        price_max = self.request.GET.get('price_max')
-        discounted = self.request.GET.get('discounted')
-
-        # --- Поиск по названию и категории ---
-        if q:
-            queryset = queryset.filter(
-                Q(name__icontains=q) | Q(category__name__icontains=q)
-            )
-
-        # --- Фильтр по категориям ---
-        if category_ids and not ("0" in category_ids):
-            queryset = queryset.filter(category_id__in=category_ids)
-
-        # --- Фильтр по брендам ---
-        if brand_ids and not ("0" in brand_ids):
-            queryset = queryset.filter(brand_id__in=brand_ids)
-
-        # --- Фильтр по статусу товара ---
-        if status_list:
-            queryset = queryset.filter(status__in=status_list)
-
-        # --- Фильтр по цене ---
-        if price_min:
-            try:
-                queryset = queryset.filter(price__gte=float(price_min))
-            except ValueError:
-                pass
-        if price_max:
-            try:
-                queryset = queryset.filter(price__lte=float(price_max))
-            except ValueError:
-                pass
-
-        # --- Фильтр по скидке ---
-        if discounted == '1':
-            queryset = queryset.filter(
-                Q(discount__gt=0) | Q(old_price__gt=F('price'))
-            )
-
-        # --- Сортировка ---
-        if sort == 'price_asc':
-            queryset = queryset.order_by('price')
-        elif sort == 'price_desc':
-            queryset = queryset.order_by('-price')
-        elif sort == 'popular':
-            queryset = queryset.annotate(total_in_cart=Sum('cartitem__quantity')).order_by('-total_in_cart')
+
+        # --- Поиск, категории, бренды, статус, цена, скидка ---
+        queryset = apply_catalog_filters(queryset, self.filters)
+
+        # --- Сортировка (при поиске без явной сортировки — по релевантности) ---
+        self.sort_key = None
+        if self.filters['q'] and not sort:
+            queryset = search.order_by_relevance(queryset, self.filters['q'])
         else:
-            queryset = queryset.order_by('-id')
+            self.sort_key = sort if sort in SORT_KEYS else 'newest'
+            queryset = order_by_keys(queryset, self.sort_key)
 
         # --- Пагинация ---
-        if show:
-            try:
-                self.paginate_by = int(show)
-            except ValueError:
-                self.paginate_by = 20
+        self.paginate_by = clamp_page_size(show)
 
         return queryset
 
+    def paginate_queryset(self, queryset, page_size):
+        # Курсорный режим для сортировок по индексируемым ключам;
+        # ?page=N и сортировка по релевантности — обычная постраничная навигация
+        if self.sort_key and 'page' not in self.request.GET:
+            page = paginate_keyset(queryset, self.sort_key, page_size, self.request.GET.get('cursor'))
+            return None, page, page.object_list, page.has_other_pages()
+        return super().paginate_queryset(queryset, page_size)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        profile = getattr(self.request.user, 'profile', None)
 
-        # --- Категории ---
-        categories = Category.objects.annotate(product_count=Count('products'))
+        # --- Фасеты фильтра (кешируются по состоянию фильтра) ---
+        facets = get_facets(self.filters)
+        pagecache.add_tags(self.request, 'catalog')
+        if self.sort_key == 'popular':
+            # порядок меняется с каждой корзиной и заказом (product/popularity.py)
+            pagecache.add_tags(self.request, 'popular')
+        context['catalog_version'] = catalog_version()
+        context['filters_signature'] = filters_signature(self.filters)
+
+        # --- Категории (тот же список, что и в навбаре) ---
+        categories = get_shopper(self.request).categories
+        for category in categories:
+            category.product_count = facets['categories'].get(category.id, 0)
         context['categories'] = categories
-        context['selected_categories'] = self.request.GET.getlist('category')
+        # отметки фильтра — только из нормализованного состояния: боковая панель
+        # кешируется по filters_signature, сырые значения GET в неё попадать не должны
+        context['selected_categories'] = self.filters['category']
 
         # --- Бренды ---
-        brands_qs = Brand.objects.annotate(product_count=Count('products')).filter(product_count__gt=0)
-        context['brands'] = brands_qs
-        context['selected_brands'] = self.request.GET.getlist('brand')
+        brands = [brand for brand in Brand.objects.all() if brand.id in facets['brands']]
+        for brand in brands:
+            brand.product_count = facets['brands'][brand.id]
+        context['brands'] = brands
+        context['selected_brands'] = self.filters['brand']
 
         # --- Статус товара (кружки) ---
-        status_counts_qs = Product.objects.values('status').annotate(count=Count('id'))
-        status_counts = {item['status']: item['count'] for item in status_counts_qs}
-
         context['status_choices'] = Product.STATUS_CHOICES
-        context['status_counts'] = status_counts
-        context['selected_status'] = self.request.GET.getlist('status')
+        context['status_counts'] = facets['statuses']
+        context['selected_status'] = self.filters['status']
 
         # --- Поиск, сортировка, пагинация ---
         context['search_query'] = self.request.GET.get('q', '')
         context['sort'] = self.request.GET.get('sort', 'popular')
         context['show'] = self.paginate_by
+        context['page_sizes'] = PAGE_SIZES
+        context['cursor_mode'] = isinstance(context['page_obj'], KeysetPage)
 
-        # --- Топ категории и продукты ---
-        context['top_categories'] = (
-            Category.objects
-                .annotate(product_count=Count("products"))
-                .order_by("-product_count")[:3]
-        )
-        context['top_products'] = Product.objects.annotate(
-            total_sold=Sum('cartitem__quantity')
-        ).order_by('-total_sold')[:3]
+        # --- Топ продукты (топ категории, корзина и избранное — в ShopperState) ---
+        context['top_products'] = Product.objects.select_related('category').order_by('-popularity', '-id')[:3]
+        context['popular_version'] = pagecache.tag_versions(['popular'])['popular']
 
         # --- Диапазон цен ---
-        prices = Product.objects.aggregate(min_price=Min('price'), max_price=Max('price'))
-        context['min_price'] = prices['min_price'] or 0
-        context['max_price'] = prices['max_price'] or 0
-        context['selected_min_price'] = self.request.GET.get('price_min', context['min_price'])
-        context['selected_max_price'] = self.request.GET.get('price_max', context['max_price'])
-
-        # --- Корзина ---
-        cart_items = []
-        cart_qty = 0
-        cart_total = 0
-        if profile:
-            profile_cart = profile.cartitem_set.select_related('product').all()
-            for item in profile_cart:
-                cart_items.append({'product': item.product, 'quantity': item.quantity})
-                cart_qty += item.quantity
-                cart_total += item.quantity * item.product.price
-        context['cart_items'] = cart_items
-        context['cart_qty'] = cart_qty
-        context['cart_total'] = cart_total
-
-        # --- Избранное ---
-        wishlist_items = []
-        if profile:
-            wishlist_items = list(profile.favorites.all())
-        context['wishlist_items'] = wishlist_items
-        context['wishlist_qty'] = len(wishlist_items)
+        context['min_price'] = facets['min_price']
+        context['max_price'] = facets['max_price']
+        context['selected_min_price'] = (
+            self.filters['price_min'] if self.filters['price_min'] is not None else context['min_price']
+        )
+        context['selected_max_price'] = (
+            self.filters['price_max'] if self.filters['price_max'] is not None else context['max_price']
+        )
+        # распределение цен выбранных категорий — для плотности и «прилипания» слайдера
+        context['price_histogram'] = histograms.get_histogram(self.filters['category'])
 
         # --- Новые товары для отдельного блока ---
-        context['new_products'] = Product.objects.filter(
+        context['new_products'] = Product.objects.select_related('category').filter(
             status='new', is_available=True
         ).order_by('-created_at')[:10]
 
         return context
 
 
+@method_decorator(conditional_view(suggestions_etag, vary_on_user=False), name='dispatch')
 class SearchSuggestionsView(View):
     def get(self, request, *args, **kwargs):
-        q = request.GET.get('q', '').strip()
-        category_id = request.GET.get('category', '0')
-        suggestions = []
-
-        if q:
-            products = Product.objects.filter(name__icontains=q)
-            if category_id != '0':
-                products = products.filter(category_id=category_id)
-            products = products[:5]
-            suggestions = [p.name for p in products]
-        else:
-            products = Product.objects.all()
-            if category_id != '0':
-                products = products.filter(category_id=category_id)
-            products = products[:5]
-            suggestions = [p.name for p in products]
+        # Подсказки отдаёт индекс в памяти процесса, без запросов к базе
+        suggestions = suggestions_index.lookup(*suggestion_params(request), limit=5)
 
         return JsonResponse({'suggestions': suggestions})
 
 
+def suggestion_params(request):
+    """(запрос, id категории) из GET-параметров подсказок"""
+    q = request.GET.get('q', '').strip()
+    try:
+        category_id = int(request.GET.get('category', '0'))
+    except ValueError:
+        category_id = 0
+    return q, category_id
+
+
 class CategoryListView(ListView):
     model = Category
     template_name = 'product/category_list.html'
     context_object_name = 'categories'
 
+    def get_queryset(self):
+        # корни дерева с children и счётчиками товаров поддерева — один запрос
+        return Category.tree()
+
 
+@method_decorator(cached_page, name='dispatch')
 class CategoryDetailView(DetailView):
     model = Category
     template_name = "product/category_detail.html"
@@ -200,179 +174,185 @@ class CategoryDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        products = self.object.products.all()
+        pagecache.add_tags(self.request, f'category:{self.object.pk}')
+        # товары категории вместе с подкатегориями
+        products = self.object.get_products().select_related('category')
         context['products'] = products
+        context['breadcrumbs'] = self.object.get_breadcrumbs()
         context['has_products'] = products.exists()
-
-        # --- Избранное для текущего пользователя ---
-        profile = getattr(self.request.user, 'profile', None)
-        wishlist_items = []
-        if profile:
-            wishlist_items = list(profile.favorites.all())
-        context['wishlist_items'] = wishlist_items
-
         return context
 
 
+# без Last-Modified: страница зависит и от соседей товара, а updated_at меняется только у него самого
+@method_decorator(conditional_view(product_detail_etag), name='dispatch')
+@method_decorator(cached_page, name='dispatch')
 class ProductDetailView(DetailView):
     model = Product
     template_name = 'product/product_detail.html'
     context_object_name = 'product'
+    # категория, бренд и галерея нужны шаблону — без отдельных запросов из него
+    queryset = Product.objects.select_related('category', 'brand').prefetch_related('images')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         product = self.object
-        related_products = Product.objects.filter(
-            category=product.category
-        ).exclude(id=product.id)[:4]
+        # «с этим покупают» из предрасчитанной таблицы, не хватает — товары той же категории
+        related_products = recommendations.related_products(product)
+        pagecache.add_tags(
+            self.request, f'product:{product.pk}', f'category:{product.category_id}',
+            *(f'product:{related.pk}' for related in related_products),
+        )
         context['related_products'] = related_products
         return context
 
 
-@require_POST
-def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-
+# ----------------------
+# Корзина: общее для sync- и async-представлений (product/async_views.py)
+# ----------------------
+def cart_quantity(request):
     try:
         quantity = int(request.POST.get('quantity', 1))
     except (ValueError, TypeError):
         quantity = 1
-    if quantity < 1:
-        quantity = 1
+    return max(quantity, 1)
 
-    if request.user.is_authenticated:
-        profile, _ = Profile.objects.get_or_create(user=request.user)
-        cart_item, created = CartItem.objects.get_or_create(
-            profile=profile,
-            product=product,
-            defaults={"quantity": quantity}
-        )
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
 
-        cart_qty = CartItem.objects.filter(profile=profile).aggregate(
-            total=Sum('quantity')
-        )['total'] or 0
+def added_to_cart_response(product, cart_qty, guest_token=None):
+    response = JsonResponse({
+        'success': True,
+        'message': f'{product.name} добавлен в корзину',
+        'cart_qty': cart_qty,
+    })
+    if guest_token is not None:
+        GuestCart.remember(response, guest_token)
+    return response
 
-    else:
-        cart = request.session.get('cart', {})
 
-        if str(product_id) in cart:
-            cart[str(product_id)]['quantity'] += quantity
-        else:
-            cart[str(product_id)] = {
-                'name': product.name,
-                'price': float(product.price),
-                'quantity': quantity,
-            }
+def cart_action(request):
+    action = request.POST.get('action')
+    if not action and request.body:
+        try:
+            action = json.loads(request.body.decode('utf-8')).get('action')
+        except Exception:
+            action = None
+    return action
 
-        request.session['cart'] = cart
-        request.session.modified = True
-        cart_qty = sum(item['quantity'] for item in cart.values())
+
+def updated_cart_response(quantity, price, total):
+    if not quantity:
+        return JsonResponse({
+            'status': 'success',
+            'removed': True,
+            'cart_total': f'{total:.2f}',
+        })
 
     return JsonResponse({
-        'success': True,
-        'message': f'{product.name} добавлен в корзину',
-        'cart_qty': cart_qty,
+        'status': 'success',
+        'removed': False,
+        'quantity': quantity,
+        'item_total': f'{quantity * price:.2f}',
+        'cart_total': f'{total:.2f}',
     })
 
 
+@require_POST
+def add_to_cart(request, product_id):
+    product = get_object_or_404(Product, id=product_id)
+    quantity = cart_quantity(request)
+
+    if request.user.is_authenticated:
+        profile, _ = Profile.objects.get_or_create(user=request.user)
+        cart.increment(profile.pk, product, quantity)
+        cart_qty = CartSummary.for_profile(profile.pk).item_count
+
+    else:
+        token, items = GuestCart.add(GuestCart.token_from(request), product.pk, quantity)
+        cart_qty = sum(items.values())
+
+    return added_to_cart_response(product, cart_qty, None if request.user.is_authenticated else token)
+
+
 @method_decorator(login_required, name='dispatch')
 class WishlistAddView(View):
     def post(self, request, product_id):
         profile, _ = Profile.objects.get_or_create(user=request.user)
-        product = get_object_or_404(Product, id=product_id)
+        product = get_object_or_404(Product.objects.only('id'), id=product_id)
+
+        # членство проверяется по кешированному набору id, в базу — одна запись
+        added, ids = wishlist.toggle(profile.pk, product.pk)
+        return wishlist_response(added, ids)
 
-        if product in profile.favorites.all():
-            profile.favorites.remove(product)
-            action = 'removed'
-        else:
-            profile.favorites.add(product)
-            action = 'added'
 
-        wishlist_qty = profile.favorites.count()
-        return JsonResponse({'success': True, 'action': action, 'wishlist_qty': wishlist_qty})
+def wishlist_response(added, ids):
+    return JsonResponse({'success': True, 'action': 'added' if added else 'removed', 'wishlist_qty': len(ids)})
 
 
 @login_required
 def remove_from_wishlist(request, product_id):
     profile, _ = Profile.objects.get_or_create(user=request.user)
-    product = get_object_or_404(Product, id=product_id)
-    profile.favorites.remove(product)
+    product = get_object_or_404(Product.objects.only('id'), id=product_id)
+    wishlist.remove(profile.pk, product.pk)
     return redirect('cart_view')
 
 
+@never_cache
+@require_GET
+def wishlist_state(request):
+    """Какие из ?ids=1,2,3 в избранном: сердечки на страницах из общего кеша"""
+    shopper = get_shopper(request)
+    ids = wishlist.parse_ids(request.GET.get('ids'))
+    if shopper.profile is None:
+        return JsonResponse({'favorited': []})
+    return JsonResponse({'favorited': wishlist.favorited(shopper.profile.pk, ids)})
+
+
 @method_decorator(login_required, name='dispatch')
 class CartAndWishlistView(TemplateView):
     template_name = 'product/cart.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        profile, _ = Profile.objects.get_or_create(user=self.request.user)
-
-        cart_items = profile.cartitem_set.select_related('product').all()
-        context['cart_items'] = cart_items
-        context['cart_qty'] = sum(item.quantity for item in cart_items)
-        context['cart_total'] = sum(Decimal(item.total_price) for item in cart_items)
-
-        wishlist_items = profile.favorites.all()
-        context['wishlist_items'] = wishlist_items
-        context['wishlist_qty'] = wishlist_items.count()
+        shopper = get_shopper(self.request)
+        profile = shopper.profile or Profile.objects.get_or_create(user=self.request.user)[0]
 
+        # корзина и счётчики берутся из ShopperState через контекст-процессор
+        context['wishlist_items'] = list(profile.favorites.all())
+        context['checkout_token'] = uuid.uuid4()
         return context
 
 
 def _cart_total(profile) -> Decimal:
-    items = profile.cartitem_set.select_related('product')
-    return sum((ci.quantity * ci.product.price) for ci in items) or Decimal('0.00')
+    return CartSummary.for_profile(profile.pk).total
 
 
 @require_POST
 @login_required
 def update_cart(request, product_id):
-    profile, _ = Profile.objects.get_or_create(user=request.user)
-    product = get_object_or_404(Product, pk=product_id)
-    cart_item, _ = CartItem.objects.get_or_create(profile=profile, product=product)
-
-    action = request.POST.get('action')
-    if not action and request.body:
-        try:
-            action = json.loads(request.body.decode('utf-8')).get('action')
-        except Exception:
-            action = None
+    action = cart_action(request)
+    if action not in ('increase', 'decrease'):
+        return JsonResponse({'status': 'error', 'message': 'Unknown action'}, status=400)
 
-    removed = False
+    profile, _ = Profile.objects.get_or_create(user=request.user)
+    product = get_object_or_404(Product.objects.only('id', 'price'), pk=product_id)
     if action == 'increase':
-        cart_item.quantity += 1
-        cart_item.save()
-    elif action == 'decrease':
-        if cart_item.quantity > 1:
-            cart_item.quantity -= 1
-            cart_item.save()
-        else:
-            cart_item.delete()
-            removed = True
+        quantity = cart.increment(profile.pk, product)
     else:
-        return JsonResponse({'status': 'error', 'message': 'Unknown action'}, status=400)
+        quantity = cart.decrement(profile.pk, product)
 
-    total = sum((ci.quantity * ci.product.price) for ci in profile.cartitem_set.all())
+    return updated_cart_response(quantity, product.price, _cart_total(profile))
 
-    if removed:
-        return JsonResponse({
-            'status': 'success',
-            'removed': True,
-            'cart_total': f'{total:.2f}',
-        })
 
-    item_total = cart_item.quantity * cart_item.product.price
-    return JsonResponse({
-        'status': 'success',
-        'removed': False,
-        'quantity': cart_item.quantity,
-        'item_total': f'{item_total:.2f}',
-        'cart_total': f'{total:.2f}',
-    })
+@require_POST
+@login_required
+def update_cart_batch(request):
+    """Несколько изменений корзины за один запрос — страница корзины копит быстрые клики"""
+    try:
+        changes = parse_changes(json.loads(request.body.decode('utf-8') or '{}'))
+    except (ValueError, UnicodeDecodeError) as exc:
+        return JsonResponse({'status': 'error', 'message': str(exc)}, status=400)
+    profile, _ = Profile.objects.get_or_create(user=request.user)
+    lines, summary = apply_changes(profile, changes)
+    return JsonResponse(changes_response_data(lines, summary))
 
 
 @require_POST
@@ -384,9 +364,7 @@ def remove_cart_item(request, product_id):
 
 
 def get_top_selling_products():
-    return Product.objects.annotate(
-        total_sold=Sum('cartitem__quantity')
-    ).order_by('-total_sold')[:3]
+    return Product.objects.order_by('-popularity', '-id')[:3]
 
 
 class CheckoutView(TemplateView):
@@ -397,35 +375,23 @@ class CheckoutView(TemplateView):
 @require_POST
 def create_order(request):
     profile, _ = Profile.objects.get_or_create(user=request.user)
-    cart_items = profile.cartitem_set.select_related("product")
 
-    if not cart_items.exists():
+    try:
+        order, created = place_order(
+            profile,
+            full_name=request.POST.get("full_name"),
+            phone=request.POST.get("phone"),
+            payment_method=request.POST.get("payment_method"),
+            token=parse_checkout_token(request.POST.get("checkout_token")),
+        )
+    except EmptyCartError:
         messages.error(request, "Ваша корзина пуста")
         return redirect("cart_view")
 
-    full_name = request.POST.get("full_name")
-    phone = request.POST.get("phone")
-    payment_method = request.POST.get("payment_method")
-
-    order = Order.objects.create(
-        profile=profile,
-        full_name=full_name,
-        phone=phone,
-        payment_method=payment_method
-    )
-
-    for item in cart_items:
-        OrderItem.objects.create(
-            order=order,
-            product=item.product,
-            name=item.product.name,
-            price=item.product.price,
-            quantity=item.quantity
-        )
-
-    cart_items.delete()
-
-    messages.success(request, "Ваш заказ успешно оформлен!")
+    if created:
+        messages.success(request, "Ваш заказ успешно оформлен!")
+    else:
+        messages.info(request, f"Заказ #{order.id} уже оформлен")
 
     return redirect("home")
 
@@ -434,17 +400,31 @@ def admin_required(user):
     return user.is_staff
 
 
+def _orders_page(request, queryset):
+    """Страница заказов по курсору; товары заказов подгружаются одним запросом"""
+    return paginate_keyset(
+        queryset.prefetch_related('items'),
+        'newest', ORDERS_PAGE_SIZE, request.GET.get('cursor'), sort_keys=ORDER_SORT_KEYS,
+    )
+
+
 @login_required
 @user_passes_test(admin_required)
 def admin_orders(request):
-    orders = Order.objects.all().order_by('-created_at')
-    return render(request, 'orders/admin_orders.html', {'orders': orders})
+    orders = Order.objects.all()
+    status = request.GET.get('status')
+    if status in dict(Order.STATUS_CHOICES):
+        orders = orders.filter(status=status)
+    page = _orders_page(request, orders)
+    return render(request, 'orders/admin_orders.html', {
+        'orders': page, 'page_obj': page, 'status_choices': Order.STATUS_CHOICES, 'selected_status': status,
+    })
 
 
 @login_required
 def my_orders(request):
-    orders = request.user.profile.orders.all().order_by('-created_at')
-    return render(request, 'orders/my_orders.html', {'orders': orders})
+    page = _orders_page(request, request.user.profile.orders.all())
+    return render(request, 'orders/my_orders.html', {'orders': page, 'page_obj': page})
 
 
 @login_required
@@ -462,14 +442,47 @@ def process_order(request, order_id, action):
     return redirect('admin_orders')
 
 
+@login_required
+@user_passes_test(admin_required)
+def catalog_export(request):
+    """Выгрузка каталога потоком: ?format=jsonl|csv, ?since=<X-Export-Watermark прошлой выгрузки>"""
+    fmt = request.GET.get('format', 'jsonl')
+    since = export.parse_since(request.GET.get('since'))
+    if fmt not in export.FORMATS or (request.GET.get('since') and since is None):
+        return JsonResponse({'error': 'Неверный формат или since'}, status=400)
+
+    rows, deleted, watermark = export.export_queryset(since)
+    stream, content_type = export.FORMATS[fmt]
+    response = StreamingHttpResponse(
+        stream(rows, request.build_absolute_uri('/')[:-1], deleted), content_type=content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="catalog.{fmt}"'
+    if watermark is not None:
+        response['X-Export-Watermark'] = watermark.isoformat()
+    return response
+
+
+@conditional_view(price_histogram_etag, vary_on_user=False)
+def price_histogram(request):
+    """Гистограмма цен: ?category=1&category=2, без параметров — весь каталог"""
+    category_ids = parse_catalog_filters(request.GET)['category']
+    return JsonResponse({'buckets': histograms.get_histogram(category_ids)})
+
+
+@conditional_view(quick_view_etag, quick_view_last_modified, vary_on_user=False)
+@cached_page(vary_on_user=False)
 def quick_view(request, pk):
-    product = get_object_or_404(Product, pk=pk)
-    data = {
+    product = get_object_or_404(Product.objects.select_related('category'), pk=pk)
+    pagecache.add_tags(request, f'product:{product.pk}')
+    return quick_view_response(product)
+
+
+def quick_view_response(product):
+    return JsonResponse({
         "name": product.name,
         "description": product.description,
         "category": product.category.name if product.category else "",
         "price": product.price,
         "old_price": product.old_price,
         "image": product.image.url if product.image else "",
-    }
-    return JsonResponse(data)
+    })
@@ -0,0 +1,126 @@
+from array import array
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+
+from accounts.models import Profile
+
+WISHLIST_TIMEOUT = 24 * 60 * 60
+MAX_BATCH = 200
+MAX_INLINE = 200
+
+_KEY = 'wishlist:ids:{}'
+
+
+class WishlistIds:
+    """
+    Избранное профиля как отсортированный массив id: проверка — bisect,
+    в кеше — упакованные байты (4 байта на товар вместо набора объектов).
+    """
+    __slots__ = ('ids',)
+
+    def __init__(self, ids=()):
+        ids = sorted(ids)
+        self.ids = array('I' if not ids or ids[-1] < 2 ** 32 else 'Q', ids)
+
+    def __contains__(self, product_id):
+        index = bisect_left(self.ids, product_id)
+        return index < len(self.ids) and self.ids[index] == product_id
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, product_id):
+        if product_id not in self:
+            if product_id >= 2 ** 32 and self.ids.typecode == 'I':
+                self.ids = array('Q', self.ids)
+            insort(self.ids, product_id)
+
+    def discard(self, product_id):
+        index = bisect_left(self.ids, product_id)
+        if index < len(self.ids) and self.ids[index] == product_id:
+            del self.ids[index]
+
+    def pack(self):
+        return self.ids.typecode, self.ids.tobytes()
+
+    @classmethod
+    def unpack(cls, packed):
+        wishlist = cls()
+        typecode, data = packed
+        wishlist.ids = array(typecode)
+        wishlist.ids.frombytes(data)
+        return wishlist
+
+
+def _through():
+    return Profile.favorites.through
+
+
+# ----------------------
+# Чтение
+# ----------------------
+def get_ids(profile_id):
+    """WishlistIds профиля из кеша; при промахе — один запрос к таблице связей"""
+    packed = cache.get(_KEY.format(profile_id))
+    if packed is not None:
+        return WishlistIds.unpack(packed)
+    wishlist = WishlistIds(_through().objects.filter(profile_id=profile_id).values_list('product_id', flat=True))
+    cache.set(_KEY.format(profile_id), wishlist.pack(), WISHLIST_TIMEOUT)
+    return wishlist
+
+
+def favorited(profile_id, product_ids):
+    """Какие из product_ids в избранном — для страниц со списками товаров, без запросов к базе"""
+    wishlist = get_ids(profile_id)
+    return [product_id for product_id in product_ids if product_id in wishlist]
+
+
+# ----------------------
+# Изменение
+# ----------------------
+def _store(profile_id, wishlist):
+    cache.set(_KEY.format(profile_id), wishlist.pack(), WISHLIST_TIMEOUT)
+
+
+def add(profile_id, product_id):
+    # INSERT OR IGNORE: устаревший кеш не приводит к ошибке уникальности
+    _through().objects.bulk_create([_through()(profile_id=profile_id, product_id=product_id)], ignore_conflicts=True)
+    wishlist = get_ids(profile_id)
+    wishlist.add(product_id)
+    _store(profile_id, wishlist)
+    return wishlist
+
+
+def remove(profile_id, product_id):
+    # у таблицы связей нет каскадов и обработчиков удаления — delete() это один DELETE
+    _through().objects.filter(profile_id=profile_id, product_id=product_id).delete()
+    wishlist = get_ids(profile_id)
+    wishlist.discard(product_id)
+    _store(profile_id, wishlist)
+    return wishlist
+
+
+def toggle(profile_id, product_id):
+    """Добавляет или убирает товар одной записью в базу; возвращает (добавлен ли, WishlistIds)"""
+    if product_id in get_ids(profile_id):
+        return False, remove(profile_id, product_id)
+    return True, add(profile_id, product_id)
+
+
+def invalidate(*profile_ids):
+    """Для изменений в обход toggle/remove (admin, profile.favorites.add, удаление товара)"""
+    cache.delete_many([_KEY.format(profile_id) for profile_id in profile_ids])
+
+
+def parse_ids(value):
+    """id товаров из «1,2,3»; нечисловые значения пропускаются, не больше MAX_BATCH"""
+    ids = []
+    for part in (value or '').split(','):
+        part = part.strip()
+        if part.isdigit():
+            ids.append(int(part))
+    return ids[:MAX_BATCH]